@@ -0,0 +1,162 @@
+"""
+Piece images and sounds, loaded when they are first needed instead of all of them before the first frame.
+
+PieceImages decodes a piece the first time it is drawn and keeps the decoded image, and the scaled copies are kept per
+square size, so a resized window scales again from memory instead of reading the files. If Pieces/atlas.png has been
+built for the square size in use, the pieces are cut from it: one file to decode instead of twelve, and nothing to
+scale.
+
+Sounds opens the audio device and decodes the sounds on a background thread, started once the first frame is up.
+Opening the device is the slowest part of pygame's startup, and a sound asked for before it is done is skipped
+rather than waited for.
+
+python Assets.py atlas --size 128       build Pieces/atlas.png for 128 pixel squares (ChessMain's default window)
+python Assets.py bench --runs 10        time from process start to the first frame of ChessMain, cold every run
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import pygame as p
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PIECE_DIR = os.path.join(BASE_DIR, "Pieces")
+SOUND_DIR = os.path.join(BASE_DIR, "Sounds")
+ATLAS_PATH = os.path.join(PIECE_DIR, "atlas.png")
+PIECES = ['wP', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bP', 'bR', 'bN', 'bB', 'bQ', 'bK'] # left to right in the atlas
+SOUNDS = ['capture', 'move-self']
+FIRST_FRAME = "first frame" # what ChessMain --first-frame prints once the board is on screen
+
+
+class PieceImages():
+    # atlas is the path of an image with the pieces side by side in PIECES order, used when the file exists
+    def __init__(self, directory=PIECE_DIR, atlas=ATLAS_PATH):
+        self.directory = directory
+        self.atlasPath = atlas if atlas is not None and os.path.exists(atlas) else None
+        self.atlas = None
+        self.sources = {} # piece name -> decoded image at its own size
+        self.sizes = {} # square size -> ScaledPieces
+
+    def source(self, piece):
+        image = self.sources.get(piece)
+        if image is None:
+            image = self.sources[piece] = p.image.load(os.path.join(self.directory, piece + ".png"))
+        return image
+
+    # the piece cut from the atlas if the atlas was built for squares of size, else None
+    def fromAtlas(self, piece, size):
+        if self.atlasPath is None:
+            return None
+        if self.atlas is None:
+            self.atlas = p.image.load(self.atlasPath).convert_alpha()
+        if self.atlas.get_height() != size:
+            return None
+        return self.atlas.subsurface((PIECES.index(piece) * size, 0, size, size))
+
+    # the pieces for squares of size pixels, indexed by piece name like a dict
+    def forSize(self, size):
+        pieces = self.sizes.get(size)
+        if pieces is None:
+            pieces = self.sizes[size] = ScaledPieces(self, size)
+        return pieces
+
+
+class ScaledPieces():
+    def __init__(self, images, size):
+        self.images = images
+        self.size = size
+        self.surfaces = {}
+
+    # scaled and converted for the display on first use, so the display mode has to be set by then
+    def __getitem__(self, piece):
+        surface = self.surfaces.get(piece)
+        if surface is None:
+            surface = self.images.fromAtlas(piece, self.size)
+            if surface is None:
+                surface = p.transform.scale(self.images.source(piece), (self.size, self.size)).convert_alpha()
+            self.surfaces[piece] = surface
+        return surface
+
+
+class Sounds():
+    def __init__(self, names=SOUNDS, directory=SOUND_DIR):
+        self.names = names
+        self.directory = directory
+        self.sounds = {}
+        self.ready = threading.Event()
+        self.thread = None
+
+    # opens the mixer and decodes the sounds in the background
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.load, daemon=True)
+            self.thread.start()
+
+    def load(self):
+        try:
+            p.mixer.init()
+            for name in self.names:
+                self.sounds[name] = p.mixer.Sound(os.path.join(self.directory, name + ".mp3"))
+        except p.error: # no audio device, the game is played without sound
+            pass
+        self.ready.set()
+
+    def play(self, name):
+        if self.ready.is_set() and name in self.sounds:
+            self.sounds[name].play()
+
+
+# the pieces side by side, scaled for squares of size, saved as a PNG
+def buildAtlas(size, path=ATLAS_PATH, directory=PIECE_DIR):
+    atlas = p.Surface((size * len(PIECES), size), p.SRCALPHA)
+    for i, piece in enumerate(PIECES):
+        image = p.image.load(os.path.join(directory, piece + ".png"))
+        atlas.blit(p.transform.scale(image, (size, size)), (i * size, 0))
+    p.image.save(atlas, path)
+    return path
+
+# seconds from starting a new ChessMain process to its first frame, for every run
+def timeToFirstFrame(runs, extraArgs=()):
+    env = dict(os.environ)
+    if not env.get("DISPLAY") and not env.get("WAYLAND_DISPLAY"):
+        env.setdefault("SDL_VIDEODRIVER", "dummy")
+    env.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.join(BASE_DIR, "ChessMain.py"), "--first-frame"]
+                                   + list(extraArgs), stdout=subprocess.PIPE, text=True, env=env, cwd=BASE_DIR)
+        for line in process.stdout:
+            if line.strip() == FIRST_FRAME:
+                times.append(time.perf_counter() - start)
+                break
+        process.stdout.close()
+        process.wait()
+    return times
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Piece atlas and startup time of the game")
+    commands = parser.add_subparsers(dest="command", required=True)
+    atlas = commands.add_parser("atlas", help="build the piece atlas")
+    atlas.add_argument("--size", type=int, default=128, help="square size in pixels")
+    atlas.add_argument("--out", default=ATLAS_PATH)
+    bench = commands.add_parser("bench", help="time to first frame of ChessMain")
+    bench.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    if args.command == "atlas":
+        print("wrote", buildAtlas(args.size, args.out))
+        return 0
+    times = timeToFirstFrame(args.runs)
+    if not times:
+        print("ChessMain never showed a frame", file=sys.stderr)
+        return 1
+    print("time to first frame over %d runs: median %.0fms  min %.0fms  max %.0fms"
+          % (len(times), statistics.median(times) * 1000, min(times) * 1000, max(times) * 1000))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""
+Batch analysis of positions from FEN/EPD or PGN files. Input is read as a stream and handed to a process pool in
+chunks, with only a few chunks in flight at a time, so memory stays bounded however large the input is. Results are
+written as JSONL or CSV in input order as soon as each chunk is done, and a checkpoint file records how far the run
+got so an interrupted run can pick up where it stopped.
+
+python BatchAnalysis.py games.pgn --out results.jsonl --depth 3 --workers 8 --checkpoint run.json
+python BatchAnalysis.py positions.epd --out results.csv --moves      legal moves only, no search
+
+Input files ending in .pgn are read as games and every position of the main line is analysed, anything else is read
+as one FEN or EPD record per line. Files ending in .gz are decompressed on the fly and "-" reads stdin.
+"""
+import argparse
+import collections
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import ChessEngine
+import Pgn
+from Search import Searcher
+
+CSV_FIELDS = ["game", "ply", "fen", "legalMoves", "moves", "bestMove", "score", "depth", "nodes", "error"]
+
+_searcher = None # the Searcher of this worker process
+_options = None
+
+
+# yields a full FEN for every FEN or EPD line, EPD operations after the four position fields are dropped
+def readFens(lines):
+    for line in lines:
+        fields = line.split(";")[0].split()
+        if len(fields) < 4 or fields[0].startswith("#"):
+            continue
+        if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit():
+            yield " ".join(fields[:6])
+        else:
+            yield " ".join(fields[:4]) + " 0 1"
+
+# yields the records the workers analyse: ("fen", fen) or ("pgn", start fen, san moves)
+def readRecords(path, lines):
+    if path.endswith(".pgn") or path.endswith(".pgn.gz"):
+        for game in Pgn.readGames(lines):
+            yield ("pgn", game.startFen(), game.moves)
+    else:
+        for fen in readFens(lines):
+            yield ("fen", fen)
+
+
+def _initWorker(options):
+    global _searcher, _options
+    _options = options
+    _searcher = Searcher(options["hash"])
+
+def analysePosition(gs, options, searcher):
+    row = {"fen": gs.getFen()}
+    moves = gs.getValidMoveCodes()
+    row["legalMoves"] = len(moves)
+    if options["moves"]:
+        row["moves"] = [ChessEngine.Move(move).getChessNotation() for move in moves]
+    if moves and (options["depth"] or options["nodes"] or options["movetime"]):
+        result = searcher.search(gs, options["depth"] or 99, options["movetime"], options["nodes"])
+        row["bestMove"] = result.bestMove.getChessNotation()
+        row["score"] = result.score
+        row["depth"] = result.depth
+        row["nodes"] = result.nodes
+    return row
+
+# analyses one chunk of (record number, record) pairs and returns the output rows in order
+def analyseChunk(chunk, options=None, searcher=None):
+    options = options or _options
+    searcher = searcher or _searcher
+    rows = []
+    for number, record in chunk:
+        if record[0] == "fen":
+            try:
+                gs = ChessEngine.GameState(fen=record[1])
+            except (ValueError, KeyError) as e:
+                rows.append({"fen": record[1], "error": str(e)})
+                continue
+            rows.append(analysePosition(gs, options, searcher))
+            continue
+
+        game = Pgn.PgnGame({"FEN": record[1]}, record[2], "*")
+        ply = 0
+        try:
+            gs = ChessEngine.GameState(fen=record[1])
+            rows.append(dict(analysePosition(gs, options, searcher), game=number, ply=0))
+            for ply, move, gs in game.replay():
+                rows.append(dict(analysePosition(gs, options, searcher), game=number, ply=ply))
+        except (ValueError, KeyError) as e: # the rest of the game cannot be replayed
+            rows.append({"game": number, "ply": ply + 1, "error": str(e)})
+    return rows
+
+
+class JsonlWriter():
+    def __init__(self, out, resumed):
+        self.out = out
+
+    def write(self, row):
+        self.out.write(json.dumps(row) + "\n")
+
+class CsvWriter():
+    def __init__(self, out, resumed):
+        self.writer = csv.DictWriter(out, CSV_FIELDS, extrasaction="ignore")
+        if not resumed:
+            self.writer.writeheader()
+
+    def write(self, row):
+        if "moves" in row:
+            row = dict(row, moves=" ".join(row["moves"]))
+        self.writer.writerow(row)
+
+
+def loadCheckpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# written to a temporary file first so a crash never leaves a half written checkpoint
+def saveCheckpoint(path, state):
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+def _chunks(records, size):
+    while True:
+        chunk = list(itertools.islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+# Runs the whole pipeline and returns (positions written, seconds). options holds depth, nodes, movetime, moves and
+# hash as in the command line. With a checkpoint path the run resumes from it if it exists
+def runPipeline(inputPath, outputPath, options, workers=1, chunkSize=64, checkpointPath=None,
+                progressInterval=5.0, log=sys.stderr):
+    state = loadCheckpoint(checkpointPath) if checkpointPath else None
+    resumed = state is not None and os.path.exists(outputPath)
+    if not resumed:
+        state = {"records": 0, "positions": 0, "outputBytes": 0}
+
+    out = open(outputPath, "r+" if resumed else "w", newline="", encoding="utf-8")
+    # anything written after the last checkpoint is thrown away and analysed again
+    out.truncate(state["outputBytes"])
+    out.seek(state["outputBytes"])
+    writer = (CsvWriter if outputPath.endswith(".csv") else JsonlWriter)(out, resumed)
+
+    lines = Pgn.openInput(inputPath)
+    records = itertools.islice(enumerate(readRecords(inputPath, lines)), state["records"], None)
+    pool = ProcessPoolExecutor(workers, initializer=_initWorker, initargs=(options,)) if workers > 1 else None
+    searcher = Searcher(options["hash"]) if pool is None else None
+    pending = collections.deque()
+    start = lastReport = time.perf_counter()
+    positions = 0
+
+    def finish(chunk, rows):
+        nonlocal positions, lastReport
+        for row in rows:
+            writer.write(row)
+        positions += len(rows)
+        out.flush()
+        state["records"] = chunk[-1][0] + 1
+        state["positions"] += len(rows)
+        state["outputBytes"] = out.tell()
+        if checkpointPath:
+            saveCheckpoint(checkpointPath, state)
+        now = time.perf_counter()
+        if log is not None and now - lastReport >= progressInterval:
+            lastReport = now
+            print("%d positions, %.1f positions/sec" % (state["positions"], positions / (now - start)), file=log)
+
+    try:
+        for chunk in _chunks(records, chunkSize):
+            if pool is None:
+                finish(chunk, analyseChunk(chunk, options, searcher))
+                continue
+            pending.append((chunk, pool.submit(analyseChunk, chunk)))
+            # a couple of chunks queued per worker keeps them busy without reading the whole input ahead
+            while len(pending) >= workers * 2:
+                chunk, future = pending.popleft()
+                finish(chunk, future.result())
+        while pending:
+            chunk, future = pending.popleft()
+            finish(chunk, future.result())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        out.close()
+        if lines is not sys.stdin:
+            lines.close()
+
+    seconds = time.perf_counter() - start
+    if log is not None:
+        print("done: %d positions in %.1fs, %.1f positions/sec" % (positions, seconds,
+              positions / seconds if seconds > 0 else 0), file=log)
+    return positions, seconds
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyse every position of a FEN/EPD or PGN file")
+    parser.add_argument("input", help="file to read, - for stdin")
+    parser.add_argument("--out", required=True, help="results file, .csv for CSV, anything else for JSONL")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--depth", type=int, default=0, help="search depth, 0 for no search")
+    parser.add_argument("--nodes", type=int, default=None, help="search node limit per position")
+    parser.add_argument("--movetime", type=float, default=None, help="search seconds per position")
+    parser.add_argument("--moves", action="store_true", help="list the legal moves of every position")
+    parser.add_argument("--hash", type=int, default=16, help="transposition table MB per worker")
+    parser.add_argument("--chunk", type=int, default=64, help="records per task sent to a worker")
+    parser.add_argument("--checkpoint", default=None, help="file to record progress in and resume from")
+    args = parser.parse_args(argv)
+
+    options = {"depth": args.depth, "nodes": args.nodes, "movetime": args.movetime, "moves": args.moves,
+               "hash": args.hash}
+    runPipeline(args.input, args.out, options, args.workers, args.chunk, args.checkpoint)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Precomputed bitboard tables for the GameState backend. Squares are numbered 0-63 in the same order as the 8x8 board
+list, so square = row * 8 + col, bit 0 is a8 and bit 63 is h1.
+Sliding attacks use the magic bitboard layout (relevant occupancy mask per square) but let a dict do the hashing
+instead of a magic multiply, and each entry is only computed the first time it is looked up so importing stays cheap.
+"""
+FULL = 0xFFFFFFFFFFFFFFFF
+NOT_FILE_A = 0xFEFEFEFEFEFEFEFE
+NOT_FILE_H = 0x7F7F7F7F7F7F7F7F
+ROW_2 = 0xFF << 16 # row 2 (rank 6), where black pawns land after a single push from their start row
+ROW_5 = 0xFF << 40 # row 5 (rank 3), where white pawns land after a single push from their start row
+LAST_ROWS = 0xFF | 0xFF << 56 # rows 0 and 7 (ranks 8 and 1), where pawns promote
+
+WHITE, BLACK = 0, 1
+
+# piece indexes into GameState.pieces, white pieces first then black, '--' marks an empty square
+PIECES = ['wP', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bP', 'bN', 'bB', 'bR', 'bQ', 'bK']
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+EMPTY = 12
+PIECE_NAMES = PIECES + ['--']
+PIECE_INDEX = {name: i for i, name in enumerate(PIECE_NAMES)}
+
+ROOK_DIRS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+BISHOP_DIRS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+
+SQUARE_BITS = [1 << sq for sq in range(64)]
+
+
+# index of the lowest set bit, b must not be 0
+def bitScan(b):
+    return (b & -b).bit_length() - 1
+
+# yields the square index of every set bit from lowest to highest
+def squares(b):
+    while b:
+        lsb = b & -b
+        yield lsb.bit_length() - 1
+        b ^= lsb
+
+def popCount(b):
+    return bin(b).count('1')
+
+
+def _stepAttacks(offsets):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        attacks = 0
+        for dr, dc in offsets:
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                attacks |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(attacks)
+    return table
+
+KNIGHT_ATTACKS = _stepAttacks([(2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2)])
+KING_ATTACKS = _stepAttacks([(dr, dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1) if dr or dc])
+# PAWN_ATTACKS[color][sq] is the set of squares a pawn of that color on sq captures on, white moves towards row 0
+PAWN_ATTACKS = [_stepAttacks([(-1, -1), (-1, 1)]), _stepAttacks([(1, -1), (1, 1)])]
+
+
+# walks every direction from sq until the edge of the board or the first blocker, blockers are included
+def slidingAttacks(sq, occupied, dirs):
+    r0, c0 = divmod(sq, 8)
+    attacks = 0
+    for dr, dc in dirs:
+        r, c = r0 + dr, c0 + dc
+        while 0 <= r < 8 and 0 <= c < 8:
+            bit = 1 << (r * 8 + c)
+            attacks |= bit
+            if occupied & bit:
+                break
+            r += dr
+            c += dc
+    return attacks
+
+# squares whose occupancy can change the attacks from sq, the last square of each ray never blocks anything
+def _relevantMask(sq, dirs):
+    r, c = divmod(sq, 8)
+    mask = 0
+    for dr, dc in dirs:
+        row, col = r + dr, c + dc
+        while 0 <= row + dr < 8 and 0 <= col + dc < 8:
+            mask |= 1 << (row * 8 + col)
+            row += dr
+            col += dc
+    return mask
+
+
+class _AttackTable(dict):
+    # maps masked occupancy to the attack set for one square, filled in on first use
+    def __init__(self, sq, dirs):
+        super().__init__()
+        self.sq = sq
+        self.dirs = dirs
+
+    def __missing__(self, occupied):
+        attacks = self[occupied] = slidingAttacks(self.sq, occupied, self.dirs)
+        return attacks
+
+ROOK_MASKS = [_relevantMask(sq, ROOK_DIRS) for sq in range(64)]
+BISHOP_MASKS = [_relevantMask(sq, BISHOP_DIRS) for sq in range(64)]
+ROOK_TABLES = [_AttackTable(sq, ROOK_DIRS) for sq in range(64)]
+BISHOP_TABLES = [_AttackTable(sq, BISHOP_DIRS) for sq in range(64)]
+
+def rookAttacks(sq, occupied):
+    return ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]]
+
+def bishopAttacks(sq, occupied):
+    return BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]]
+
+def queenAttacks(sq, occupied):
+    return ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]] | BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]]
+
+def _betweenTable():
+    table = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        r0, c0 = divmod(sq, 8)
+        for dr, dc in ROOK_DIRS + BISHOP_DIRS:
+            r, c = r0 + dr, c0 + dc
+            between = 0
+            while 0 <= r < 8 and 0 <= c < 8:
+                table[sq][r * 8 + c] = between
+                between |= 1 << (r * 8 + c)
+                r += dr
+                c += dc
+    return table
+
+# BETWEEN[a][b] holds the squares strictly between a and b when they share a rank, file or diagonal, otherwise 0
+BETWEEN = _betweenTable()
@@ -1,14 +1,36 @@
 """
 This class is responsible for storing all of the information about the current state of a chess game. It will also be 
 responsible for determining the valid moves and keeping a move log.
-Can use numpy arrays to make this faster
+The position is kept in bitboards (see Bitboards.py), self.board is a read only 8x8 view of them.
+All the rules are played: castling, en passant and promotion, and checkmate, stalemate, the fifty move rule,
+threefold repetition and insufficient material end the game (see gameResult).
 """
-import copy
+import re
+from Bitboards import *
+from Zobrist import PIECE_KEYS, SIDE_KEY, CASTLING_KEYS, EP_KEYS
+from Evaluation import PST_MG, PST_EG, PHASE_WEIGHTS, pieceSquareSums
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+UCI_PATTERN = re.compile(r"^([a-h])([1-8])([a-h])([1-8])([nbrq])?$")
+
+# rights that stay after a move from or to each square, moving a king or rook or capturing a rook loses them
+CASTLING_MASKS = [15] * 64
+CASTLING_MASKS[0], CASTLING_MASKS[4], CASTLING_MASKS[7] = 15 ^ 8, 15 ^ 12, 15 ^ 4 # a8, e8, h8
+CASTLING_MASKS[56], CASTLING_MASKS[60], CASTLING_MASKS[63] = 15 ^ 2, 15 ^ 3, 15 ^ 1 # a1, e1, h1
+# per color (right, king start, king end, rook start, squares that must be empty, squares the king crosses)
+CASTLING_MOVES = [[(1, 60, 62, 63, 1 << 61 | 1 << 62, (61, 62)),
+                   (2, 60, 58, 56, 1 << 57 | 1 << 58 | 1 << 59, (59, 58))],
+                  [(4, 4, 6, 7, 1 << 5 | 1 << 6, (5, 6)),
+                   (8, 4, 2, 0, 1 << 1 | 1 << 2 | 1 << 3, (3, 2))]]
+CASTLING_ROOKS = {62: (63, 61), 58: (56, 59), 6: (7, 5), 2: (0, 3)} # king end square -> rook start and end squares
+
 class GameState():
-    def __init__(self, test=False):
-        # 8x8 2D List 
+    checkHash = False # debug mode, recompute the hash from scratch after every move and compare
+
+    def __init__(self, test=False, fen=None):
+        # 8x8 2D List used to set up the bitboards, self.board is rebuilt from the bitboards after this
         if test:
-            self.board = [
+            board = [
             ["--", "--", "--", "--", "bK", "--", "--", "--"],
             ["--", "--", "--", "--", "bR", "--", "--", "--"],
             ["--", "--", "--", "--", "--", "--", "--", "--"],
@@ -18,7 +40,7 @@ class GameState():
             ["--", "--", "--", "--", "wR", "--", "--", "--"],
             ["--", "--", "--", "--", "wK", "--", "--", "--"]]
         else:
-            self.board = [
+            board = [
                 ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
                 ["bP", "bP", "bP", "bP", "bP", "bP", "bP", "bP"],
                 ["--", "--", "--", "--", "--", "--", "--", "--"],
@@ -27,40 +49,214 @@ class GameState():
                 ["--", "--", "--", "--", "--", "--", "--", "--"],
                 ["wP", "wP", "wP", "wP", "wP", "wP", "wP", "wP"],
                 ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]]
-        
-        """
-        self.whitePieces = [Rook(), Knight(), Bishop(), Queen(), King(), Bishop(), Knight(), Rook(),
-                            Pawn(), Pawn(), Pawn(), Pawn(), Pawn(), Pawn(), Pawn(), Pawn()]
-        self.blackPieces = [Rook(), Knight(), Bishop(), Queen(), King(), Bishop(), Knight(), Rook(),
-                            Pawn(), Pawn(), Pawn(), Pawn(), Pawn(), Pawn(), Pawn(), Pawn()]"""
+        self.loadBoard(board)
         
         self.whiteToMove = True
         self.moveLog = []
         self.friendly = {True : 'w', False : 'b'} # index this dict with self.whiteToMove
 
-        # Bools for castling conditions
-        self.whiteKingMoved = False
-        self.blackKingMoved = False
-        self.longWhiteRookMoved = False
-        self.shortWhiteRookMoved = False
-        self.longBlackRookMoved = False
-        self.shortBlackRookMoved = False
+        # castling rights still available: 1 white short, 2 white long, 4 black short, 8 black long
+        self.castling = 0 if test else 15
         self.whiteKingInCheck = False
         self.blackKingInCheck = False
 
-        # King Locations for checks
-        self.whiteKingLoc = (7, 4)
-        self.blackKingLoc = (0, 4)
-    
-    def kingMove(self, r, c):
-        if self.whiteToMove:
-            print("Moving white King to:", r, c)
-            self.whiteKingLoc = (r, c)
-            self.whiteKingMoved = True
+        # square a pawn skipped over with its last double push, None if the last move was not one
+        self.enPassantSq = None
+        self.halfmoveClock = 0 # plies since the last capture or pawn move, for the fifty move rule
+        self.firstPly = 0 # plies played before the position the game was set up from, counted from move 1 white
+        # One entry per move in moveLog with what makeMove cannot work out backwards: the castling rights, en passant
+        # square and halfmove clock packed into an int (the captured piece is part of the move code), and the hash
+        # of the position before the move, which also serves to find repetitions
+        self.undoLog = []
+        self.hashLog = []
+
+        if fen is not None:
+            self.loadFen(fen)
+        self.hashKey = self.computeHash()
+
+    # sets up the position from a FEN string, the game history starts over from it
+    def loadFen(self, fen):
+        fields = fen.split()
+        if len(fields) < 2:
+            raise ValueError("Invalid FEN: " + fen)
+        rows = fields[0].split('/')
+        if len(rows) != 8:
+            raise ValueError("Invalid FEN: " + fen)
+        board = []
+        for row in rows:
+            boardRow = []
+            for ch in row:
+                if ch.isdigit():
+                    boardRow.extend(["--"] * int(ch))
+                elif ch.upper() in "PNBRQK":
+                    boardRow.append(('w' if ch.isupper() else 'b') + ch.upper())
+                else:
+                    raise ValueError("Invalid FEN: " + fen)
+            if len(boardRow) != 8:
+                raise ValueError("Invalid FEN: " + fen)
+            board.append(boardRow)
+        whiteToMove = fields[1] == 'w'
+        castling = fields[2] if len(fields) > 2 else '-'
+        ep = fields[3] if len(fields) > 3 else '-'
+        fullmove = int(fields[5]) if len(fields) > 5 and fields[5].isdigit() else 1
+        self.setPosition([PIECE_INDEX[piece] for row in board for piece in row], whiteToMove,
+                         sum(1 << bit for bit, flag in enumerate("KQkq") if flag in castling),
+                         None if ep == '-' else Move.ranksToRows[ep[1]] * 8 + Move.filesToCols[ep[0]],
+                         int(fields[4]) if len(fields) > 4 and fields[4].isdigit() else 0,
+                         (max(fullmove, 1) - 1) * 2 + (not whiteToMove))
+
+    # sets up the position from the piece index on every square (a8 first) and the state FEN holds besides the
+    # pieces, the game history starts over from it
+    def setPosition(self, squares, whiteToMove, castling, enPassantSq, halfmoveClock, firstPly):
+        self.loadSquares(squares)
+        self.whiteToMove = whiteToMove
+        self.castling = castling
+        self.enPassantSq = enPassantSq
+        self.halfmoveClock = halfmoveClock
+        self.firstPly = firstPly
+        self.moveLog = []
+        self.undoLog = []
+        self.hashLog = []
+        self.hashKey = self.computeHash()
+
+    # FEN of the current position
+    def getFen(self):
+        rows = []
+        for row in self.board:
+            text = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                text += piece[1] if piece[0] == 'w' else piece[1].lower()
+            rows.append(text + (str(empty) if empty else ""))
+        rights = self.castlingRights()
+        castling = "".join(flag for bit, flag in enumerate("KQkq") if rights >> bit & 1) or "-"
+        ep = "-"
+        if self.enPassantSq is not None:
+            ep = Move.colsToFiles[self.enPassantSq & 7] + Move.rowsToRanks[self.enPassantSq >> 3]
+        fullmove = (self.firstPly + len(self.moveLog)) // 2 + 1
+        return "%s %s %s %s %d %d" % ("/".join(rows), 'w' if self.whiteToMove else 'b', castling, ep,
+                                      self.halfmoveClock, fullmove)
+
+    # finds the legal move written in standard algebraic notation (e.g. "Nf3", "exd5", "R1e2+", "O-O", "e8=Q"),
+    # raises ValueError if there is no such move or it is ambiguous
+    def moveFromSan(self, san):
+        text = san.rstrip("+#!?")
+        if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+            for move in self.getValidMoveCodes():
+                if move & MOVE_FLAGS == CASTLE and ((move >> 6) & 7 == 6) == (len(text) == 3):
+                    return Move(move)
+            raise ValueError("Illegal move: " + san)
+        match = SAN_PATTERN.match(text)
+        if match is None:
+            raise ValueError("Invalid move: " + san)
+        pieceLetter, fromFile, fromRank, target, promotion = match.groups()
+        piece = "PNBRQK".index(pieceLetter or 'P') + self.side() * 6
+        end = Move.ranksToRows[target[1]] * 8 + Move.filesToCols[target[0]]
+        promoted = "PNBRQK".index(promotion) + self.side() * 6 if promotion else EMPTY
+        candidates = []
+        for move in self.getValidMoveCodes():
+            if (move >> 12) & 15 != piece or (move >> 6) & 63 != end or move & MOVE_FLAGS == CASTLE:
+                continue
+            if fromFile is not None and move & 7 != Move.filesToCols[fromFile]:
+                continue
+            if fromRank is not None and (move & 63) >> 3 != Move.ranksToRows[fromRank]:
+                continue
+            if promotedPiece(move) != promoted:
+                continue
+            candidates.append(move)
+        if len(candidates) != 1:
+            raise ValueError(("Illegal move: " if not candidates else "Ambiguous move: ") + san)
+        return Move(candidates[0])
+
+    # standard algebraic notation of a legal move in this position, with the file or rank of the start square added
+    # only when another piece of the same kind could go to the same square, and + or # when it gives check or mate
+    def moveToSan(self, move):
+        start, end, piece = move & 63, (move >> 6) & 63, (move >> 12) & 15
+        toName = Move.colsToFiles[end & 7] + Move.rowsToRanks[end >> 3]
+        if move & MOVE_FLAGS == CASTLE:
+            san = "O-O" if end & 7 == 6 else "O-O-O"
+        elif piece % 6 == PAWN:
+            san = Move.colsToFiles[start & 7] + "x" + toName if start & 7 != end & 7 else toName
+            promoted = promotedPiece(move)
+            if promoted != EMPTY:
+                san += "=" + "PNBRQK"[promoted % 6]
         else:
-            print("Moving black King to:", r, c)
-            self.blackKingLoc = (r, c)
-            self.blackKingMovd = True
+            others = [other & 63 for other in self.getValidMoveCodes() if (other >> 12) & 15 == piece and (other >> 6) & 63 == end
+                      and other & 63 != start]
+            origin = ""
+            if others:
+                if all(sq & 7 != start & 7 for sq in others):
+                    origin = Move.colsToFiles[start & 7]
+                elif all(sq >> 3 != start >> 3 for sq in others):
+                    origin = Move.rowsToRanks[start >> 3]
+                else:
+                    origin = Move.colsToFiles[start & 7] + Move.rowsToRanks[start >> 3]
+            capture = "x" if (move >> 16) & 15 != EMPTY else ""
+            san = "PNBRQK"[piece % 6] + origin + capture + toName
+        self.makeMove(move)
+        if self.inCheck():
+            san += "#" if not self.getValidMoveCodes() else "+"
+        self.undoMove()
+        return san
+
+    # finds the legal move written in UCI long algebraic notation (e.g. "e2e4", "e7e8q"), raises ValueError if there
+    # is no such move
+    def moveFromUci(self, uci):
+        match = UCI_PATTERN.match(uci)
+        if match is None:
+            raise ValueError("Invalid move: " + uci)
+        start = Move.ranksToRows[match.group(2)] * 8 + Move.filesToCols[match.group(1)]
+        end = Move.ranksToRows[match.group(4)] * 8 + Move.filesToCols[match.group(3)]
+        for move in self.getValidMoveCodes():
+            if move & 0xFFF == start | end << 6 and Move(move).promotion == match.group(5):
+                return Move(move)
+        raise ValueError("Illegal move: " + uci)
+
+    # sets up the bitboards from an 8x8 list of piece strings
+    def loadBoard(self, board):
+        self.loadSquares([PIECE_INDEX[piece] for row in board for piece in row])
+
+    # sets up the bitboards from a list of the piece index on every square, EMPTY where there is none
+    def loadSquares(self, squares):
+        self.pieces = [0] * 12 # one bitboard per piece, indexed like Bitboards.PIECES
+        self.squares = list(squares) # piece index on every square, EMPTY if nothing is there
+        for sq, piece in enumerate(self.squares):
+            if piece != EMPTY:
+                self.pieces[piece] |= 1 << sq
+        self.updateOccupancy()
+        # material and piece-square sums for Evaluation, kept up to date by makeMove and undoMove
+        self.pstMg, self.pstEg, self.phase = pieceSquareSums(self.pieces)
+
+    def updateOccupancy(self):
+        self.occupancy = [0, 0] # all white pieces, all black pieces
+        for piece in range(6):
+            self.occupancy[WHITE] |= self.pieces[piece]
+            self.occupancy[BLACK] |= self.pieces[piece + 6]
+        self.occupied = self.occupancy[WHITE] | self.occupancy[BLACK]
+        self._board = None
+
+    # read only 8x8 view of the position, rebuilt lazily after the position changes
+    @property
+    def board(self):
+        if self._board is None:
+            names = [PIECE_NAMES[piece] for piece in self.squares]
+            self._board = tuple(tuple(names[r * 8:r * 8 + 8]) for r in range(8))
+        return self._board
+
+    # King Locations for checks
+    @property
+    def whiteKingLoc(self):
+        return divmod(bitScan(self.pieces[KING]), 8) if self.pieces[KING] else None
+
+    @property
+    def blackKingLoc(self):
+        return divmod(bitScan(self.pieces[KING + 6]), 8) if self.pieces[KING + 6] else None
 
     def isKing(self, r, c):
         return (self.whiteToMove and self.whiteKingLoc == (r, c)) or (not self.whiteToMove and self.blackKingLoc == (r, c))
@@ -68,25 +264,204 @@ class GameState():
     def isEnemyKing(self, r, c):
         return (self.whiteToMove and self.blackKingLoc == (r, c)) or (not self.whiteToMove and self.whiteKingLoc == (r, c))
     
-    def makeMove(self, move):
-        if self.isKing(move.startRow, move.startCol):
-            self.kingMove(move.endRow, move.endCol)
+    # moves a piece between two squares in the bitboards and the square list, piece is captured on end if not EMPTY
+    def movePieceBits(self, start, end, piece, captured):
+        startBit, endBit = 1 << start, 1 << end
+        self.pieces[piece] ^= startBit | endBit
+        self.squares[start] = EMPTY
+        self.squares[end] = piece
+        color = piece // 6
+        self.occupancy[color] ^= startBit | endBit
+        self.pstMg += PST_MG[piece][end] - PST_MG[piece][start]
+        self.pstEg += PST_EG[piece][end] - PST_EG[piece][start]
+        if captured != EMPTY:
+            self.pieces[captured] ^= endBit
+            self.occupancy[1 - color] ^= endBit
+            self.pstMg -= PST_MG[captured][end]
+            self.pstEg -= PST_EG[captured][end]
+            self.phase -= PHASE_WEIGHTS[captured]
+        self.occupied = self.occupancy[WHITE] | self.occupancy[BLACK]
+        self._board = None
+
+    # puts piece on the empty square sq
+    def addPiece(self, sq, piece):
+        bit = 1 << sq
+        self.pieces[piece] |= bit
+        self.squares[sq] = piece
+        self.occupancy[piece // 6] |= bit
+        self.occupied |= bit
+        self.pstMg += PST_MG[piece][sq]
+        self.pstEg += PST_EG[piece][sq]
+        self.phase += PHASE_WEIGHTS[piece]
+        self._board = None
 
-        self.board[move.startRow][move.startCol] = '--'
-        self.board[move.endRow][move.endCol] = move.pieceMoved
+    # takes piece off sq
+    def removePiece(self, sq, piece):
+        bit = 1 << sq
+        self.pieces[piece] ^= bit
+        self.squares[sq] = EMPTY
+        self.occupancy[piece // 6] ^= bit
+        self.occupied ^= bit
+        self.pstMg -= PST_MG[piece][sq]
+        self.pstEg -= PST_EG[piece][sq]
+        self.phase -= PHASE_WEIGHTS[piece]
+        self._board = None
+
+    # bitmask of the castling rights still available: 1 white short, 2 white long, 4 black short, 8 black long
+    def castlingRights(self):
+        return self.castling
+
+    # key of the en passant file if the side to move has a pawn that could capture on enPassantSq, otherwise 0
+    def enPassantKey(self):
+        sq = self.enPassantSq
+        if sq is None:
+            return 0
+        side = self.side()
+        if PAWN_ATTACKS[1 - side][sq] & self.pieces[PAWN + side * 6]:
+            return EP_KEYS[sq & 7]
+        return 0
+
+    # Zobrist key of the position built from scratch, makeMove and undoMove keep self.hashKey up to date incrementally
+    def computeHash(self):
+        key = 0
+        for piece in range(12):
+            for sq in squares(self.pieces[piece]):
+                key ^= PIECE_KEYS[piece][sq]
+        if not self.whiteToMove:
+            key ^= SIDE_KEY
+        return key ^ CASTLING_KEYS[self.castlingRights()] ^ self.enPassantKey()
+
+    def verifyHash(self):
+        assert self.hashKey == self.computeHash(), "incremental hash does not match the position"
+
+    # move can be a Move or a packed move code from getValidMoveCodes
+    def makeMove(self, move):
+        start, end = move & 63, (move >> 6) & 63
+        piece, captured = (move >> 12) & 15, (move >> 16) & 15
+        ep = self.enPassantSq
+        self.undoLog.append(self.castling | (64 if ep is None else ep) << 4 | self.halfmoveClock << 11)
+        self.hashLog.append(self.hashKey)
         self.moveLog.append(move) # add move to move log to keep history and potentially undo moves
+        key = self.hashKey ^ self.enPassantKey() ^ PIECE_KEYS[piece][start] ^ SIDE_KEY
+
+        if not move & MOVE_FLAGS:
+            self.movePieceBits(start, end, piece, captured)
+            key ^= PIECE_KEYS[piece][end]
+            if captured != EMPTY:
+                key ^= PIECE_KEYS[captured][end]
+        elif move & PROMOTION:
+            promoted = promotedPiece(move)
+            self.movePieceBits(start, end, piece, captured)
+            self.removePiece(end, piece)
+            self.addPiece(end, promoted)
+            key ^= PIECE_KEYS[promoted][end]
+            if captured != EMPTY:
+                key ^= PIECE_KEYS[captured][end]
+        elif move & MOVE_FLAGS == EN_PASSANT:
+            taken = end + 8 if piece == PAWN else end - 8 # the pawn that double pushed past end
+            self.movePieceBits(start, end, piece, EMPTY)
+            self.removePiece(taken, captured)
+            key ^= PIECE_KEYS[piece][end] ^ PIECE_KEYS[captured][taken]
+        else: # castling, the king's move is followed by the rook's
+            rookStart, rookEnd = CASTLING_ROOKS[end]
+            rook = piece - KING + ROOK
+            self.movePieceBits(start, end, piece, EMPTY)
+            self.movePieceBits(rookStart, rookEnd, rook, EMPTY)
+            key ^= PIECE_KEYS[piece][end] ^ PIECE_KEYS[rook][rookStart] ^ PIECE_KEYS[rook][rookEnd]
 
+        rights = self.castling & CASTLING_MASKS[start] & CASTLING_MASKS[end]
+        if rights != self.castling:
+            key ^= CASTLING_KEYS[self.castling] ^ CASTLING_KEYS[rights]
+            self.castling = rights
+        if piece == PAWN or piece == PAWN + 6:
+            self.halfmoveClock = 0
+            self.enPassantSq = (start + end) // 2 if abs(end - start) == 16 else None
+        else:
+            self.halfmoveClock = 0 if captured != EMPTY else self.halfmoveClock + 1
+            self.enPassantSq = None
+        self.whiteToMove = not self.whiteToMove
+        self.hashKey = key ^ self.enPassantKey()
+        if self.checkHash:
+            self.verifyHash()
+
+    # takes back the last move, everything makeMove changed comes back from the move code and the undo log
     def undoMove(self):
-        if (not len(self.moveLog)):
-            print("Warning: Cannot undo move with no moves made")
+        if not self.moveLog: # nothing to take back
             return
         
-        move = self.moveLog[len(self.moveLog) - 1]
-        if self.isKing(move.endRow, move.endCol):
-            self.kingMove(move.startRow, move.startCol)
-        self.board[move.endRow][move.endCol] = move.pieceCaptured
-        self.board[move.startRow][move.startCol] = move.pieceMoved
-        del self.moveLog[len(self.moveLog) - 1]
+        move = self.moveLog.pop()
+        state = self.undoLog.pop()
+        start, end = move & 63, (move >> 6) & 63
+        piece, captured = (move >> 12) & 15, (move >> 16) & 15
+        self.whiteToMove = not self.whiteToMove
+
+        if not move & MOVE_FLAGS:
+            # moving the piece back puts it on start, the captured piece goes back on end afterwards
+            self.movePieceBits(end, start, piece, EMPTY)
+            if captured != EMPTY:
+                self.addPiece(end, captured)
+        elif move & PROMOTION:
+            self.removePiece(end, promotedPiece(move))
+            self.addPiece(start, piece)
+            if captured != EMPTY:
+                self.addPiece(end, captured)
+        elif move & MOVE_FLAGS == EN_PASSANT:
+            self.movePieceBits(end, start, piece, EMPTY)
+            self.addPiece(end + 8 if piece == PAWN else end - 8, captured)
+        else:
+            rookStart, rookEnd = CASTLING_ROOKS[end]
+            self.movePieceBits(rookEnd, rookStart, piece - KING + ROOK, EMPTY)
+            self.movePieceBits(end, start, piece, EMPTY)
+
+        self.castling = state & 15
+        ep = (state >> 4) & 127
+        self.enPassantSq = None if ep == 64 else ep
+        self.halfmoveClock = state >> 11
+        self.hashKey = self.hashLog.pop()
+        if self.checkHash:
+            self.verifyHash()
+
+    # True if the position occurred at least times times before since the last capture or pawn move. Only every
+    # second earlier position can match, the same side has to be to move
+    def isRepetition(self, times=1):
+        key = self.hashKey
+        log = self.hashLog
+        count = 0
+        for i in range(len(log) - 4, max(len(log) - self.halfmoveClock, 0) - 1, -2):
+            if log[i] == key:
+                count += 1
+                if count >= times:
+                    return True
+        return False
+
+    def isThreefoldRepetition(self):
+        return self.isRepetition(2)
+
+    def isFiftyMoveRule(self):
+        return self.halfmoveClock >= 100
+
+    # neither side has the material left to mate: bare kings, or a single knight or bishop against a bare king
+    def isInsufficientMaterial(self):
+        pieces = self.pieces
+        if pieces[PAWN] or pieces[PAWN + 6] or pieces[ROOK] or pieces[ROOK + 6] or pieces[QUEEN] or pieces[QUEEN + 6]:
+            return False
+        return popCount(self.occupied) <= 3
+
+    def isCheckmate(self):
+        return self.inCheck() and not self.getValidMoveCodes()
+
+    def isStalemate(self):
+        return not self.inCheck() and not self.getValidMoveCodes()
+
+    # "1-0", "0-1" or "1/2-1/2" once the game is over, None while it is not
+    def gameResult(self):
+        if not self.getValidMoveCodes():
+            if not self.inCheck():
+                return "1/2-1/2"
+            return "0-1" if self.whiteToMove else "1-0"
+        if self.isFiftyMoveRule() or self.isThreefoldRepetition() or self.isInsufficientMaterial():
+            return "1/2-1/2"
+        return None
 
     # returns true if coord pair is within the 8x8 board
     def validCoords(self, r, c):
@@ -98,22 +473,28 @@ class GameState():
     
     # returns True if the square is currently empty
     def isEmpty(self, r, c) -> bool:
-        return self.board[r][c] == "--"
+        return not self.occupied >> (r * 8 + c) & 1
     
     # returns True if square contains a friendly piece, otherwise False
     def isFriendly(self, r, c) -> bool:
-        return self.board[r][c][0] == self.friendly[self.whiteToMove]
+        return bool(self.occupancy[self.side()] >> (r * 8 + c) & 1)
     
     # returns True if square contains an enemy piece, otherwise False
     def isEnemy(self, r, c):
-        return self.board[r][c][0] == self.friendly[not self.whiteToMove]
+        return bool(self.occupancy[1 - self.side()] >> (r * 8 + c) & 1)
+
+    # index of the side to move into self.occupancy, WHITE or BLACK
+    def side(self):
+        return WHITE if self.whiteToMove else BLACK
     
     def getValidMovesPiece(self, r, c):
-        return self.getAllMovesPiece(r, c)
+        sq = r * 8 + c
+        return [Move(move) for move in self.getValidMoveCodes() if move & 63 == sq]
     
+    # the per piece generators below append packed move codes, this wraps them in Move objects
     def getAllMovesPiece(self, r, c):
         moves = []
-        if not self.isFriendly:
+        if not self.isFriendly(r, c):
             return moves
         
         piece = self.board[r][c][1]
@@ -129,183 +510,251 @@ class GameState():
             self.getQueenMoves(r, c, moves)
         elif piece == 'K':
             self.getKingMoves(r, c, moves)
-        return moves
+        return list(map(Move, moves))
     
-    # Have to loop through all possible moves and see if any of them expose the current King to a check
     def getValidMoves(self):
-        allMoves = self.getAllMoves()
-        invalidMoveList = []
-        print("allMoves len:", len(allMoves))
-        
-        for move in allMoves:
-            self.makeMove(move)
-            self.whiteToMove = not self.whiteToMove
-            oppAllMoves = self.getAllMoves()
-
-            for oppMove in oppAllMoves:
-                if self.isEnemyKing(oppMove.endRow, oppMove.endCol):
-                    print("invalid move")
-                    print("player move:", move.startRow, move.startCol, "->", move.endRow, move.endCol)
-                    print("opp move:", oppMove.startRow, oppMove.startCol, "->", oppMove.endRow, oppMove.endCol)
-                    invalidMoveList.append(move)
-                    break
-            self.whiteToMove = not self.whiteToMove
-            self.undoMove()
-            print("#" * 30)
-        
-        for move in invalidMoveList:
-            allMoves.remove(move)
-        return allMoves
+        return list(map(Move, self.getValidMoveCodes()))
 
     def getAllMoves(self):
-        moves = []
-        for r in range(len(self.board)):
-            for c in range(len(self.board[r])):
-                turn = self.board[r][c][0]
-                
-                if (turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):
-                    piece = self.board[r][c][1]
-                    
-                    if piece == 'P':
-                        self.getPawnMoves(r, c, moves)
-                    elif piece == 'R':
-                        self.getRookMoves(r, c, moves)
-                    elif piece == 'B':
-                        self.getBishopMoves(r, c, moves)
-                    elif piece == 'N':
-                        self.getKnightMoves(r, c, moves)
-                    elif piece == 'Q':
-                        self.getQueenMoves(r, c, moves)
-                    elif piece == 'K':
-                        self.getKingMoves(r, c, moves)
-        #for move in moves:
-            #print("valid:", move.getChessNotation())
+        return list(map(Move, self.getAllMoveCodes()))
+
+    # Legal moves for the side to move. Checkers and pinned pieces are worked out once for the position, so only king
+    # moves still need their destination tested for attacks.
+    # Fills moves with packed move codes, pass the same list in again to reuse it instead of allocating a new one.
+    # capturesOnly leaves out every move that does not capture a piece
+    def getValidMoveCodes(self, moves=None, capturesOnly=False):
+        side = self.side()
+        kingBB = self.pieces[KING + side * 6]
+        if not kingBB:
+            return self.getAllMoveCodes(moves)
+        if moves is None:
+            moves = []
+        else:
+            del moves[:]
+        kingSq = bitScan(kingBB)
+        checkers = self.attackersTo(kingSq, self.occupied, 1 - side)
+        mask = self.occupancy[1 - side] if capturesOnly else FULL
+        self.getLegalKingMoves(kingSq, moves, mask)
+        if self.castling and not checkers and not capturesOnly:
+            self.getCastlingMoves(kingSq, moves)
+        if self.enPassantSq is not None:
+            self.getEnPassantMoves(kingSq, moves)
+        if checkers & (checkers - 1): # double check, only the king can move
+            return moves
+
+        # when in check every other piece has to capture the checker or block it
+        if checkers:
+            mask &= BETWEEN[kingSq][bitScan(checkers)] | checkers
+        self.generateMoves(moves, mask, self.pinnedPieces(kingSq, side))
         return moves
-    
-    def getPawnMoves(self, r, c, moves):
+
+    # pseudo legal moves for the side to move, one bitboard per piece type instead of scanning all 64 squares
+    def getAllMoveCodes(self, moves=None):
+        if moves is None:
+            moves = []
+        else:
+            del moves[:]
+        side = self.side()
+        self.generateMoves(moves, FULL, {})
+        for sq in squares(self.pieces[KING + side * 6]):
+            self.addMoves(sq, KING_ATTACKS[sq] & ~self.occupancy[side], moves)
+        if self.enPassantSq is not None:
+            self.getEnPassantMoves(None, moves)
+        return moves
+
+    # appends moves for every piece except the king that end on a square in mask. pinned maps the square of each
+    # pinned piece to the line it is allowed to move along
+    def generateMoves(self, moves, mask, pinned):
+        side = self.side()
+        offset = side * 6
+        pieces = self.pieces
+        occupied = self.occupied
+        targetMask = ~self.occupancy[side] & mask
+
+        pawns = pieces[PAWN + offset]
+        for sq in pinned:
+            if pawns >> sq & 1:
+                pawns ^= 1 << sq
+                self.getPawnMovesBits(1 << sq, moves, mask & pinned[sq])
+        self.getPawnMovesBits(pawns, moves, mask)
+        for sq in squares(pieces[KNIGHT + offset]):
+            if sq not in pinned: # a pinned knight can never stay on the pin line
+                self.addMoves(sq, KNIGHT_ATTACKS[sq] & targetMask, moves)
+        for sq in squares(pieces[BISHOP + offset]):
+            self.addMoves(sq, bishopAttacks(sq, occupied) & targetMask & pinned.get(sq, FULL), moves)
+        for sq in squares(pieces[ROOK + offset]):
+            self.addMoves(sq, rookAttacks(sq, occupied) & targetMask & pinned.get(sq, FULL), moves)
+        for sq in squares(pieces[QUEEN + offset]):
+            self.addMoves(sq, queenAttacks(sq, occupied) & targetMask & pinned.get(sq, FULL), moves)
+
+    # king moves to squares the enemy does not attack, the king is taken off the board first so it cannot hide
+    # behind itself from a slider
+    def getLegalKingMoves(self, kingSq, moves, mask=FULL):
+        side = self.side()
+        occupied = self.occupied ^ (1 << kingSq)
+        targets = KING_ATTACKS[kingSq] & ~self.occupancy[side] & mask
+        for sq in squares(targets):
+            if self.attackersTo(sq, occupied, 1 - side):
+                targets ^= 1 << sq
+        self.addMoves(kingSq, targets, moves)
+
+    # castling moves for the side to move, which must not be in check. The rook has to be on its square, the squares
+    # between it and the king empty and the squares the king crosses not attacked
+    def getCastlingMoves(self, kingSq, moves):
+        side = self.side()
+        rook = ROOK + side * 6
+        occupied = self.occupied
+        for right, kingStart, kingEnd, rookStart, between, crossed in CASTLING_MOVES[side]:
+            if not self.castling & right or kingSq != kingStart or not self.pieces[rook] >> rookStart & 1:
+                continue
+            if occupied & between or any(self.attackersTo(sq, occupied, 1 - side) for sq in crossed):
+                continue
+            moves.append(kingStart | kingEnd << 6 | (KING + side * 6) << 12 | EMPTY << 16 | CASTLE)
+
+    # En passant captures onto enPassantSq. Each one is played out on the occupancy and the king checked for attacks,
+    # taking two pawns off one rank can uncover an attack the pin detection does not see. kingSq None skips that test
+    def getEnPassantMoves(self, kingSq, moves):
+        ep = self.enPassantSq
+        side = self.side()
+        pawn, enemyPawn = PAWN + side * 6, PAWN + (1 - side) * 6
+        taken = ep + 8 if side == WHITE else ep - 8
+        if self.squares[taken] != enemyPawn:
+            return
+        takenBit = 1 << taken
+        for sq in squares(PAWN_ATTACKS[1 - side][ep] & self.pieces[pawn]):
+            if kingSq is not None:
+                occupied = (self.occupied ^ (1 << sq) ^ takenBit) | (1 << ep)
+                if self.attackersTo(kingSq, occupied, 1 - side) & ~takenBit:
+                    continue
+            moves.append(sq | ep << 6 | pawn << 12 | enemyPawn << 16 | EN_PASSANT)
+
+    # bitboard of the pieces of color that attack sq with the given occupancy
+    def attackersTo(self, sq, occupied, color):
+        pieces = self.pieces
+        offset = color * 6
+        queens = pieces[QUEEN + offset]
+        return ((PAWN_ATTACKS[1 - color][sq] & pieces[PAWN + offset])
+                | (KNIGHT_ATTACKS[sq] & pieces[KNIGHT + offset])
+                | (KING_ATTACKS[sq] & pieces[KING + offset])
+                | (bishopAttacks(sq, occupied) & (pieces[BISHOP + offset] | queens))
+                | (rookAttacks(sq, occupied) & (pieces[ROOK + offset] | queens)))
+
+    # returns True if the king of the side to move is attacked
+    def inCheck(self):
+        side = self.side()
+        kingBB = self.pieces[KING + side * 6]
+        return bool(kingBB) and bool(self.attackersTo(bitScan(kingBB), self.occupied, 1 - side))
+
+    # maps each friendly piece pinned to the king on kingSq to the squares between the king and the pinning piece,
+    # including the pinning piece itself
+    def pinnedPieces(self, kingSq, side):
+        pieces = self.pieces
+        offset = (1 - side) * 6
+        queens = pieces[QUEEN + offset]
+        snipers = ((rookAttacks(kingSq, 0) & (pieces[ROOK + offset] | queens))
+                   | (bishopAttacks(kingSq, 0) & (pieces[BISHOP + offset] | queens)))
+        pinned = {}
+        for sniper in squares(snipers):
+            between = BETWEEN[kingSq][sniper] & self.occupied
+            if between and not between & (between - 1) and between & self.occupancy[side]:
+                pinned[bitScan(between)] = BETWEEN[kingSq][sniper] | (1 << sniper)
+        return pinned
+
+    # appends a move from sq to every square set in targets
+    def addMoves(self, sq, targets, moves):
+        squareList = self.squares
+        base = sq | squareList[sq] << 12
+        while targets:
+            lsb = targets & -targets
+            end = lsb.bit_length() - 1
+            moves.append(base | end << 6 | squareList[end] << 16)
+            targets ^= lsb
+
+    # generates pushes and captures for every pawn in pawns at once, a pawn reaching the last row promotes to any of
+    # the four pieces
+    def getPawnMovesBits(self, pawns, moves, mask=FULL):
+        pawn = PAWN + self.side() * 6
+        quiet = pawn << 12 | EMPTY << 16
+        empty = ~self.occupied & FULL
         if self.whiteToMove:
-            if r <= 0:
-                return
-            # check forward move
-            if self.board[r-1][c] == "--":
-                moves.append(Move((r,c), (r-1, c), self.board))
-                # check double forward move
-                if r == 6 and self.board[r-2][c] == "--":
-                    moves.append(Move((r,c), (r-2, c), self.board))
-
-            # check left capture
-            if c > 0 and self.board[r-1][c-1][0] == 'b':
-                moves.append(Move((r,c), (r-1, c-1), self.board))
-            # check right capture
-            if c < 7 and self.board[r-1][c+1][0] == 'b':
-                moves.append(Move((r,c), (r-1, c+1), self.board))
-
-                             
-        elif not self.whiteToMove:
-            # check forward move
-            if r >= 7:
-                return
-            if self.board[r+1][c] == "--":
-                moves.append(Move((r,c), (r+1, c), self.board))
-                # check double forward move
-                if r == 1 and self.board[r+2][c] == "--":
-                    moves.append(Move((r,c), (r+2, c), self.board))
-            
-            # check right capture
-            if c > 0 and self.board[r+1][c-1][0] == 'w':
-                moves.append(Move((r,c), (r+1, c-1), self.board))
-            # check left capture
-            if c < 7 and self.board[r+1][c+1][0] == 'w':
-                moves.append(Move((r,c), (r+1, c+1), self.board))
+            single = (pawns >> 8) & empty
+            double = ((single & ROW_5) >> 8) & empty
+            step = 8
+            enemy = self.occupancy[BLACK] & mask
+        else:
+            single = (pawns << 8) & empty
+            double = ((single & ROW_2) << 8) & empty
+            step = -8
+            enemy = self.occupancy[WHITE] & mask
 
+        # a double push has to pass the empty square in front, the mask only applies to where the pawn lands
+        for end in squares(single & mask & ~LAST_ROWS):
+            moves.append(quiet | (end + step) | end << 6)
+        for end in squares(single & mask & LAST_ROWS):
+            move = quiet | (end + step) | end << 6
+            for promotion in PROMOTIONS:
+                moves.append(move | promotion)
+        for end in squares(double & mask):
+            moves.append(quiet | (end + 2 * step) | end << 6)
+        attacks = PAWN_ATTACKS[self.side()]
+        squareList = self.squares
+        for sq in squares(pawns):
+            targets = attacks[sq] & enemy
+            if not targets:
+                continue
+            if not targets & LAST_ROWS:
+                self.addMoves(sq, targets, moves)
+                continue
+            for end in squares(targets):
+                move = sq | end << 6 | pawn << 12 | squareList[end] << 16
+                for promotion in PROMOTIONS:
+                    moves.append(move | promotion)
+    
+    def getPawnMoves(self, r, c, moves):
+        self.getPawnMovesBits(1 << (r * 8 + c), moves)
 
     def getRookMoves(self, r, c, moves):
-        # check up
-        self.checkDir((1, 0), r, c, moves)
-        # check down
-        self.checkDir((-1, 0), r, c, moves)
-        # check left
-        self.checkDir((0, 1), r, c, moves)
-        # check right
-        self.checkDir((0, -1), r, c, moves)
+        sq = r * 8 + c
+        self.addMoves(sq, rookAttacks(sq, self.occupied) & ~self.occupancy[self.side()], moves)
 
     def getBishopMoves(self, r, c, moves):
-        # check up, right
-        self.checkDir((1, 1), r, c, moves)
-        # check up, left
-        self.checkDir((1, -1), r, c, moves)
-        # check down, right
-        self.checkDir((-1, 1), r, c, moves)
-        # check dowm, left
-        #print("moves before:")
-        #for move in moves:
-        #    print(move.getChessNotation())
-        self.checkDir((-1, -1), r, c, moves)
-        #print("moves after:")
-        #for move in moves:
-        #    print(move.getChessNotation())
-
-    #BUGGED
-    def getKnightMoves(self, r, c, moves):
-        moveList = [(2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2)]
+        sq = r * 8 + c
+        self.addMoves(sq, bishopAttacks(sq, self.occupied) & ~self.occupancy[self.side()], moves)
 
-        for m in moveList:
-            if not self.validCoords(r + m[0], c + m[1]):
-                continue
-            if not self.isFriendly(r + m[0], c + m[1]):
-                moves.append(Move((r, c), (r + m[0], c + m[1]), self.board))
+    def getKnightMoves(self, r, c, moves):
+        sq = r * 8 + c
+        self.addMoves(sq, KNIGHT_ATTACKS[sq] & ~self.occupancy[self.side()], moves)
 
     def getQueenMoves(self, r, c, moves):
-        # check up
-        self.checkDir((1, 0), r, c, moves)
-        # check down
-        self.checkDir((-1, 0), r, c, moves)
-        # check left
-        self.checkDir((0, 1), r, c, moves)
-        # check right
-        self.checkDir((0, -1), r, c, moves)
-        # check up, right
-        self.checkDir((1, 1), r, c, moves)
-        # check up, left
-        self.checkDir((1, -1), r, c, moves)
-        # check down, right
-        self.checkDir((-1, 1), r, c, moves)
-        # check dowm, left
-        self.checkDir((-1, -1), r, c, moves)
-
+        sq = r * 8 + c
+        self.addMoves(sq, queenAttacks(sq, self.occupied) & ~self.occupancy[self.side()], moves)
 
     def getKingMoves(self, r, c, moves):
-        moveDirs = [-1, 0, 1]
-        for yDir in moveDirs:
-            for xDir in moveDirs:
-                # cannot move in no direction
-                if xDir == yDir == 0:
-                    continue
-                if not self.validCoords(r + yDir, c + xDir) or self.isFriendly(r + yDir, c + xDir):
-                    continue
-                moves.append(Move((r, c), (r + yDir, c + xDir), self.board))
-
-
-    # check dir gets passed a tuple to check until end of board in that direction(inversed), (1, 0) in increasing row direction, (1, 1) check diagonal
-    def checkDir(self, dir, r, c, moves):
-        row, col = r, c
-        vert, horz = dir[0], dir[1]
-        while(row + vert >= 0 and row + vert <= 7 and col + horz >= 0 and col + horz <= 7):
-            # ran into empty square
-            if self.isEmpty(row + vert, col + horz):
-                moves.append(Move((r,c), (row+vert, col+horz), self.board))
-            # ran into enemy piece
-            elif self.isEnemy(row + vert, col + horz):
-                moves.append(Move((r,c), (row+vert, col+horz), self.board))
-                break
-            # ran into friendly piece
-            else:
-                break
-            row += vert
-            col += horz
-
-
-class Move():
+        sq = r * 8 + c
+        self.addMoves(sq, KING_ATTACKS[sq] & ~self.occupancy[self.side()], moves)
+
+
+# Moves are packed into an int: start square in bits 0-5, end square in bits 6-11, piece moved in bits 12-15, piece
+# captured (EMPTY if none) in bits 16-19 and the flags below in bits 20-23, squares and pieces numbered like in
+# Bitboards.py. Move generation works with the plain ints, Move wraps one for callers that want rows, columns and
+# notation
+MOVE_FLAGS = 15 << 20 # one of the values below, or 0 for any other move
+EN_PASSANT = 1 << 20 # the captured pawn is beside the start square, not on the end square
+CASTLE = 2 << 20 # a king move two squares sideways, the rook is moved by makeMove
+PROMOTION = 4 << 20 # only set for promotions, bits 20-21 then hold the promoted piece type less KNIGHT
+PROMOTIONS = [PROMOTION | (kind - KNIGHT) << 20 for kind in (QUEEN, KNIGHT, ROOK, BISHOP)]
+
+def encodeMove(start, end, pieceMoved, pieceCaptured):
+    return start | end << 6 | pieceMoved << 12 | pieceCaptured << 16
+
+# piece index a promotion move leaves on its end square, EMPTY for any other move
+def promotedPiece(move):
+    if not move & PROMOTION:
+        return EMPTY
+    return KNIGHT + ((move >> 20) & 3) + ((move >> 12) & 15) // 6 * 6
+
+class Move(int):
+    __slots__ = ()
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4,
                    "5": 3, "6": 2, "7": 1, "8": 0}
     rowsToRanks = {v: k for k, v in ranksToRows.items()}
@@ -313,24 +762,61 @@ class Move():
                    "d": 3, "c": 2, "b": 1, "a": 0}
     colsToFiles = {v: k for k, v in filesToCols.items()}
     
-    def __init__(self, startSq, endSq, board):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = copy.deepcopy(board[self.startRow][self.startCol])
-        self.pieceCaptured = copy.deepcopy(board[self.endRow][self.endCol])
+    # Move(startSq, endSq, board) looks the pieces up on the board, Move(code) wraps an already packed move
+    def __new__(cls, startSq, endSq=None, board=None):
+        if endSq is None:
+            return int.__new__(cls, startSq)
+        return int.__new__(cls, encodeMove(startSq[0] * 8 + startSq[1], endSq[0] * 8 + endSq[1],
+                                           PIECE_INDEX[board[startSq[0]][startSq[1]]],
+                                           PIECE_INDEX[board[endSq[0]][endSq[1]]]))
+
+    @property
+    def startRow(self):
+        return (self & 63) >> 3
 
+    @property
+    def startCol(self):
+        return self & 7
+
+    @property
+    def endRow(self):
+        return (self >> 9) & 7
+
+    @property
+    def endCol(self):
+        return (self >> 6) & 7
+
+    @property
+    def pieceMoved(self):
+        return PIECE_NAMES[(self >> 12) & 15]
+
+    @property
+    def pieceCaptured(self):
+        return PIECE_NAMES[(self >> 16) & 15]
+
+    @property
+    def isCastle(self):
+        return self & MOVE_FLAGS == CASTLE
+
+    @property
+    def isEnPassant(self):
+        return self & MOVE_FLAGS == EN_PASSANT
+
+    # lowercase letter of the piece a pawn promotes to, None if the move is not a promotion
+    @property
+    def promotion(self):
+        piece = promotedPiece(self)
+        return None if piece == EMPTY else PIECE_NAMES[piece][1].lower()
+
+    # long algebraic notation as UCI writes it, e.g. e2e4, e1g1 for castling and e7e8q
     def getChessNotation(self):
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        return (self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+                + (self.promotion or ""))
 
     def getRankFile(self, r ,c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
-    
-    def __eq__(self, other):
-        if type(self) != type(other):
-            return False
-        return (self.startRow == other.startRow and self.startCol == other.startCol and self.endRow == other.endRow
-                and self.endCol == other.endCol and self.pieceMoved == other.pieceMoved and self. pieceCaptured == other.pieceCaptured)
-    
-    
\ No newline at end of file
+
+    def __repr__(self):
+        return "Move(" + self.getChessNotation() + ")"
+
+    __str__ = __repr__
@@ -2,54 +2,70 @@
 Main driver file. It handles user input displaying the current game state
 """
 
+import argparse
+import logging
+import time
 import pygame as p
+import Assets
 import ChessEngine
+import EngineWorker
+import Instrumentation
+import MoveCache
+import Renderer
 
 WIDTH = HEIGHT = 1024
 DIMENSION = 8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 165
-IMAGES = {}
-SOUNDS = {}
-
-"""
-Initialize a global directory of images. This will be called exactly once in the main
-"""
-
-def loadImages():
-    pieces = ['wP', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bP', 'bR', 'bN', 'bB', 'bQ', 'bK']
-    for piece in pieces:
-        IMAGES[piece] = p.image.load("Pieces/" + piece + ".png")
-        IMAGES[piece] = p.transform.scale(IMAGES[piece], (SQ_SIZE, SQ_SIZE))
-
-def loadSounds():
-    sounds = ['capture', 'move-self']
-    for sound in sounds:
-        SOUNDS[sound] = p.mixer.Sound("Sounds/" + sound + ".mp3")
-
-def main():
-    p.init()
-    screen = p.display.set_mode((WIDTH, HEIGHT))
+IDLE_POLL_MS = 50 # while nothing happens the loop sleeps until input arrives, waking this often to poll the worker
+AI_THINK_TIME = 1.0 # seconds the engine gets per move
+
+# statsPath turns on Instrumentation for this process (rendering, makeMove) and gets its stats when the game is closed.
+# firstFrame ends the game as soon as the board is on screen, for timing the startup (see Assets.py bench).
+# archivePath is a GameArchive the game is appended to when it is reset or closed, loadGame the index of a game in it
+# to carry on from, after loadPly plies or at its end
+def main(aiPlayers=(), bookPath=None, statsPath=None, firstFrame=False, archivePath=None, loadGame=None, loadPly=None):
+    if statsPath is not None:
+        Instrumentation.enable()
+    # only what the first frame needs, the mixer is opened in the background once the board is up (Assets.Sounds)
+    p.display.init()
+    p.font.init()
+    screen = p.display.set_mode((WIDTH, HEIGHT), p.RESIZABLE)
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
-    gs = ChessEngine.GameState()
-    loadImages() # loading image files, only do this once
-    loadSounds() # loading sounds files, only do once
+    gs = loadGameState(archivePath, loadGame, loadPly) if loadGame is not None else ChessEngine.GameState()
+    images = Assets.PieceImages() # pieces are decoded when first drawn and kept scaled per square size
+    sounds = Assets.Sounds()
+    sqSize = SQ_SIZE
+    worker = EngineWorker.EngineWorker(bookPath=bookPath) # move generation and engine replies run here, off the event loop
+    renderer = Renderer.BoardRenderer(screen, images.forSize(sqSize), sqSize, DIMENSION)
     running = True
-    sqSelected = () # keep track of the square selected by the last click of the user, tuple(row, col)
     playerClicks = [] # keep track of player clicks (two tuples: [(6, 4), (4, 4)])
-    validMoves = gs.getValidMoves()
-    moveMade = False
+    moveCache = MoveCache.MoveCache() # positions seen before, e.g. after an undo, do not wait for the worker
+    validMoves = MoveCache.NO_MOVES # a MoveList, filled in once the worker replies
+    moveMade = True # asks the worker for the first position's moves
     activePiece = ()
+    waited = [] # the event that ended an idle wait
 
     while running:
-        for e in p.event.get():
+        humanTurn = gs.friendly[gs.whiteToMove] not in aiPlayers
+        events = waited + p.event.get()
+        for e in events:
             if e.type == p.QUIT:
                 running = False
-            elif e.type == p.MOUSEBUTTONDOWN and e.button == 1:
+            elif e.type == p.VIDEOEXPOSE:
+                renderer.invalidate()
+            elif e.type == p.VIDEORESIZE: # the board fills the smaller side, pieces already decoded are only rescaled
+                screen = p.display.get_surface()
+                screen.fill(p.Color("white"))
+                sqSize = max(min(e.w, e.h) // DIMENSION, 1)
+                renderer = Renderer.BoardRenderer(screen, images.forSize(sqSize), sqSize, DIMENSION)
+            elif e.type == p.MOUSEBUTTONDOWN and e.button == 1 and humanTurn:
                 location = p.mouse.get_pos() # (x, y) location of the mouse
-                col = location[0]//SQ_SIZE
-                row = location[1]//SQ_SIZE
+                col = location[0]//sqSize
+                row = location[1]//sqSize
+                if not gs.validCoords(row, col): # beside the board in a window that is not square
+                    continue
                 
                 if playerClicks == [] and gs.selectWrongSquare(row, col):
                     continue
@@ -57,107 +73,141 @@ def main():
                 if playerClicks == []:               
                     activePiece = (row, col)
                     playerClicks.append((row, col))
-                    print(activePiece)
 
                 elif len(playerClicks) == 1:
                     playerClicks.append((row, col))
 
                 if len(playerClicks) == 2: # after 2nd click
-                    move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board)
-                    print(move.getChessNotation())
-                    if move in validMoves:
-                        movePiece(gs, move)
+                    move = findMove(validMoves, playerClicks[0], playerClicks[1])
+                    if move is not None:
+                        movePiece(gs, move, sounds)
                         moveMade = True
                     playerClicks = []
 
             # release piece    
-            elif e.type == p.MOUSEBUTTONUP and e.button == 1:
+            elif e.type == p.MOUSEBUTTONUP and e.button == 1 and humanTurn:
                 if activePiece == ():
                     continue
 
                 location = p.mouse.get_pos() # (x, y) location of the mouse
-                col = location[0]//SQ_SIZE
-                row = location[1]//SQ_SIZE
+                col = location[0]//sqSize
+                row = location[1]//sqSize
                 if activePiece[0] == row and activePiece[1] == col: # player clicked on piece, is not drag and dropping
                     activePiece = ()
                     continue
                 
                 else:
-                    move = ChessEngine.Move(activePiece, (row, col), gs.board)
-                    if move in validMoves:
-                        movePiece(gs, move) # need to implement
+                    move = findMove(validMoves, activePiece, (row, col))
+                    if move is not None:
+                        movePiece(gs, move, sounds)
                         moveMade = True
                         playerClicks = []
                         activePiece = ()
 
-            elif e.type == p.KEYDOWN and p.K_z:
+            elif e.type == p.KEYDOWN and e.key == p.K_z:
+                worker.cancel() # anything the worker was doing is for the position being undone
                 gs.undoMove()
+                playerClicks = []
+                activePiece = ()
                 moveMade = True
 
-            elif e.type == p.KEYDOWN and p.K_r:
+            elif e.type == p.KEYDOWN and e.key == p.K_r:
+                worker.cancel()
+                saveGame(archivePath, gs, aiPlayers)
                 gs = ChessEngine.GameState(test=True)
                 playerClicks = []
-                validMoves = gs.getValidMoves()
-                moveMade = False
+                moveMade = True
                 activePiece = ()
 
+        for kind, result in worker.poll():
+            if kind == "moves":
+                key, codes = result
+                moves = moveCache.store(key, codes)
+                if key == gs.hashKey:
+                    validMoves = moves
+            elif kind == "search" and result[0] is not None:
+                movePiece(gs, ChessEngine.Move(result[0]), sounds)
+                moveMade = True
 
         if moveMade:
-            gs.whiteToMove = not gs.whiteToMove
-            validMoves = gs.getValidMoves()
+            validMoves = moveCache.lookup(gs.hashKey)
+            if validMoves is None:
+                validMoves = MoveCache.NO_MOVES
+                worker.requestMoves(gs)
+            if gs.friendly[gs.whiteToMove] in aiPlayers:
+                worker.requestSearch(gs, time=AI_THINK_TIME)
             moveMade = False
         
-        drawGameState(screen, gs, playerClicks, activePiece)
-        clock.tick(MAX_FPS)
-        p.display.flip()
-
-def drawGameState(screen, gs, playerClicks, activePiece):
-    drawBoard(screen) # draw squares on the board
-    # add in piece highlighting, move suggestions
-    if len(playerClicks) == 1:
-        highlightSquare(screen, playerClicks[0][0], playerClicks[0][1])
-        moveSuggestions(screen, gs, playerClicks[0][0], playerClicks[0][1])
-    drawPieces(gs, screen, gs.board, activePiece)
-
-def highlightSquare(screen, r, c):
-    p.draw.rect(screen, p.Color("green"), p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-def moveSuggestions(screen, gs, r, c):
-    moves = gs.getValidMovesPiece(r, c)
-    for move in moves:
-        row, col = move.endRow, move.endCol
-        center = ((col+1) * SQ_SIZE - SQ_SIZE//2, (row+1) * SQ_SIZE - SQ_SIZE//2 )
-        p.draw.circle(screen, p.Color("black"), center, SQ_SIZE//8)
-        #p.draw.rect(screen, p.Color("green"), p.Rect(col * SQ_SIZE, row * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-
-def drawBoard(screen):
-    colors = [p.Color(211, 182, 131), p.Color(43, 29, 20)]
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            color = colors[((r+c) % 2)]
-            p.draw.rect(screen, color, p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-def drawPieces(gs, screen, board, activePiece):
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece == "--" or activePiece == (r,c):
-                continue
-            screen.blit(IMAGES[piece], p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-    if activePiece != () and gs.isFriendly(activePiece[0], activePiece[1]):
-        pos = p.mouse.get_pos()
-        pieceRect = p.Rect(pos[0], pos[1], SQ_SIZE, SQ_SIZE)
-        pieceRect.center = pos
-        screen.blit(IMAGES[board[activePiece[0]][activePiece[1]]], pieceRect)
-
-def movePiece(gs, move):
-    print("valid move")
-    if gs.isEnemy(move.endRow, move.endCol):
-        p.mixer.Sound.play(SOUNDS['capture'])
-    p.mixer.Sound.play(SOUNDS['move-self'])
+        rects = drawGameState(renderer, gs, playerClicks, activePiece, validMoves, worker.isBusy("search"))
+        if rects:
+            p.display.update(rects)
+            if firstFrame:
+                print(Assets.FIRST_FRAME, flush=True)
+                running = False
+            sounds.start() # the mixer opens once the board is up, later calls do nothing
+        if events or rects:
+            clock.tick(MAX_FPS)
+            waited = []
+        else:
+            event = p.event.wait(IDLE_POLL_MS)
+            waited = [event] if event.type != p.NOEVENT else []
+    worker.close()
+    if not firstFrame:
+        saveGame(archivePath, gs, aiPlayers)
+    if statsPath is not None:
+        Instrumentation.logStats()
+        Instrumentation.dump(statsPath)
+        logging.info("move cache %s", moveCache.stats())
+
+# only the squares that changed since the last frame are drawn, returns their rects
+def drawGameState(renderer, gs, playerClicks, activePiece, validMoves, thinking):
+    selected = playerClicks[0] if len(playerClicks) == 1 else None
+    suggestions = [(move.endRow, move.endCol) for move in validMoves.fromSquare(*selected)] if selected else []
+    dragged = activePiece if activePiece != () and gs.isFriendly(activePiece[0], activePiece[1]) else None
+    return renderer.render(gs.board, selected, suggestions, dragged, p.mouse.get_pos(), thinking)
+
+# the legal move from start to end (row, col), None if there is none. Pawns reaching the last row become queens
+def findMove(validMoves, start, end):
+    for move in validMoves.fromSquare(*start): # promotions are generated queen first
+        if (move.endRow, move.endCol) == end:
+            return move
+    return None
+
+# appends the game to the archive at path, unless there is no archive or no move was played
+def saveGame(path, gs, aiPlayers):
+    if path is None or not gs.moveLog:
+        return
+    import GameArchive # only loaded when games are stored, it is not needed to play
+    headers = {"Event": "Casual game", "Site": "ChessMain", "Date": time.strftime("%Y.%m.%d"),
+               "White": "Engine" if 'w' in aiPlayers else "Human", "Black": "Engine" if 'b' in aiPlayers else "Human"}
+    GameArchive.appendGames(path, [GameArchive.packGameState(gs, headers)])
+    logging.info("game saved to %s", path)
+
+# the position of a stored game after ply plies, or at its end. All of its moves are played so they can be undone
+def loadGameState(path, index, ply=None):
+    import GameArchive
+    with GameArchive.GameArchive(path) as archive:
+        game = archive[index]
+        return game.position(len(game) if ply is None else ply, fromStart=True)
+
+def movePiece(gs, move, sounds):
+    if move.pieceCaptured != "--":
+        sounds.play('capture')
+    sounds.play('move-self')
     gs.makeMove(move)
             
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Play chess")
+    parser.add_argument("--ai", choices=["w", "b", "wb"], default="", help="colors played by the engine")
+    parser.add_argument("--book", default=None, help="opening book the engine plays from, see OpeningBook.py")
+    parser.add_argument("--stats", default=None, help="instrument the game and write its stats to this JSON file")
+    parser.add_argument("--first-frame", action="store_true", help="quit once the board is drawn, to time startup")
+    parser.add_argument("--archive", default=None, help="GameArchive file the game is appended to when it ends")
+    parser.add_argument("--load", type=int, default=None, help="carry on with this game of the archive")
+    parser.add_argument("--ply", type=int, default=None, help="plies into the loaded game, its end if left out")
+    args = parser.parse_args()
+    if args.load is not None and args.archive is None:
+        parser.error("--load needs --archive")
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    main(args.ai, args.book, args.stats, args.first_frame, args.archive, args.load, args.ply)
\ No newline at end of file
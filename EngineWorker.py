@@ -0,0 +1,97 @@
+"""
+Runs legal move generation and engine searches in a separate process so the pygame loop never waits on them. Requests
+are tagged with a generation number; cancel() bumps it, which makes a running search stop at its next check and
+every older result get dropped, so an undo or reset never sees a reply for a position that is gone.
+"""
+import copy
+import multiprocessing
+import queue
+
+
+class _StaleFlag():
+    # stands in for Searcher.stopFlag, reads as set once the request is no longer the latest one
+    def __init__(self, generation, current):
+        self.generation = generation
+        self.current = current
+
+    def __getitem__(self, i):
+        return self.current.value != self.generation
+
+def _workerLoop(requests, results, current, hashMb, bookPath):
+    # imported here, in the worker, so the game window does not wait for the engine modules to load
+    from OpeningBook import OpeningBook
+    from Search import Searcher
+    searcher = Searcher(hashMb)
+    book = OpeningBook(bookPath) if bookPath else None
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        generation, kind, gs, limits = request
+        if current.value != generation:
+            continue # cancelled before it was started
+        if kind == "moves":
+            results.put((generation, kind, (gs.hashKey, gs.getValidMoveCodes())))
+        elif kind == "search":
+            move = book.choose(gs) if book is not None else None
+            if move is not None: # no need to search a position the book knows
+                results.put((generation, kind, (int(move), 0, 0, [int(move)])))
+                continue
+            searcher.stopFlag = _StaleFlag(generation, current)
+            result = searcher.search(gs, limits.get("depth", 99), limits.get("time"), limits.get("nodes"))
+            if current.value == generation:
+                pv = [int(move) for move in result.pv]
+                results.put((generation, kind, (pv[0] if pv else None, result.score, result.depth, pv)))
+
+
+class EngineWorker():
+    # bookPath is an OpeningBook file the engine plays from while the position is in it
+    def __init__(self, hashMb=16, bookPath=None):
+        self.requests = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.current = multiprocessing.Value('i', 0, lock=False) # latest generation, written only by this process
+        self.pending = set() # kinds of request still waiting for a result
+        self.process = multiprocessing.Process(target=_workerLoop, args=(self.requests, self.results, self.current,
+                                                                         hashMb, bookPath), daemon=True)
+        self.process.start()
+
+    # asks for the legal move codes of gs, the reply comes back through poll()
+    def requestMoves(self, gs):
+        self.submit("moves", gs, {})
+
+    # asks for an engine move, limits may hold depth, time (seconds) and nodes
+    def requestSearch(self, gs, **limits):
+        self.submit("search", gs, limits)
+
+    def submit(self, kind, gs, limits):
+        self.pending.add(kind)
+        # the queue pickles in a background thread, so it gets a copy the caller cannot change in the meantime
+        self.requests.put((self.current.value, kind, copy.deepcopy(gs), limits))
+
+    # drops every request made so far and stops a search that is running
+    def cancel(self):
+        self.current.value += 1
+        self.pending.clear()
+
+    def isBusy(self, kind=None):
+        return bool(self.pending) if kind is None else kind in self.pending
+
+    # returns the (kind, result) replies that arrived since the last call without waiting. moves results are the
+    # position's hash key and its list of move codes, search results are (best move code, score, depth, pv codes)
+    def poll(self):
+        replies = []
+        while True:
+            try:
+                generation, kind, result = self.results.get_nowait()
+            except queue.Empty:
+                return replies
+            if generation == self.current.value:
+                self.pending.discard(kind)
+                replies.append((kind, result))
+
+    def close(self):
+        self.cancel()
+        self.requests.put(None)
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
@@ -0,0 +1,369 @@
+"""
+Static evaluation: material and piece-square tables blended between middlegame and endgame by the material left,
+plus mobility, pawn structure and king safety. Scores are centipawns.
+
+evaluate(gs) scores one GameState, using the material and piece-square sums that makeMove/undoMove keep up to date.
+evaluateBatch(boards) scores an (N, 12, 64) array of piece planes (see encode) with NumPy, a few microseconds per
+position instead of a Python loop each, and gives exactly the same numbers. NumPy is only needed for the batch
+functions.
+
+python Evaluation.py positions.epd     score every FEN/EPD line in batches and print the positions per second
+"""
+import argparse
+import sys
+import time
+from Bitboards import *
+
+np = None # numpy, imported by the batch functions on first use so evaluate() alone starts fast
+
+MATERIAL_MG = [100, 320, 330, 500, 900, 0]
+MATERIAL_EG = [120, 300, 330, 520, 950, 0]
+PHASE_WEIGHTS = [0, 1, 1, 2, 4, 0] * 2 # 24 with all the pieces on the board, 0 with only kings and pawns
+MAX_PHASE = 24
+
+# piece-square tables from white's point of view, laid out like the board: index 0 is a8 and 63 is h1
+PAWN_TABLE = [
+      0,   0,   0,   0,   0,   0,   0,   0,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     10,  10,  20,  30,  30,  20,  10,  10,
+      5,   5,  10,  25,  25,  10,   5,   5,
+      0,   0,   0,  20,  20,   0,   0,   0,
+      5,  -5, -10,   0,   0, -10,  -5,   5,
+      5,  10,  10, -20, -20,  10,  10,   5,
+      0,   0,   0,   0,   0,   0,   0,   0]
+KNIGHT_TABLE = [
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50]
+BISHOP_TABLE = [
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20]
+ROOK_TABLE = [
+      0,   0,   0,   0,   0,   0,   0,   0,
+      5,  10,  10,  10,  10,  10,  10,   5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+      0,   0,   0,   5,   5,   0,   0,   0]
+QUEEN_TABLE = [
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+     -5,   0,   5,   5,   5,   5,   0,  -5,
+      0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20]
+KING_TABLE_MG = [
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+     20,  20,   0,   0,   0,   0,  20,  20,
+     20,  30,  10,   0,   0,  10,  30,  20]
+KING_TABLE_EG = [
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10,   0,   0, -10, -20, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -30,   0,   0,   0,   0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50]
+
+# material plus piece-square value of every piece on every square, positive for white and negative for black, so
+# the sum over the pieces on the board is the score from white's point of view
+def _pieceSquareValues(material, kingTable):
+    tables = [PAWN_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE, QUEEN_TABLE, kingTable]
+    values = [[material[piece] + tables[piece][sq] for sq in range(64)] for piece in range(6)]
+    values += [[-values[piece][sq ^ 56] for sq in range(64)] for piece in range(6)] # black sees the board flipped
+    return values
+
+PST_MG = _pieceSquareValues(MATERIAL_MG, KING_TABLE_MG)
+PST_EG = _pieceSquareValues(MATERIAL_EG, KING_TABLE_EG)
+
+MOBILITY_WEIGHTS = [0, 4, 4, 2, 1, 0] # per square a piece attacks that is not taken by its own side
+DOUBLED_PAWN = -10 # per pawn beyond the first on a file
+ISOLATED_PAWN = -15
+PASSED_PAWN = [0, 5, 10, 20, 35, 60, 100, 0] # by ranks advanced from the pawn's own back rank
+SHIELD_NEAR, SHIELD_FAR = 10, 5 # own pawns one and two rows in front of the king, on its file and the two next to it
+TROPISM_WEIGHTS = [0, 2, 1, 2, 4, 0] # per enemy piece, times how close it is to the king (7 - king distance)
+
+FILES = [0x0101010101010101 << c for c in range(8)]
+ADJACENT_FILES = [(FILES[c - 1] if c else 0) | (FILES[c + 1] if c < 7 else 0) for c in range(8)]
+
+def _rowsMask(rows):
+    mask = 0
+    for r in rows:
+        mask |= 0xFF << (r * 8)
+    return mask
+
+# squares in front of a pawn on its own and the adjacent files, no enemy pawn there means the pawn is passed
+PASSED_MASKS = [[_rowsMask(range(sq >> 3)) & (FILES[sq & 7] | ADJACENT_FILES[sq & 7]) for sq in range(64)],
+                [_rowsMask(range((sq >> 3) + 1, 8)) & (FILES[sq & 7] | ADJACENT_FILES[sq & 7]) for sq in range(64)]]
+
+def _shieldMask(sq, rowStep):
+    r = (sq >> 3) + rowStep
+    return _rowsMask([r]) & (FILES[sq & 7] | ADJACENT_FILES[sq & 7]) if 0 <= r < 8 else 0
+
+SHIELD_NEAR_MASKS = [[_shieldMask(sq, -1) for sq in range(64)], [_shieldMask(sq, 1) for sq in range(64)]]
+SHIELD_FAR_MASKS = [[_shieldMask(sq, -2) for sq in range(64)], [_shieldMask(sq, 2) for sq in range(64)]]
+CLOSENESS = [[7 - max(abs((a >> 3) - (b >> 3)), abs((a & 7) - (b & 7))) for b in range(64)] for a in range(64)]
+
+
+# (middlegame, endgame, phase) sums of a position from scratch, GameState keeps them up to date move by move
+def pieceSquareSums(pieces):
+    mg = eg = phase = 0
+    for piece in range(12):
+        for sq in squares(pieces[piece]):
+            mg += PST_MG[piece][sq]
+            eg += PST_EG[piece][sq]
+            phase += PHASE_WEIGHTS[piece]
+    return mg, eg, phase
+
+def mobility(gs, color):
+    pieces = gs.pieces
+    offset = color * 6
+    occupied = gs.occupied
+    notOwn = ~gs.occupancy[color] & FULL
+    score = 0
+    for sq in squares(pieces[KNIGHT + offset]):
+        score += MOBILITY_WEIGHTS[KNIGHT] * popCount(KNIGHT_ATTACKS[sq] & notOwn)
+    for sq in squares(pieces[BISHOP + offset]):
+        score += MOBILITY_WEIGHTS[BISHOP] * popCount(bishopAttacks(sq, occupied) & notOwn)
+    for sq in squares(pieces[ROOK + offset]):
+        score += MOBILITY_WEIGHTS[ROOK] * popCount(rookAttacks(sq, occupied) & notOwn)
+    for sq in squares(pieces[QUEEN + offset]):
+        score += MOBILITY_WEIGHTS[QUEEN] * popCount(queenAttacks(sq, occupied) & notOwn)
+    return score
+
+def pawnStructure(gs, color):
+    pawns = gs.pieces[PAWN + color * 6]
+    enemyPawns = gs.pieces[PAWN + (1 - color) * 6]
+    score = 0
+    for c in range(8):
+        count = popCount(pawns & FILES[c])
+        if count > 1:
+            score += DOUBLED_PAWN * (count - 1)
+        if count and not pawns & ADJACENT_FILES[c]:
+            score += ISOLATED_PAWN * count
+    masks = PASSED_MASKS[color]
+    for sq in squares(pawns):
+        if not enemyPawns & masks[sq]:
+            score += PASSED_PAWN[7 - (sq >> 3) if color == WHITE else sq >> 3]
+    return score
+
+# pawn shield in front of the king minus the pressure of the enemy pieces close to it
+def kingSafety(gs, color):
+    pieces = gs.pieces
+    if not pieces[KING + color * 6]:
+        return 0
+    kingSq = bitScan(pieces[KING + color * 6])
+    pawns = pieces[PAWN + color * 6]
+    score = (SHIELD_NEAR * popCount(pawns & SHIELD_NEAR_MASKS[color][kingSq])
+             + SHIELD_FAR * popCount(pawns & SHIELD_FAR_MASKS[color][kingSq]))
+    closeness = CLOSENESS[kingSq]
+    offset = (1 - color) * 6
+    for piece in (KNIGHT, BISHOP, ROOK, QUEEN):
+        for sq in squares(pieces[piece + offset]):
+            score -= TROPISM_WEIGHTS[piece] * closeness[sq]
+    return score
+
+# score of gs from the point of view of the side to move
+def evaluate(gs):
+    phase = min(gs.phase, MAX_PHASE)
+    score = (gs.pstMg * phase + gs.pstEg * (MAX_PHASE - phase)) // MAX_PHASE
+    score += mobility(gs, WHITE) - mobility(gs, BLACK)
+    score += pawnStructure(gs, WHITE) - pawnStructure(gs, BLACK)
+    score += (kingSafety(gs, WHITE) - kingSafety(gs, BLACK)) * phase // MAX_PHASE
+    return score if gs.whiteToMove else -score
+
+
+def _requireNumpy():
+    global np
+    if np is None:
+        try:
+            import numpy as np
+        except ImportError:
+            raise ImportError("batch evaluation needs numpy (pip install numpy)") from None
+
+# (12, 64) uint8 array with a 1 wherever a piece of that index stands
+def encode(gs):
+    _requireNumpy()
+    planes = np.frombuffer(b"".join(bb.to_bytes(8, "little") for bb in gs.pieces), dtype=np.uint8)
+    return np.unpackbits(planes, bitorder="little").reshape(12, 64)
+
+def encodeBatch(positions):
+    _requireNumpy()
+    return np.stack([encode(gs) for gs in positions]) if positions else np.zeros((0, 12, 64), np.uint8)
+
+_arrays = None
+
+def _tables():
+    global _arrays
+    if _arrays is None:
+        _arrays = {
+            "mg": np.array(PST_MG, np.float32).reshape(-1), "eg": np.array(PST_EG, np.float32).reshape(-1),
+            "phase": np.array(PHASE_WEIGHTS, np.int32),
+            "passedWhite": np.array([PASSED_PAWN[7 - r] for r in range(8)], np.int32).reshape(8, 1, 1),
+            "passedBlack": np.array(PASSED_PAWN, np.int32).reshape(8, 1, 1),
+            "rows": np.arange(8).reshape(8, 1, 1),
+            "shieldNear": np.array([[[m >> sq & 1 for sq in range(64)] for m in masks] for masks in SHIELD_NEAR_MASKS],
+                                   np.int32),
+            "shieldFar": np.array([[[m >> sq & 1 for sq in range(64)] for m in masks] for masks in SHIELD_FAR_MASKS],
+                                  np.int32),
+            "closeness": np.array(CLOSENESS, np.int32),
+            "tropism": np.array(TROPISM_WEIGHTS, np.int16).reshape(6, 1, 1),
+        }
+    return _arrays
+
+KNIGHT_STEPS = [(2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2)]
+_shiftMasks = {}
+
+# moves planes laid out square by square, (64, N), by dr rows and dc columns. Squares are rows of N positions so a
+# shift is one contiguous copy, what wraps around a file edge is masked off
+def _shift(planes, dr, dc):
+    if (dr, dc) not in _shiftMasks:
+        _shiftMasks[dr, dc] = np.array([[0 <= (sq & 7) - dc < 8] for sq in range(64)], planes.dtype)
+    delta = dr * 8 + dc
+    shifted = np.zeros_like(planes)
+    if delta > 0:
+        shifted[delta:] = planes[:-delta]
+    else:
+        shifted[:delta] = planes[-delta:]
+    shifted *= _shiftMasks[dr, dc]
+    return shifted
+
+# planes is the (12, 64, N) transposed batch, own and empty are (64, N)
+def _batchMobility(planes, own, empty, offset):
+    # every slider ray is walked for all pieces at once and the planes carry each piece's weight, so the squares
+    # reached add up to the weighted sum of the per piece counts
+    reached = np.zeros_like(own)
+    knights = planes[KNIGHT + offset] * MOBILITY_WEIGHTS[KNIGHT]
+    for dr, dc in KNIGHT_STEPS:
+        reached += _shift(knights, dr, dc)
+    queens = planes[QUEEN + offset] * MOBILITY_WEIGHTS[QUEEN]
+    lines = [(ROOK_DIRS, planes[ROOK + offset] * MOBILITY_WEIGHTS[ROOK] + queens),
+             (BISHOP_DIRS, planes[BISHOP + offset] * MOBILITY_WEIGHTS[BISHOP] + queens)]
+    for dirs, start in lines:
+        for dr, dc in dirs:
+            ray = start
+            for _ in range(7):
+                ray = _shift(ray, dr, dc)
+                reached += ray
+                ray *= empty
+    return (reached * (1 - own)).sum(axis=0, dtype=np.int64)
+
+def _batchPawns(planes, tables):
+    white, black = planes[PAWN].reshape(8, 8, -1), planes[PAWN + 6].reshape(8, 8, -1) # (row, col, N)
+    rows = tables["rows"]
+    scores = []
+    for pawns in (white, black):
+        files = pawns.sum(axis=0)
+        padded = np.pad(files, ((1, 1), (0, 0)))
+        isolated = (padded[:-2] + padded[2:]) == 0
+        scores.append(DOUBLED_PAWN * np.maximum(files - 1, 0).sum(axis=0) + ISOLATED_PAWN * (files * isolated).sum(axis=0))
+    # a white pawn is passed when no black pawn on its or an adjacent file is on a row above it, and the other way
+    blackFront = np.pad(np.where(black > 0, rows, 8).min(axis=0), ((1, 1), (0, 0)), constant_values=8)
+    blackFront = np.minimum(np.minimum(blackFront[:-2], blackFront[1:-1]), blackFront[2:])
+    whiteFront = np.pad(np.where(white > 0, rows, -1).max(axis=0), ((1, 1), (0, 0)), constant_values=-1)
+    whiteFront = np.maximum(np.maximum(whiteFront[:-2], whiteFront[1:-1]), whiteFront[2:])
+    scores[0] = scores[0] + (white * (blackFront >= rows) * tables["passedWhite"]).sum(axis=(0, 1))
+    scores[1] = scores[1] + (black * (whiteFront <= rows) * tables["passedBlack"]).sum(axis=(0, 1))
+    return scores[0] - scores[1]
+
+def _batchKingSafety(planes, color, tables):
+    offset = color * 6
+    kings = planes[KING + offset].argmax(axis=0)
+    hasKing = planes[KING + offset].any(axis=0)
+    pawns = planes[PAWN + offset].T
+    score = (SHIELD_NEAR * (pawns * tables["shieldNear"][color][kings]).sum(axis=1)
+             + SHIELD_FAR * (pawns * tables["shieldFar"][color][kings]).sum(axis=1))
+    enemies = (planes[6 - offset:12 - offset] * tables["tropism"]).sum(axis=0).T
+    score = score - (enemies * tables["closeness"][kings]).sum(axis=1)
+    return np.where(hasKing, score, 0)
+
+def _evaluateChunk(boards, tables):
+    # square major layout, (12, 64, N), so every square of a plane is one contiguous row of positions
+    planes = np.ascontiguousarray(boards.transpose(1, 2, 0)).astype(np.int16)
+    phase = np.minimum(tables["phase"] @ planes.sum(axis=1, dtype=np.int32), MAX_PHASE)
+    # float32 so the products go through BLAS, every sum is a small integer and stays exact
+    flat = planes.reshape(12 * 64, -1).astype(np.float32)
+    mg = (tables["mg"] @ flat).astype(np.int64)
+    eg = (tables["eg"] @ flat).astype(np.int64)
+    score = (mg * phase + eg * (MAX_PHASE - phase)) // MAX_PHASE
+
+    white = planes[:6].sum(axis=0, dtype=np.int16)
+    black = planes[6:].sum(axis=0, dtype=np.int16)
+    empty = 1 - white - black
+    score += _batchMobility(planes, white, empty, 0) - _batchMobility(planes, black, empty, 6)
+    score += _batchPawns(planes, tables)
+    score += (_batchKingSafety(planes, WHITE, tables) - _batchKingSafety(planes, BLACK, tables)) * phase // MAX_PHASE
+    return score
+
+# Scores an (N, 12, 64) array of positions (see encode) with the same terms as evaluate. Returns an int64 array of
+# scores from white's point of view, or from the side to move's if whiteToMove (N bools) is given. The work is done
+# chunkSize positions at a time to keep the temporary arrays small
+def evaluateBatch(boards, whiteToMove=None, chunkSize=2048):
+    _requireNumpy()
+    boards = np.asarray(boards).reshape(-1, 12, 64)
+    tables = _tables()
+    scores = np.empty(len(boards), np.int64)
+    for start in range(0, len(boards), chunkSize):
+        scores[start:start + chunkSize] = _evaluateChunk(boards[start:start + chunkSize], tables)
+    if whiteToMove is not None:
+        scores = np.where(np.asarray(whiteToMove, bool), scores, -scores)
+    return scores
+
+
+def main(argv=None):
+    import ChessEngine # imported here, ChessEngine itself imports the tables above
+    from BatchAnalysis import readFens
+    from Pgn import openInput
+    parser = argparse.ArgumentParser(description="Score every position of a FEN/EPD file with the batch evaluation")
+    parser.add_argument("input", help="file to read, .gz is decompressed and - reads stdin")
+    parser.add_argument("--batch", type=int, default=65536, help="positions encoded and scored at a time")
+    parser.add_argument("--print", action="store_true", help="print every score, side to move's point of view")
+    args = parser.parse_args(argv)
+    _requireNumpy()
+
+    parsing = scoring = 0.0
+    count = 0
+    with openInput(args.input) as lines:
+        fens = readFens(lines)
+        while True:
+            start = time.perf_counter()
+            batch = [ChessEngine.GameState(fen=fen) for _, fen in zip(range(args.batch), fens)]
+            if not batch:
+                break
+            boards = encodeBatch(batch)
+            sides = [gs.whiteToMove for gs in batch]
+            middle = time.perf_counter()
+            scores = evaluateBatch(boards, sides)
+            parsing += middle - start
+            scoring += time.perf_counter() - middle
+            count += len(batch)
+            if args.print:
+                for gs, score in zip(batch, scores):
+                    print(gs.getFen(), int(score))
+    print("%d positions, parsing %.1fs, scoring %.2fs (%.0f positions/sec)" % (count, parsing, scoring,
+          count / scoring if scoring else 0), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""
+Compact binary game records. A game is stored as a 13 byte header, its tags and two bytes per move: start | end << 6,
+with the promoted piece type in bits 12-14, the same 16 bits as an OpeningBook move. Every SNAPSHOT_INTERVAL plies the
+position is stored as well (36 bytes), so position(ply) starts from the nearest snapshot and plays fewer than
+SNAPSHOT_INTERVAL moves instead of the whole game. Stored moves are turned back into move codes from the board alone,
+without generating the legal moves; an archive is trusted to hold the games it was given.
+
+An archive file is records back to back, so appending games only ever writes at its end. Archives are memory-mapped
+and a game is unpacked only when it is asked for.
+
+python GameArchive.py import games.pgn --out games.cga      append the games of a PGN file (.gz and - work too)
+python GameArchive.py export games.cga --out games.pgn
+python GameArchive.py show games.cga --game 12 --ply 120     FEN of a position and the time it took to set up
+python GameArchive.py bench games.cga                         size per game and seek time against a full replay
+"""
+import argparse
+import copy
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+import ChessEngine
+import Pgn
+from Bitboards import EMPTY, PAWN, KNIGHT, KING
+from OpeningBook import bookMove
+
+RECORD = struct.Struct("<IHHBBBH") # record size, plies, first ply, result, snapshot interval, flags, tag bytes
+SNAPSHOT = struct.Struct("<32sBBH") # a piece index per square two to a byte, side | castling << 1, en passant, clock
+RESULTS = ("*", "1-0", "0-1", "1/2-1/2")
+SET_UP = 1 # flag of a game that does not start from the initial position, its first position follows the tags
+SNAPSHOT_INTERVAL = 32 # plies between stored positions, 0 stores none
+MAX_INTERVAL = 255 # the interval is stored in a byte
+NO_EN_PASSANT = 64
+DERIVED_TAGS = ("Result", "FEN", "SetUp") # written from the record itself, not stored with the tags
+NIBBLES = [(byte & 15, byte >> 4) for byte in range(256)]
+
+
+# the position of gs packed into SNAPSHOT.size bytes, without its history
+def packPosition(gs):
+    squares = gs.squares
+    board = bytes(squares[sq] | squares[sq + 1] << 4 for sq in range(0, 64, 2))
+    ep = NO_EN_PASSANT if gs.enPassantSq is None else gs.enPassantSq
+    return SNAPSHOT.pack(board, gs.whiteToMove | gs.castling << 1, ep, gs.halfmoveClock)
+
+START_POSITION = packPosition(ChessEngine.GameState()) # games starting here store no first position
+
+# sets gs up from the snapshot at offset in data, firstPly is the number of plies played before it
+def unpackPosition(data, offset, gs, firstPly):
+    board, state, ep, clock = SNAPSHOT.unpack_from(data, offset)
+    squares = []
+    for byte in board:
+        squares.extend(NIBBLES[byte])
+    gs.setPosition(squares, bool(state & 1), state >> 1, None if ep == NO_EN_PASSANT else ep, clock, firstPly)
+
+# the move code of a stored move in gs, the position it was played in
+def decodeMove(gs, packed):
+    start, end = packed & 63, (packed >> 6) & 63
+    piece, captured = gs.squares[start], gs.squares[end]
+    promoted = packed >> 12
+    if promoted:
+        return start | end << 6 | piece << 12 | captured << 16 | ChessEngine.PROMOTION | (promoted - KNIGHT) << 20
+    kind = piece % 6
+    if kind == KING and abs(end - start) == 2:
+        return start | end << 6 | piece << 12 | EMPTY << 16 | ChessEngine.CASTLE
+    if kind == PAWN and captured == EMPTY and (end - start) & 7: # a pawn moving sideways onto an empty square
+        return start | end << 6 | piece << 12 | (PAWN + 6 - piece) << 16 | ChessEngine.EN_PASSANT
+    return start | end << 6 | piece << 12 | captured << 16
+
+
+# codes are the move codes of the game from startFen, headers its PGN tags. Returns the record as bytes
+def packGame(codes, startFen=None, headers=None, result="*", interval=SNAPSHOT_INTERVAL):
+    if not 0 <= interval <= MAX_INTERVAL:
+        raise ValueError("the snapshot interval must be 0 to %d plies" % MAX_INTERVAL)
+    gs = ChessEngine.GameState(fen=startFen or ChessEngine.START_FEN)
+    firstPly = gs.firstPly
+    start = packPosition(gs)
+    setUp = start != START_POSITION
+    moves = []
+    snapshots = []
+    for ply, code in enumerate(codes, 1):
+        moves.append(bookMove(code))
+        gs.makeMove(code)
+        if interval and ply % interval == 0:
+            snapshots.append(packPosition(gs))
+    tags = "\0".join(name + "\0" + str(value) for name, value in (headers or {}).items()
+                     if name not in DERIVED_TAGS).encode("utf-8")
+    body = b"".join([tags, start if setUp else b"", struct.pack("<%dH" % len(moves), *moves)] + snapshots)
+    return RECORD.pack(RECORD.size + len(body), len(moves), firstPly, RESULTS.index(result) if result in RESULTS else 0,
+                       interval, SET_UP if setUp else 0, len(tags)) + body
+
+# the record of the game gs has played so far, result defaults to gs.gameResult() or "*" while the game is on
+def packGameState(gs, headers=None, result=None, interval=SNAPSHOT_INTERVAL):
+    start = copy.deepcopy(gs)
+    while start.moveLog:
+        start.undoMove()
+    if result is None:
+        result = gs.gameResult() or "*"
+    return packGame(gs.moveLog, start.getFen(), headers, result, interval)
+
+# the record of a Pgn.PgnGame, raises ValueError at its first illegal move
+def packPgnGame(game, interval=SNAPSHOT_INTERVAL):
+    codes = [move for _, move, _ in game.replay()]
+    fen = game.headers.get("FEN")
+    return packGame(codes, fen, game.headers, game.result, interval)
+
+# writes records to the end of path, creating it if needed, and returns how many were written
+def appendGames(path, records):
+    count = 0
+    with open(path, "ab", buffering=1 << 20) as f:
+        for record in records:
+            f.write(record)
+            count += 1
+    return count
+
+
+class StoredGame():
+    # data holds the record at offset, e.g. an archive's mmap; the moves are unpacked here, the positions on demand
+    def __init__(self, data, offset=0):
+        size, plies, self.firstPly, result, self.interval, flags, tagBytes = RECORD.unpack_from(data, offset)
+        self.size = size
+        self.result = RESULTS[result] if result < len(RESULTS) else "*"
+        offset += RECORD.size
+        fields = bytes(data[offset:offset + tagBytes]).decode("utf-8", errors="replace").split("\0") if tagBytes else []
+        self.headers = dict(zip(fields[::2], fields[1::2]))
+        offset += tagBytes
+        self.data = data
+        self.start = None # offset of the first position of a set up game
+        if flags & SET_UP:
+            self.start = offset
+            offset += SNAPSHOT.size
+        self.moves = struct.unpack_from("<%dH" % plies, data, offset)
+        self.snapshots = offset + plies * 2 # offset of the first stored position, after interval plies
+
+    def __len__(self):
+        return len(self.moves)
+
+    def startFen(self):
+        if self.start is None and not self.firstPly:
+            return ChessEngine.START_FEN
+        return self.position(0).getFen()
+
+    # GameState after ply plies, ply is clamped to the game. It is set up from the last snapshot at or before ply,
+    # so it can only undo back to there; fromStart plays every move instead, keeping the whole game to undo. gs is
+    # set up again if given, saving the cost of a new one
+    def position(self, ply, fromStart=False, gs=None):
+        ply = max(0, min(ply, len(self.moves)))
+        if gs is None:
+            gs = ChessEngine.GameState()
+        snapshot = 0 if fromStart or not self.interval else ply // self.interval
+        if snapshot:
+            unpackPosition(self.data, self.snapshots + (snapshot - 1) * SNAPSHOT.size, gs,
+                           self.firstPly + snapshot * self.interval)
+        elif self.start is not None:
+            unpackPosition(self.data, self.start, gs, self.firstPly)
+        else:
+            unpackPosition(START_POSITION, 0, gs, self.firstPly)
+        for packed in self.moves[snapshot * self.interval:ply]:
+            gs.makeMove(decodeMove(gs, packed))
+        return gs
+
+    # yields (ply, move code, gs) after every move, gs is the same GameState each time
+    def replay(self):
+        gs = self.position(0)
+        for ply, packed in enumerate(self.moves, 1):
+            code = decodeMove(gs, packed)
+            gs.makeMove(code)
+            yield ply, code, gs
+
+    def sanMoves(self):
+        gs = self.position(0)
+        sans = []
+        for packed in self.moves:
+            code = decodeMove(gs, packed)
+            sans.append(gs.moveToSan(code))
+            gs.makeMove(code)
+        return sans
+
+    def pgn(self):
+        headers = dict(self.headers)
+        if self.start is not None or self.firstPly:
+            headers["SetUp"] = "1"
+            headers["FEN"] = self.startFen()
+        return Pgn.formatGame(headers, self.sanMoves(), self.result, self.firstPly)
+
+
+class GameArchive():
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # an empty file cannot be mapped
+            self.data = b""
+        # offset of every game. A record cut short, by an append that never finished, is left out
+        self.offsets = []
+        offset, end = 0, len(self.data)
+        while offset + RECORD.size <= end:
+            size = RECORD.unpack_from(self.data, offset)[0]
+            if size < RECORD.size or offset + size > end:
+                break
+            self.offsets.append(offset)
+            offset += size
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        return StoredGame(self.data, self.offsets[i])
+
+    def __iter__(self):
+        for offset in self.offsets:
+            yield StoredGame(self.data, offset)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# packs every game of a PGN file, counting the games left out for an illegal move in skipped[0]
+def packPgnFile(path, interval, skipped):
+    with Pgn.openInput(path) as lines:
+        for game in Pgn.readGames(lines):
+            try:
+                record = packPgnGame(game, interval)
+            except ValueError:
+                skipped[0] += 1
+                continue
+            yield record
+
+# mean seconds to set up random positions of the archive from the snapshots and by replaying every move before them
+def benchSeek(archive, samples, rng=random):
+    gs = ChessEngine.GameState()
+    games = [archive[rng.randrange(len(archive))] for _ in range(samples)]
+    plies = [rng.randint(0, len(game)) for game in games]
+    times = []
+    for fromStart in (False, True):
+        start = time.perf_counter()
+        for game, ply in zip(games, plies):
+            game.position(ply, fromStart, gs)
+        times.append((time.perf_counter() - start) / samples)
+    return times
+
+# argparse type of --interval
+def snapshotInterval(text):
+    interval = int(text)
+    if not 0 <= interval <= MAX_INTERVAL:
+        raise argparse.ArgumentTypeError("must be 0 (no snapshots) to %d" % MAX_INTERVAL)
+    return interval
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Store games in a compact binary archive")
+    commands = parser.add_subparsers(dest="command", required=True)
+    store = commands.add_parser("import", help="append the games of a PGN file to an archive")
+    store.add_argument("pgn", help="games to read, .gz is decompressed and - reads stdin")
+    store.add_argument("--out", required=True)
+    store.add_argument("--interval", type=snapshotInterval, default=SNAPSHOT_INTERVAL,
+                       help="plies between stored positions, 0 to %d" % MAX_INTERVAL)
+    export = commands.add_parser("export", help="write an archive as PGN")
+    export.add_argument("archive")
+    export.add_argument("--out", default=None, help="PGN file to write, stdout if left out")
+    show = commands.add_parser("show", help="print a position of a stored game")
+    show.add_argument("archive")
+    show.add_argument("--game", type=int, default=0)
+    show.add_argument("--ply", type=int, default=None, help="plies into the game, the end if left out")
+    bench = commands.add_parser("bench", help="size per game and time to reach a position")
+    bench.add_argument("archive")
+    bench.add_argument("--samples", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        start = time.perf_counter()
+        before = os.path.getsize(args.out) if os.path.exists(args.out) else 0
+        skipped = [0]
+        count = appendGames(args.out, packPgnFile(args.pgn, args.interval, skipped))
+        written = os.path.getsize(args.out) - before
+        print("%d games appended (%d skipped for an illegal move), %.0f bytes per game, in %.1fs"
+              % (count, skipped[0], written / max(count, 1), time.perf_counter() - start))
+        return 0
+
+    with GameArchive(args.archive) as archive:
+        if args.command == "export":
+            out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+            try:
+                for game in archive:
+                    out.write(game.pgn())
+            finally:
+                if args.out:
+                    out.close()
+            return 0
+        if not len(archive):
+            print("no games in " + args.archive, file=sys.stderr)
+            return 1
+        if args.command == "show":
+            game = archive[args.game]
+            ply = len(game) if args.ply is None else args.ply
+            start = time.perf_counter()
+            gs = game.position(ply)
+            seconds = time.perf_counter() - start
+            print(gs.getFen())
+            print("ply %d of %d, %s, set up in %.0fus" % (min(ply, len(game)), len(game), game.result, seconds * 1e6))
+            return 0
+        plies = sum(len(game) for game in archive)
+        size = len(archive.data)
+        seek, replay = benchSeek(archive, args.samples)
+        print("%d games, %d plies, %.0f bytes per game, %.2f bytes per ply" % (len(archive), plies,
+                                                                              size / len(archive), size / max(plies, 1)))
+        print("random position: %.0fus from the snapshots, %.0fus replaying the game from the start"
+              % (seek * 1e6, replay * 1e6))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
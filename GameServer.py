@@ -0,0 +1,598 @@
+"""
+Headless game server. Clients connect over TCP and exchange one JSON object per line, so any language (or nc) can
+play. One asyncio loop holds every game; engine moves are searched in a bounded process pool.
+
+Engine requests wait in a bounded queue for a free worker. When the queue is full, the connection whose move needed
+an engine reply is not read again until there is room, which pushes back on the clients that create the load instead
+of letting requests pile up in memory. Games take turns: a game the engine plays against itself queues again after
+every move. Every game has its own engine limits (movetime, nodes, depth) or a clock
+(base + increment seconds for each side), running out of time loses.
+
+Requests (replies carry the same "id" when one is given):
+    {"op": "new", "fen": ..., "ai": "b", "movetime": 1.0, "nodes": ..., "depth": ..., "clock": [300, 2]}
+    {"op": "move", "game": 1, "move": "e2e4"}      UCI notation
+    {"op": "watch", "game": 1}                     receive the updates of a game started elsewhere
+    {"op": "resign", "game": 1}
+    {"op": "close", "game": 1}
+    {"op": "stats"}                                games, memory, queue, p50/p99 latencies and queue waits
+Every change to a game is pushed to its clients as {"type": "state", "game": 1, "fen": ..., "legal": [...], ...}.
+Messages to a client go through its own bounded queue and writer task, so nothing in the server ever waits on a
+client's socket; a client that lets MAX_PENDING messages pile up is disconnected.
+
+python GameServer.py serve --port 8765 --workers 4
+python GameServer.py bench --games 500 --nodes 2000     serve in-process, play random games against it, print stats
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import ChessEngine
+from MoveCache import MoveCache
+from Search import Searcher, MAX_PLY
+from Uci import timeForMove
+
+MAX_LINE = 1 << 16 # longest request line accepted
+LATENCY_SAMPLES = 10000 # latencies kept per metric, older ones drop out
+OPS = ("new", "move", "watch", "resign", "close", "stats")
+AI_COLORS = ("", "w", "b", "wb", "bw")
+MAX_MOVETIME = 3600.0 # seconds, longer engine limits and clocks are refused
+MAX_PENDING = 256 # messages a client can fall behind by before it is disconnected
+FLUSH_TIMEOUT = 1.0 # seconds a closing connection gets to take the messages still queued for it
+
+_searcher = None # the Searcher of this worker process
+
+
+def _initWorker(hashMb):
+    global _searcher
+    _searcher = Searcher(hashMb)
+
+# runs in a worker, returns (move code or None, score, depth, nodes, seconds)
+def _engineMove(gs, depth, seconds, nodes):
+    result = _searcher.search(gs, depth, seconds, nodes)
+    return (int(result.bestMove) if result.bestMove is not None else None, result.score, result.depth, result.nodes,
+            result.seconds)
+
+
+class LatencyStats():
+    def __init__(self, samples=LATENCY_SAMPLES):
+        self.samples = collections.deque(maxlen=samples)
+        self.count = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    # {"count", "p50", "p99", "max"} in milliseconds over the samples kept
+    def summary(self):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {"count": 0, "p50": 0.0, "p99": 0.0, "max": 0.0}
+        at = lambda q: round(ordered[min(int(len(ordered) * q), len(ordered) - 1)] * 1000, 3)
+        return {"count": self.count, "p50": at(0.5), "p99": at(0.99), "max": round(ordered[-1] * 1000, 3)}
+
+
+# the engine limits of a "new" request as numbers in range, raises ValueError for anything else
+def parseLimits(request):
+    limits = {}
+    for name, kind, low, high in (("movetime", float, 0.001, MAX_MOVETIME), ("nodes", int, 1, 10 ** 9),
+                                  ("depth", int, 1, MAX_PLY - 1)):
+        value = request.get(name)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or (kind is int and value != int(value)):
+            raise ValueError("%s must be a number" % name if kind is float else "%s must be an integer" % name)
+        if not low <= value <= high:
+            raise ValueError("%s must be between %s and %s" % (name, low, high))
+        limits[name] = kind(value)
+    return limits
+
+# (base, increment) seconds of a "new" request's clock, None without one. Raises ValueError if it is not a list of two
+# numbers, base above 0 and increment 0 or more
+def parseClock(clock):
+    if clock is None:
+        return None
+    if (not isinstance(clock, list) or len(clock) != 2
+            or any(isinstance(t, bool) or not isinstance(t, (int, float)) for t in clock)):
+        raise ValueError("clock must be [base, increment] in seconds")
+    if not 0 < clock[0] <= MAX_MOVETIME * 24 or not 0 <= clock[1] <= MAX_MOVETIME:
+        raise ValueError("clock needs a base above 0 and an increment of 0 or more")
+    return float(clock[0]), float(clock[1])
+
+# approximate bytes held by an object and the lists, dicts and ints inside it, shared small ints included
+def deepSize(obj, seen=None):
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deepSize(key, seen) + deepSize(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+        size += sum(deepSize(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deepSize(vars(obj), seen)
+    return size
+
+
+class ClientWriter():
+    # sends the messages for one connection from its own task, send() itself never waits
+    def __init__(self, writer, limit=MAX_PENDING):
+        self.writer = writer
+        self.queue = asyncio.Queue(limit)
+        self.task = asyncio.ensure_future(self.run())
+
+    # queues a message, a dict or the encoded line of one. A client too far behind is cut off, which ends its
+    # handleClient and with it the games only it was in
+    def send(self, message):
+        if self.writer.is_closing():
+            return
+        data = message if isinstance(message, bytes) else encodeMessage(message)
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self.writer.transport.abort()
+
+    async def run(self):
+        while True:
+            data = await self.queue.get()
+            if data is None or self.writer.is_closing():
+                return
+            self.writer.write(data)
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                return
+
+    # lets the messages already queued go out for up to timeout seconds, then closes the connection
+    async def close(self, timeout=FLUSH_TIMEOUT):
+        try:
+            self.queue.put_nowait(None)
+            await asyncio.wait_for(asyncio.shield(self.task), timeout)
+        except (asyncio.QueueFull, asyncio.TimeoutError):
+            pass
+        self.task.cancel()
+        self.writer.close()
+
+
+def encodeMessage(message):
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+class GameSession():
+    # moveCache is the server's MoveCache, shared by every game so common openings are generated once
+    def __init__(self, gameId, gs, aiColors, limits, clock, moveCache):
+        self.id = gameId
+        self.gs = gs
+        self.moveCache = moveCache
+        self.aiColors = aiColors # "w", "b", "wb" or ""
+        self.limits = limits # {"movetime", "nodes", "depth"} for engine moves without a clock
+        self.increment = clock[1] if clock else 0.0
+        self.clock = [clock[0], clock[0]] if clock else None # seconds left for white and black
+        self.turnStart = time.monotonic()
+        self.generation = 0 # bumped by every move, engine replies for an older generation are dropped
+        self.result = None
+        self.reason = None
+        self.clients = set() # ClientWriter of every connection following the game
+        self.lastMove = None
+        self.counted = False # already in GameServer.gamesFinished
+        self.flagTimer = None # loop.call_later handle that ends the game when the side to move runs out of time
+
+    def engineToMove(self):
+        return self.result is None and self.gs.friendly[self.gs.whiteToMove] in self.aiColors
+
+    # charges the side to move for the time since its turn began, returns False if its flag fell
+    def chargeClock(self):
+        now = time.monotonic()
+        if self.clock is not None:
+            side = 0 if self.gs.whiteToMove else 1
+            self.clock[side] -= now - self.turnStart
+            if self.clock[side] < 0:
+                self.clock[side] = 0.0
+                self.finish("0-1" if side == 0 else "1-0", "time")
+                return False
+            self.clock[side] += self.increment
+        self.turnStart = now
+        return True
+
+    def play(self, move):
+        self.gs.makeMove(move)
+        self.lastMove = move.getChessNotation()
+        self.generation += 1
+        result = self.gs.gameResult()
+        if result is not None:
+            self.finish(result, self.gameOverReason())
+
+    def gameOverReason(self):
+        gs = self.gs
+        if not self.moveCache.get(gs):
+            return "checkmate" if gs.inCheck() else "stalemate"
+        if gs.isFiftyMoveRule():
+            return "fifty moves"
+        if gs.isThreefoldRepetition():
+            return "repetition"
+        return "insufficient material"
+
+    def finish(self, result, reason):
+        self.result = result
+        self.reason = reason
+        self.generation += 1
+        self.cancelFlag()
+
+    def cancelFlag(self):
+        if self.flagTimer is not None:
+            self.flagTimer.cancel()
+            self.flagTimer = None
+
+    # (depth, seconds, nodes) for an engine move in the current position
+    def engineLimits(self):
+        depth = self.limits.get("depth") or MAX_PLY - 1
+        if self.clock is not None:
+            params = {"wtime": self.clock[0] * 1000, "btime": self.clock[1] * 1000,
+                      "winc": self.increment * 1000, "binc": self.increment * 1000}
+            return depth, timeForMove(params, self.gs.whiteToMove), self.limits.get("nodes")
+        seconds = self.limits.get("movetime")
+        if seconds is None and self.limits.get("nodes") is None and not self.limits.get("depth"):
+            seconds = 1.0
+        return depth, seconds, self.limits.get("nodes")
+
+    def state(self):
+        gs = self.gs
+        return {"type": "state", "game": self.id, "fen": gs.getFen(), "turn": gs.friendly[gs.whiteToMove],
+                "lastMove": self.lastMove, "ply": len(gs.moveLog),
+                "legal": [] if self.result else self.moveCache.get(gs).notations(),
+                "result": self.result, "reason": self.reason,
+                "clock": [round(t, 3) for t in self.clock] if self.clock is not None else None}
+
+
+class GameServer():
+    # workers engine processes, maxQueued engine requests waiting for one before clients are made to wait
+    def __init__(self, workers=None, maxQueued=None, hashMb=4):
+        self.workers = workers or os.cpu_count() or 1
+        self.hashMb = hashMb
+        self.queue = asyncio.Queue()
+        self.admission = asyncio.Semaphore(maxQueued or self.workers * 4) # room for client requests in the queue
+        self.pool = None
+        self.games = {}
+        self.nextId = itertools.count(1)
+        self.moveLatency = LatencyStats() # request received to reply queued, for human moves
+        self.queueWait = LatencyStats() # a connection waiting for room in the engine queue
+        self.engineLatency = LatencyStats() # engine request queued to move played
+        self.engineNodes = 0
+        self.engineSeconds = 0.0
+        self.engineMoves = 0
+        self.gamesFinished = 0
+        self.moveCache = MoveCache()
+        self.dispatchers = []
+        self.connections = {} # ClientWriter: handleClient task of every connected client
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=8765):
+        self.pool = ProcessPoolExecutor(self.workers, initializer=_initWorker, initargs=(self.hashMb,))
+        self.dispatchers = [asyncio.ensure_future(self.dispatch()) for _ in range(self.workers)]
+        self.server = await asyncio.start_server(self.handleClient, host, port, limit=MAX_LINE)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        # closing the transports ends the readline of every handler, which then cleans up its games
+        for client in list(self.connections):
+            client.writer.close()
+        await asyncio.gather(*self.connections.values(), return_exceptions=True)
+        for task in self.dispatchers:
+            task.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+    async def handleClient(self, reader, writer):
+        owned = set()
+        client = ClientWriter(writer)
+        self.connections[client] = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError): # a line over MAX_LINE, or the client went away
+                    break
+                if not line:
+                    break
+                start = time.perf_counter()
+                request, session = None, None
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("a request is a JSON object")
+                    reply, session = self.handle(request, client, owned)
+                except Exception as e: # a bad request gets an error, the connection and the server carry on
+                    reply = {"type": "error", "error": str(e) or type(e).__name__}
+                    request = request if isinstance(request, dict) else {}
+                if "id" in request:
+                    reply["id"] = request["id"]
+                client.send(reply)
+                if request.get("op") == "move":
+                    self.moveLatency.add(time.perf_counter() - start)
+                if session is not None:
+                    start = time.perf_counter()
+                    await self.requestEngineMove(session)
+                    self.queueWait.add(time.perf_counter() - start)
+        finally:
+            for session in list(owned):
+                session.clients.discard(client)
+                if not session.clients:
+                    self.removeGame(session)
+            self.connections.pop(client, None)
+            await client.close()
+
+    # queues the game's state for every client following it, except for skip
+    def push(self, session, skip=None):
+        data = encodeMessage(session.state())
+        for client in list(session.clients):
+            if client is not skip:
+                client.send(data)
+
+    def session(self, request):
+        if "game" not in request:
+            raise ValueError("%s needs a game" % request["op"])
+        session = self.games.get(request["game"])
+        if session is None:
+            raise ValueError("no game %s" % request["game"])
+        return session
+
+    # (reply, session) for a request, session is the game that may need an engine move now
+    def handle(self, request, client, owned):
+        op = request.get("op")
+        if op not in OPS:
+            raise ValueError("unknown op %r" % op)
+        if op == "new":
+            fen = request.get("fen") or ChessEngine.START_FEN
+            if not isinstance(fen, str):
+                raise ValueError("fen must be a string")
+            ai = request.get("ai") or ""
+            if ai not in AI_COLORS:
+                raise ValueError("ai must be one of %s" % ", ".join(repr(colors) for colors in AI_COLORS))
+            limits = parseLimits(request)
+            clock = parseClock(request.get("clock"))
+            session = GameSession(next(self.nextId), ChessEngine.GameState(fen=fen), ai, limits, clock, self.moveCache)
+            session.clients.add(client)
+            owned.add(session)
+            self.games[session.id] = session
+            self.armFlag(session)
+            return session.state(), session
+        if op == "stats":
+            return self.stats(), None
+        session = self.session(request)
+        if op == "watch":
+            session.clients.add(client)
+            owned.add(session)
+            return session.state(), None
+        if op == "close":
+            session.clients.discard(client)
+            owned.discard(session)
+            if not session.clients:
+                self.removeGame(session)
+            return {"type": "closed", "game": session.id}, None
+        if session.result is not None:
+            raise ValueError("game %d is over" % session.id)
+        if op == "resign":
+            session.finish("0-1" if session.gs.whiteToMove else "1-0", "resignation")
+        else:
+            if session.engineToMove():
+                raise ValueError("it is the engine's move")
+            move = session.gs.moveFromUci(str(request.get("move", "")))
+            if session.chargeClock():
+                session.play(move)
+                self.armFlag(session)
+        self.countFinished(session)
+        self.push(session, skip=client) # the requesting client gets the state as its reply
+        return session.state(), session
+
+    def removeGame(self, session):
+        session.cancelFlag()
+        self.games.pop(session.id, None)
+
+    # ends the game on time once the side to move has used up its clock, unless a move comes first. Clocks are
+    # otherwise only charged when a move arrives, so a player who stops moving would never lose
+    def armFlag(self, session):
+        session.cancelFlag()
+        if session.clock is None or session.result is not None:
+            return
+        side = 0 if session.gs.whiteToMove else 1
+        generation = session.generation
+        session.flagTimer = asyncio.get_running_loop().call_later(
+            session.clock[side], lambda: asyncio.ensure_future(self.flagFell(session, generation)))
+
+    async def flagFell(self, session, generation):
+        if session.generation != generation or session.result is not None or session.id not in self.games:
+            return
+        session.flagTimer = None
+        side = 0 if session.gs.whiteToMove else 1
+        session.clock[side] = 0.0
+        session.finish("0-1" if side == 0 else "1-0", "time")
+        self.countFinished(session)
+        self.push(session)
+
+    def countFinished(self, session):
+        if session.result is not None and not session.counted:
+            session.counted = True
+            self.gamesFinished += 1
+
+    # queues an engine move if the engine is to move. Waits while maxQueued client requests are already waiting,
+    # which stops the caller's connection from being read until the engines catch up
+    async def requestEngineMove(self, session):
+        if session.engineToMove():
+            await self.admission.acquire()
+            self.queue.put_nowait((session, session.generation, time.perf_counter(), True))
+
+    # takes engine requests off the queue one at a time, one dispatcher per worker process. A request that fails
+    # ends its game with an error to its clients, the dispatcher goes on with the next one
+    async def dispatch(self):
+        while True:
+            session, generation, queued, admitted = await self.queue.get()
+            if admitted:
+                self.admission.release()
+            try:
+                await self.playEngine(session, generation, queued)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                session.finish("*", "engine error")
+                self.countFinished(session)
+                error = encodeMessage({"type": "error", "game": session.id, "error": str(e) or type(e).__name__})
+                for client in list(session.clients):
+                    client.send(error)
+                self.push(session)
+            finally:
+                self.queue.task_done()
+
+    # plays one engine move. When the engine is to move again, in a game it plays against itself, the game goes to
+    # the back of the queue so that the other games get their turn in between. It skips admission, a dispatcher
+    # waiting for room in its own queue could wait forever
+    async def playEngine(self, session, generation, queued):
+        if session.generation != generation or session.id not in self.games: # moved on or closed
+            return
+        depth, seconds, nodes = session.engineLimits()
+        code, score, reached, searched, spent = await asyncio.get_running_loop().run_in_executor(
+            self.pool, _engineMove, session.gs, depth, seconds, nodes)
+        self.engineNodes += searched
+        self.engineSeconds += spent
+        self.engineMoves += 1
+        if session.generation != generation or code is None:
+            return
+        if session.chargeClock():
+            session.play(ChessEngine.Move(code))
+            self.armFlag(session)
+        self.engineLatency.add(time.perf_counter() - queued)
+        self.countFinished(session)
+        self.push(session)
+        if session.engineToMove():
+            self.queue.put_nowait((session, session.generation, time.perf_counter(), False))
+
+    def stats(self):
+        memory = [deepSize(session.gs) for session in self.games.values()]
+        return {"type": "stats", "games": len(self.games), "finished": self.gamesFinished,
+                "queued": self.queue.qsize(), "workers": self.workers,
+                "memory": {"total": sum(memory), "perGame": sum(memory) // len(memory) if memory else 0,
+                           "max": max(memory, default=0)},
+                "moveLatencyMs": self.moveLatency.summary(), "queueWaitMs": self.queueWait.summary(),
+                "engineLatencyMs": self.engineLatency.summary(),
+                "engineMoves": self.engineMoves, "moveCache": self.moveCache.stats(),
+                "engineNps": int(self.engineNodes / self.engineSeconds) if self.engineSeconds > 0 else 0}
+
+
+# A client playing random moves as white against the engine in games games at once. Replies are matched to requests
+# by id, engine moves arrive as pushes. Once every game is over it waits for release before disconnecting, so the
+# server still holds the games when the stats are taken
+async def _benchClient(port, games, limits, rng, maxPlies, done, release):
+    loop = asyncio.get_running_loop()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=MAX_LINE)
+    replies = {}
+    states = {}
+    changed = asyncio.Event()
+    ids = itertools.count()
+
+    async def read():
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            message = json.loads(line)
+            if message.get("type") == "state":
+                states[message["game"]] = message
+                changed.set()
+            if "id" in message:
+                replies.pop(message["id"]).set_result(message)
+
+    def call(request):
+        request["id"] = next(ids)
+        replies[request["id"]] = loop.create_future()
+        writer.write(json.dumps(request).encode() + b"\n")
+        return replies[request["id"]]
+
+    reading = asyncio.ensure_future(read())
+    for _ in range(games):
+        await call(dict(op="new", ai="b", **limits))
+    active = set(states)
+    while active:
+        changed.clear()
+        for gameId in list(active):
+            state = states[gameId]
+            if state["result"] is not None or state["ply"] >= maxPlies:
+                active.discard(gameId)
+            elif state["turn"] == "w":
+                await call({"op": "move", "game": gameId, "move": rng.choice(state["legal"])})
+        if active and all(states[g]["turn"] == "b" for g in active):
+            await changed.wait()
+    done()
+    await release.wait()
+    reading.cancel()
+    writer.close()
+
+async def _bench(games, clients, workers, limits, maxPlies):
+    server = GameServer(workers)
+    port = await server.start(port=0)
+    start = time.perf_counter()
+    perClient = [games // clients + (i < games % clients) for i in range(clients)]
+    perClient = [n for n in perClient if n]
+    allDone = asyncio.Event()
+    release = asyncio.Event()
+    finished = []
+    def done():
+        finished.append(1)
+        if len(finished) == len(perClient):
+            allDone.set()
+    tasks = [asyncio.ensure_future(_benchClient(port, n, limits, random.Random(i), maxPlies, done, release))
+             for i, n in enumerate(perClient)]
+    await allDone.wait()
+    seconds = time.perf_counter() - start
+    stats = server.stats()
+    release.set()
+    await asyncio.gather(*tasks)
+    await server.close()
+    return stats, seconds
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve many games over TCP, one JSON message per line")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    bench = commands.add_parser("bench", help="play random games against an in-process server")
+    bench.add_argument("--games", type=int, default=200)
+    bench.add_argument("--clients", type=int, default=20)
+    bench.add_argument("--nodes", type=int, default=2000, help="engine node limit per move")
+    bench.add_argument("--max-plies", type=int, default=60)
+    for command in (serve, bench):
+        command.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args(argv)
+
+    if args.command == "bench":
+        stats, seconds = asyncio.run(_bench(args.games, args.clients, args.workers, {"nodes": args.nodes},
+                                            args.max_plies))
+        print("%d games in %.1fs" % (args.games, seconds))
+        print(json.dumps(stats, indent=1))
+        return 0
+
+    async def serveForever():
+        server = GameServer(args.workers)
+        port = await server.start(args.host, args.port)
+        print("serving on %s:%d with %d engine workers" % (args.host, port, server.workers))
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.close()
+    try:
+        asyncio.run(serveForever())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""
+Counters and phase timers for the engine's hot paths, so slowdowns can be tracked down without print calls in them.
+
+Nothing is measured until enable() is called. enable() swaps the instrumented functions (move generation, legality
+checks, makeMove, evaluation, search, board rendering) for wrappers that count and time them, and disable() puts the
+originals back. While disabled the engine runs exactly the code it runs without this module, at no cost.
+
+Counters: movesGenerated, legalityChecks, movesMade, nodes, ttHits, ttMisses. Timers (calls, seconds, longest):
+moveGeneration, evaluation, search, rendering. Stats are kept for the current process only, an EngineWorker or
+GameServer worker process counts its own. Only modules imported before enable() are instrumented, so pygame is never
+pulled in by it, and Searchers pick up the timed evaluation when they are made, so make them afterwards.
+
+The wrappers keep the names of the functions they wrap, so cProfile and pyinstrument show them as usual.
+
+python Instrumentation.py --fen "<fen>" --time 2 --json stats.json      instrumented search, stats logged and dumped
+python Instrumentation.py --perft 4 --profile perft.prof                profile perft, read with pstats or snakeviz
+"""
+import argparse
+import contextlib
+import functools
+import json
+import logging
+import sys
+import time
+
+COUNTERS = ("movesGenerated", "legalityChecks", "movesMade", "nodes", "ttHits", "ttMisses")
+TIMERS = ("moveGeneration", "evaluation", "search", "rendering")
+
+log = logging.getLogger(__name__)
+
+
+class Timer():
+    __slots__ = ("calls", "seconds", "longest")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.longest = 0.0
+
+    def add(self, seconds):
+        self.calls += 1
+        self.seconds += seconds
+        if seconds > self.longest:
+            self.longest = seconds
+
+    def asDict(self):
+        return {"calls": self.calls, "seconds": round(self.seconds, 6), "longest": round(self.longest, 6),
+                "meanUs": round(self.seconds / self.calls * 1e6, 3) if self.calls else 0.0}
+
+
+counters = dict.fromkeys(COUNTERS, 0)
+timers = {name: Timer() for name in TIMERS}
+_originals = {} # (module name, class name or None, attribute) -> the function the wrapper replaced
+
+
+def _timed(name, function, count=None):
+    timer = timers[name]
+    perf_counter = time.perf_counter
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        result = function(*args, **kwargs)
+        timer.add(perf_counter() - start)
+        if count is not None:
+            count(args, result)
+        return result
+    return wrapper
+
+def _counted(name, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        counters[name] += 1
+        return function(*args, **kwargs)
+    return wrapper
+
+def _countMoves(args, moves):
+    counters["movesGenerated"] += len(moves)
+
+# Searcher.search resets its node count and the table statistics at the start, so they are read once it returns
+def _countSearch(args, result):
+    searcher = args[0]
+    counters["nodes"] += searcher.nodes
+    counters["ttHits"] += searcher.tt.hits
+    counters["ttMisses"] += searcher.tt.probes - searcher.tt.hits
+
+# (module, class or None, attribute, wrapper factory)
+HOOKS = [
+    ("ChessEngine", "GameState", "getValidMoveCodes", lambda f: _timed("moveGeneration", f, _countMoves)),
+    ("ChessEngine", "GameState", "attackersTo", lambda f: _counted("legalityChecks", f)),
+    ("ChessEngine", "GameState", "makeMove", lambda f: _counted("movesMade", f)),
+    ("Search", None, "evaluate", lambda f: _timed("evaluation", f)),
+    ("Search", "Searcher", "search", lambda f: _timed("search", f, _countSearch)),
+    ("Renderer", "BoardRenderer", "render", lambda f: _timed("rendering", f)),
+]
+
+
+def isEnabled():
+    return bool(_originals)
+
+# installs the wrappers into the hooked modules that have been imported
+def enable():
+    if _originals:
+        return
+    for moduleName, className, attribute, wrap in HOOKS:
+        module = sys.modules.get(moduleName)
+        if module is None:
+            continue
+        owner = getattr(module, className) if className else module
+        original = getattr(owner, attribute)
+        _originals[moduleName, className, attribute] = original
+        setattr(owner, attribute, wrap(original))
+
+def disable():
+    for (moduleName, className, attribute), original in _originals.items():
+        module = sys.modules[moduleName]
+        setattr(getattr(module, className) if className else module, attribute, original)
+    _originals.clear()
+
+def reset():
+    for name in counters:
+        counters[name] = 0
+    for timer in timers.values():
+        timer.__init__()
+
+def snapshot():
+    return {"enabled": isEnabled(), "counters": dict(counters),
+            "timers": {name: timer.asDict() for name, timer in timers.items()}}
+
+def dump(path):
+    with open(path, "w") as f:
+        json.dump(snapshot(), f, indent=1)
+
+# one line per counter and per timer that saw any use
+def logStats(logger=log, level=logging.INFO):
+    if not logger.isEnabledFor(level):
+        return
+    for name, value in counters.items():
+        if value:
+            logger.log(level, "%-16s %d", name, value)
+    for name, timer in timers.items():
+        if timer.calls:
+            logger.log(level, "%-16s %d calls  %.3fs  mean %.1fus  longest %.3fms", name, timer.calls, timer.seconds,
+                       timer.seconds / timer.calls * 1e6, timer.longest * 1000)
+
+# times a block of code under name, for phases that have no function of their own to hook
+@contextlib.contextmanager
+def phase(name):
+    if not _originals:
+        yield
+        return
+    timer = timers.get(name)
+    if timer is None:
+        timer = timers[name] = Timer()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(time.perf_counter() - start)
+
+# runs the block under cProfile, the stats are written to path (pstats format) or logged by cumulative time
+@contextlib.contextmanager
+def profile(path=None, limit=25):
+    import cProfile # only needed when profiling
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if path is not None:
+            profiler.dump_stats(path)
+        else:
+            import io
+            import pstats
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+            log.info("%s", out.getvalue())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a search or perft with the engine instrumented")
+    parser.add_argument("--fen", default=None)
+    parser.add_argument("--time", type=float, default=None, help="seconds to search")
+    parser.add_argument("--depth", type=int, default=None)
+    parser.add_argument("--nodes", type=int, default=None)
+    parser.add_argument("--perft", type=int, default=None, metavar="DEPTH", help="run perft instead of a search")
+    parser.add_argument("--json", default=None, help="write the stats to this file")
+    parser.add_argument("--profile", default=None, help="also run under cProfile and write its stats to this file")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    import ChessEngine
+    from Search import Searcher, MAX_PLY
+    enable()
+    gs = ChessEngine.GameState(fen=args.fen or ChessEngine.START_FEN)
+    with profile(args.profile) if args.profile else contextlib.nullcontext():
+        if args.perft is not None:
+            from Perft import perft
+            with phase("perft"):
+                log.info("perft %d: %d nodes", args.perft, perft(gs, args.perft))
+        else:
+            if args.time is None and args.nodes is None and args.depth is None:
+                args.time = 2.0
+            result = Searcher().search(gs, args.depth or MAX_PLY - 1, args.time, args.nodes)
+            log.info("%s", result)
+    logStats()
+    if args.json is not None:
+        dump(args.json)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
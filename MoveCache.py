@@ -0,0 +1,165 @@
+"""
+Bounded LRU cache of legal move lists keyed by the position's Zobrist hash, for callers that ask about the same
+positions again and again: the board UI after every move and undo, the game server for every state it pushes, and
+analysis passes over the same games.
+
+There is nothing to invalidate by hand. makeMove and undoMove keep GameState.hashKey up to date, so a position that
+changed asks for another key, and a position that was undone to asks for its old one and gets its moves back for the
+price of a dict lookup. Each entry indexes its moves by start square, so the moves of one piece are a lookup as well.
+The hash covers side to move, castling rights and the en passant square, everything the legal moves depend on.
+
+python MoveCache.py --games 50      hit rate and lookup cost over random games replayed with undos
+"""
+import argparse
+import collections
+import random
+import sys
+import time
+import ChessEngine
+
+DEFAULT_CAPACITY = 4096 # positions kept, a few hundred bytes each until their Move objects are made
+
+
+class MoveList():
+    __slots__ = ("codes", "_moves", "_bySquare", "_uci")
+
+    # codes are the packed legal move codes of the position. Move objects, the square index and the notation are
+    # made on first use, a position that is only looked up again does not pay for them
+    def __init__(self, codes):
+        self.codes = tuple(codes)
+        self._moves = None
+        self._bySquare = None
+        self._uci = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        return iter(self.moves)
+
+    @property
+    def moves(self):
+        if self._moves is None:
+            self._moves = tuple(map(ChessEngine.Move, self.codes))
+        return self._moves
+
+    # the legal moves of the piece on (r, c), empty if it has none
+    def fromSquare(self, r, c):
+        if self._bySquare is None:
+            bySquare = {}
+            for move in self.moves:
+                bySquare.setdefault(move & 63, []).append(move)
+            self._bySquare = {sq: tuple(moves) for sq, moves in bySquare.items()}
+        return self._bySquare.get(r * 8 + c, ())
+
+    # UCI notation of every move
+    def notations(self):
+        if self._uci is None:
+            self._uci = [move.getChessNotation() for move in self.moves]
+        return self._uci
+
+NO_MOVES = MoveList(())
+
+
+class MoveCache():
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict() # hash key -> MoveList, least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    # the MoveList of gs, generated and stored if the cache does not have it
+    def get(self, gs):
+        moves = self.lookup(gs.hashKey)
+        if moves is None:
+            moves = self.store(gs.hashKey, gs.getValidMoveCodes())
+        return moves
+
+    # the cached MoveList for key, None when it has to be generated
+    def lookup(self, key):
+        moves = self.entries.get(key)
+        if moves is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return moves
+
+    # stores the legal move codes generated elsewhere (e.g. by an EngineWorker) for key and returns their MoveList
+    def store(self, key, codes):
+        moves = self.entries[key] = MoveList(codes)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return moves
+
+    def clear(self):
+        self.entries.clear()
+        self.resetStats()
+
+    def resetStats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {"entries": len(self.entries), "capacity": self.capacity, "hits": self.hits, "misses": self.misses,
+                "hitRate": round(self.hitRate(), 4)}
+
+
+# plays random games, takes every move back and replays it, the way a player stepping through a game would
+def _bench(games, plies, capacity, seed=1):
+    rng = random.Random(seed)
+    cache = MoveCache(capacity)
+    generate = lookup = 0.0
+    queries = 0
+    for _ in range(games):
+        gs = ChessEngine.GameState(fen=ChessEngine.START_FEN)
+        played = []
+        for _ in range(plies):
+            start = time.perf_counter()
+            moves = cache.get(gs)
+            lookup += time.perf_counter() - start
+            if not moves:
+                break
+            start = time.perf_counter()
+            gs.getValidMoveCodes()
+            generate += time.perf_counter() - start
+            queries += 1
+            move = rng.choice(moves.codes)
+            played.append(move)
+            gs.makeMove(move)
+        for _ in played:
+            gs.undoMove()
+            cache.get(gs)
+        for move in played:
+            gs.makeMove(move)
+            cache.get(gs)
+    return cache, queries, generate, lookup
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move cache hit rate over random games replayed with undos")
+    parser.add_argument("--games", type=int, default=50)
+    parser.add_argument("--plies", type=int, default=80)
+    parser.add_argument("--capacity", type=int, default=DEFAULT_CAPACITY)
+    args = parser.parse_args(argv)
+    cache, queries, generate, lookup = _bench(args.games, args.plies, args.capacity)
+    print("%d positions  generating %.1fus  first visit (generate and store) %.1fus" % (
+        queries, generate / queries * 1e6, lookup / queries * 1e6))
+    start = time.perf_counter()
+    gs = ChessEngine.GameState(fen=ChessEngine.START_FEN)
+    cache.get(gs)
+    for _ in range(100000):
+        cache.get(gs).fromSquare(6, 4)
+    print("cached lookup of one piece's moves %.2fus" % ((time.perf_counter() - start) * 10))
+    print(cache.stats())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""
+Opening book in a sorted fixed width binary file. Every entry is 16 bytes, laid out like a Polyglot book entry (big
+endian key, move, weight, learn), but the key is GameState.hashKey rather than the Polyglot hash, so books have to be
+built with this module. The file is memory-mapped and binary searched in place, so opening a book reads nothing and
+its size does not matter.
+
+Book moves are the low 12 bits of a packed move, start | end << 6, with the promoted piece type (1 knight to 4 queen,
+as in Polyglot) in bits 12-14.
+
+python OpeningBook.py build games.pgn --out book.bin --plies 24 --min-games 2
+python OpeningBook.py probe book.bin --fen "<fen>"
+"""
+import argparse
+import mmap
+import random
+import struct
+import sys
+import time
+import ChessEngine
+import Pgn
+
+ENTRY = struct.Struct(">QHHI") # key, move, weight, learn
+KEY = struct.Struct(">Q")
+RESULT_WEIGHTS = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1), "*": (1, 1)} # (white, black) points per game
+
+
+# the book move of a packed move code
+def bookMove(code):
+    promoted = ChessEngine.promotedPiece(code)
+    return code & 0xFFF if promoted == ChessEngine.EMPTY else code & 0xFFF | (promoted % 6) << 12
+
+
+class OpeningBook():
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # an empty file cannot be mapped
+            self.data = b""
+        self.size = len(self.data) // ENTRY.size
+
+    def __len__(self):
+        return self.size
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # returns the [(book move, weight)] stored for key, best first
+    def entries(self, key):
+        data = self.data
+        lo, hi = 0, self.size
+        while lo < hi: # first entry with a key >= key
+            mid = (lo + hi) >> 1
+            if KEY.unpack_from(data, mid * ENTRY.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        entries = []
+        while lo < self.size:
+            entryKey, move, weight, learn = ENTRY.unpack_from(data, lo * ENTRY.size)
+            if entryKey != key:
+                break
+            entries.append((move, weight))
+            lo += 1
+        return entries
+
+    # returns [(Move, weight)] for the legal book moves of gs, a hash collision can never return an illegal move
+    def moves(self, gs):
+        entries = self.entries(gs.hashKey)
+        if not entries:
+            return []
+        legal = {bookMove(code): code for code in gs.getValidMoveCodes()}
+        return [(ChessEngine.Move(legal[move]), weight) for move, weight in entries if move in legal and weight]
+
+    # picks a book move for gs at random in proportion to the weights, or the heaviest one with best=True. Returns
+    # None when the position is not in the book
+    def choose(self, gs, best=False, rng=random):
+        moves = self.moves(gs)
+        if not moves:
+            return None
+        if best:
+            return moves[0][0]
+        return rng.choices([move for move, _ in moves], [weight for _, weight in moves])[0]
+
+
+# Counts every move played in the first plies of games, weighted by the result for the side that played it (2 for a
+# win, 1 for a draw). Returns {key: {book move: weight}}. Games stop counting at their first illegal move
+def collectMoves(games, plies=24, minGames=1):
+    counts = {}
+    for game in games:
+        weights = RESULT_WEIGHTS.get(game.result, (1, 1))
+        gs = ChessEngine.GameState(fen=game.startFen())
+        try:
+            for san in game.moves[:plies]:
+                move = gs.moveFromSan(san)
+                position = counts.setdefault(gs.hashKey, {})
+                stats = position.setdefault(bookMove(move), [0, 0])
+                stats[0] += weights[0 if gs.whiteToMove else 1]
+                stats[1] += 1
+                gs.makeMove(move)
+        except ValueError:
+            continue
+    return {key: {move: weight for move, (weight, played) in moves.items() if played >= minGames and weight}
+            for key, moves in counts.items()}
+
+# writes the moves from collectMoves as a book sorted by key, heaviest move first. Weights are scaled down per
+# position where they do not fit in 16 bits. Returns the number of entries written
+def writeBook(moves, path):
+    entries = 0
+    with open(path, "wb") as f:
+        for key in sorted(moves):
+            weights = moves[key]
+            if not weights:
+                continue
+            scale = max(1, -(-max(weights.values()) // 0xFFFF))
+            for move, weight in sorted(weights.items(), key=lambda item: -item[1]):
+                f.write(ENTRY.pack(key, move, max(1, weight // scale), 0))
+                entries += 1
+    return entries
+
+def buildBook(pgnPath, outputPath, plies=24, minGames=1):
+    with Pgn.openInput(pgnPath) as lines:
+        return writeBook(collectMoves(Pgn.readGames(lines), plies, minGames), outputPath)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query an opening book")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="compile a book from a PGN file")
+    build.add_argument("pgn", help="games to read, .gz is decompressed and - reads stdin")
+    build.add_argument("--out", required=True)
+    build.add_argument("--plies", type=int, default=24, help="plies of every game to put in the book")
+    build.add_argument("--min-games", type=int, default=1, help="leave out moves played in fewer games")
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book")
+    probe.add_argument("--fen", default=ChessEngine.START_FEN)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        start = time.perf_counter()
+        entries = buildBook(args.pgn, args.out, args.plies, args.min_games)
+        print("%d entries written in %.1fs" % (entries, time.perf_counter() - start))
+        return 0
+
+    gs = ChessEngine.GameState(fen=args.fen)
+    with OpeningBook(args.book) as book:
+        start = time.perf_counter()
+        moves = book.moves(gs)
+        seconds = time.perf_counter() - start
+        total = sum(weight for _, weight in moves)
+        for move, weight in moves:
+            print("%s %d %.1f%%" % (move.getChessNotation(), weight, weight * 100 / total))
+        print("%d moves, %d book entries, lookup %.1fus" % (len(moves), len(book), seconds * 1e6))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+Multi-core search. Worker processes keep a Searcher each, so the GIL does not serialise them.
+
+"smp" mode (Lazy SMP): every worker searches the whole position and they share one transposition table in
+multiprocessing.shared_memory. Entries are written without locks; TranspositionTable stores the key XORed with the
+data, so a half written entry fails the key check and is ignored. Helpers start one depth deeper on odd workers to
+spread the work, and the main worker's result is the one returned.
+
+"split" mode (root splitting): the root moves are dealt out to the workers, each with a private table, and the best
+score at the deepest depth every worker completed wins. It is used when shared memory cannot be created.
+
+Workers send every depth they complete back over a queue while they search, so a caller's info callback sees the
+progress of the search (the main worker's depths in smp mode, the depths every worker has finished in split mode)
+and not just its result. stop() sets a flag every worker checks, in both modes.
+
+python ParallelSearch.py --workers 8 --depth 6 --compare    time the same search on one core and on eight
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import ChessEngine
+from Search import Searcher, SearchResult, MAX_PLY
+from TranspositionTable import TranspositionTable, entriesFor, ENTRY_BYTES
+
+try:
+    from multiprocessing import shared_memory
+except ImportError: # pragma: no cover - very old Python
+    shared_memory = None
+
+_searcher = None # the Searcher of this worker process
+_sharedMemory = None
+_reports = None # queue the completed depths go back to the ParallelSearcher on
+
+
+def _initWorker(sharedName, hashMb, reports, stopFlag):
+    global _searcher, _sharedMemory, _reports
+    _reports = reports
+    if sharedName is None:
+        _searcher = Searcher(hashMb)
+        _searcher.stopFlag = stopFlag
+        return
+    # pool workers are children of the process that created the segment and share its resource tracker
+    _sharedMemory = shared_memory.SharedMemory(name=sharedName)
+    tt = TranspositionTable(hashMb, buffer=_sharedMemory.buf)
+    _searcher = Searcher(tt=tt)
+    _searcher.stopFlag = _sharedMemory.buf[tt.sizeBytes():tt.sizeBytes() + 1]
+
+# runs in a worker, returns the completed depths as (depth, score, pv codes) plus node and TT counts. With a searchId
+# every depth is also sent to the reports queue as (searchId, worker, depth, score, pv codes, nodes) once it is done
+def _workerSearch(gs, maxDepth, timeLimit, nodeLimit, rootMoves, startDepth, ttAge, searchId=None, worker=0):
+    depths = []
+    def info(result):
+        depths.append((result.depth, result.score, [int(move) for move in result.pv]))
+        if searchId is not None:
+            _reports.put((searchId, worker, result.depth, result.score, depths[-1][2], result.nodes))
+    _searcher.search(gs, maxDepth, timeLimit, nodeLimit, info, rootMoves, startDepth, ttAge)
+    return depths, _searcher.nodes, _searcher.tt.probes, _searcher.tt.hits
+
+
+class ParallelSearcher():
+    def __init__(self, workers=None, hashMb=64, mode="smp"):
+        self.workers = workers or os.cpu_count() or 1
+        self.hashMb = hashMb
+        self.sharedMemory = None
+        self.ttAge = 0
+        self.searchId = 0 # reports of an earlier search that arrive late are told apart by it
+        if mode == "smp" and shared_memory is not None:
+            ttBytes = entriesFor(hashMb) * ENTRY_BYTES
+            try:
+                self.sharedMemory = shared_memory.SharedMemory(create=True, size=ttBytes + 1)
+            except OSError:
+                self.sharedMemory = None
+        self.mode = "smp" if self.sharedMemory is not None else "split"
+        if self.sharedMemory is not None: # new segments are zero filled, which is an empty table
+            self.stopFlag = self.sharedMemory.buf[ttBytes:ttBytes + 1]
+            workerStop = None # the workers find it after their table in the segment
+        else:
+            self.stopFlag = workerStop = multiprocessing.RawArray('b', 1)
+        self.reports = multiprocessing.Queue()
+        sharedName = self.sharedMemory.name if self.sharedMemory is not None else None
+        self.pool = ProcessPoolExecutor(self.workers, initializer=_initWorker,
+                                        initargs=(sharedName, hashMb, self.reports, workerStop))
+
+    def close(self):
+        self.pool.shutdown()
+        self.reports.close()
+        if self.sharedMemory is not None:
+            self.stopFlag.release()
+            self.sharedMemory.close()
+            self.sharedMemory.unlink()
+            self.sharedMemory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # asks every worker to return as soon as possible, safe to call from another thread
+    def stop(self):
+        self.stopFlag[0] = 1
+
+    # same arguments and result as Searcher.search, nodeLimit is shared out between the workers. The result's nodes
+    # and nps add up every worker. info is called with a SearchResult for every depth completed: the main worker's
+    # in smp mode, the best over all root moves once every worker has finished the depth in split mode
+    def search(self, gs, maxDepth=MAX_PLY - 1, timeLimit=None, nodeLimit=None, info=None):
+        start = time.perf_counter()
+        self.ttAge = (self.ttAge + 1) & 63
+        self.searchId += 1
+        legal = gs.getValidMoveCodes()
+        if not legal:
+            return Searcher(1).search(gs)
+        workerNodes = nodeLimit // self.workers if nodeLimit is not None else None
+        searchId = self.searchId if info is not None else None
+        self.stopFlag[0] = 0
+        reported = 0
+
+        if self.mode == "smp":
+            futures = [self.pool.submit(_workerSearch, gs, maxDepth, timeLimit, workerNodes, None, 1 + i % 2,
+                                        self.ttAge, searchId, i) for i in range(self.workers)]
+            if info is not None:
+                reported = self.relayInfo(futures[:1], 1, start, info)
+            mainDepths = futures[0].result()[0]
+            self.stopFlag[0] = 1 # the helpers have done their job once the main worker is finished
+            results = [future.result() for future in futures]
+            depth, score, pv = mainDepths[-1]
+        else:
+            shares = [legal[i::self.workers] for i in range(self.workers) if legal[i::self.workers]]
+            futures = [self.pool.submit(_workerSearch, gs, maxDepth, timeLimit, workerNodes, share, 1, None,
+                                        searchId, i) for i, share in enumerate(shares)]
+            if info is not None:
+                reported = self.relayInfo(futures, len(shares), start, info)
+            results = [future.result() for future in futures]
+            # scores are only comparable at the same depth, use the deepest one that every worker finished
+            depth = min(depths[-1][0] for depths, _, _, _ in results)
+            score, pv = max((entry[1], entry[2]) for depths, _, _, _ in results for entry in depths
+                            if entry[0] == depth)
+
+        seconds = time.perf_counter() - start
+        nodes = sum(result[1] for result in results)
+        probes = sum(result[2] for result in results)
+        hits = sum(result[3] for result in results)
+        hashfull = self.hashfull() if self.mode == "smp" else 0
+        result = SearchResult(ChessEngine.Move(pv[0]), score, depth, list(map(ChessEngine.Move, pv)), nodes, seconds,
+                              hits / probes if probes else 0.0, hashfull)
+        if info is not None and reported < depth: # its report was still on the way when the worker returned
+            info(result)
+        return result
+
+    # Calls info with the depths the workers report until every future in waitFor is done. A depth is reported once
+    # needed workers have completed it (the main worker alone in smp mode, every share in split mode), with the best
+    # score among them and the nodes of every worker so far. Returns the deepest depth reported
+    def relayInfo(self, waitFor, needed, start, info):
+        nodes = {} # worker: nodes of its last completed depth
+        depths = {} # depth: [(score, pv codes)] of the workers that completed it
+        reported = 0
+        while True:
+            finished = all(future.done() for future in waitFor)
+            try:
+                searchId, worker, depth, score, pv, workerNodes = self.reports.get(timeout=0 if finished else 0.05)
+            except queue.Empty:
+                if finished:
+                    return reported
+                continue
+            if searchId != self.searchId:
+                continue
+            nodes[worker] = workerNodes
+            if self.mode == "smp" and worker != 0:
+                continue
+            entries = depths.setdefault(depth, [])
+            entries.append((score, pv))
+            if len(entries) < needed or depth <= reported:
+                continue
+            reported = depth
+            score, pv = max(entries)
+            hashfull = self.hashfull() if self.mode == "smp" else 0
+            info(SearchResult(ChessEngine.Move(pv[0]), score, depth, list(map(ChessEngine.Move, pv)),
+                              sum(nodes.values()), time.perf_counter() - start, 0.0, hashfull))
+
+    def hashfull(self):
+        tt = TranspositionTable(self.hashMb, buffer=self.sharedMemory.buf)
+        tt.age = self.ttAge
+        full = tt.hashfull()
+        tt.table.release()
+        return full
+
+
+# times a fixed depth search on one core and with workers processes, returns (single, parallel, speedup)
+def compareSpeedup(gs, depth, workers, hashMb=64, mode="smp"):
+    single = Searcher(hashMb).search(gs, depth)
+    with ParallelSearcher(workers, hashMb, mode) as searcher:
+        searcher.search(gs, 1) # start the worker processes before timing
+        parallel = searcher.search(gs, depth)
+    return single, parallel, single.seconds / parallel.seconds if parallel.seconds > 0 else 0.0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search a position on several cores")
+    parser.add_argument("--fen", default=ChessEngine.START_FEN)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--time", type=float, default=None, help="seconds to search")
+    parser.add_argument("--hash", type=int, default=64, help="shared transposition table size in MB")
+    parser.add_argument("--mode", choices=["smp", "split"], default="smp")
+    parser.add_argument("--compare", action="store_true", help="also search on one core and report the speedup")
+    args = parser.parse_args(argv)
+    gs = ChessEngine.GameState(fen=args.fen)
+
+    if args.compare:
+        single, parallel, speedup = compareSpeedup(gs, args.depth, args.workers, args.hash, args.mode)
+        print("1 core:    ", single)
+        print("%d workers:" % args.workers, parallel)
+        print("speedup %.2fx" % speedup)
+        return 0
+
+    with ParallelSearcher(args.workers, args.hash, args.mode) as searcher:
+        result = searcher.search(gs, args.depth, args.time)
+    print(result)
+    print("bestmove", result.bestMove.getChessNotation())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
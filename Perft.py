@@ -0,0 +1,117 @@
+"""
+Perft counts the leaf nodes of the legal move tree to a fixed depth. The counts for the reference positions below are
+known, so any difference points at a move generation bug, and the nodes per second show whether a change made move
+generation faster or slower.
+
+python Perft.py --depth 4                    perft from the starting position
+python Perft.py --fen "<fen>" --depth 3 --divide
+python Perft.py --suite --max-nodes 1000000  check every reference position up to the node limit
+"""
+import argparse
+import sys
+import time
+import ChessEngine
+
+# (name, fen, [nodes at depth 1, depth 2, ...])
+REFERENCE_POSITIONS = [
+    ("initial", ChessEngine.START_FEN,
+     [20, 400, 8902, 197281, 4865609, 119060324]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603, 193690690]),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624, 11030083]),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333, 15833292]),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487, 89941194]),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594, 164075551]),
+]
+
+
+# number of leaf nodes depth plies below the current position, the last ply is counted without being played
+def perft(gs, depth):
+    return _perft(gs, depth, [[] for _ in range(depth + 1)])
+
+# buffers holds one move list per ply that is refilled instead of allocating a new list at every node
+def _perft(gs, depth, buffers):
+    if depth == 0:
+        return 1
+    moves = gs.getValidMoveCodes(buffers[depth])
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += _perft(gs, depth - 1, buffers)
+        gs.undoMove()
+    return nodes
+
+# perft split up by root move, returns a list of (move notation, nodes)
+def divide(gs, depth):
+    results = []
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        results.append((move.getChessNotation(), perft(gs, depth - 1)))
+        gs.undoMove()
+    return results
+
+# runs perft and returns (nodes, seconds taken)
+def timedPerft(fen, depth):
+    gs = ChessEngine.GameState(fen=fen)
+    start = time.perf_counter()
+    nodes = perft(gs, depth)
+    return nodes, time.perf_counter() - start
+
+def nodesPerSecond(nodes, seconds):
+    return int(nodes / seconds) if seconds > 0 else 0
+
+# checks every reference position at increasing depth until the expected count passes maxNodes,
+# returns True if every count matched
+def runSuite(maxNodes, out=sys.stdout):
+    allPassed = True
+    totalNodes = totalTime = 0
+    for name, fen, counts in REFERENCE_POSITIONS:
+        for depth, expected in enumerate(counts, 1):
+            if depth > 1 and expected > maxNodes:
+                break
+            nodes, seconds = timedPerft(fen, depth)
+            totalNodes += nodes
+            totalTime += seconds
+            passed = nodes == expected
+            allPassed = allPassed and passed
+            print("%-10s depth %d  %10d nodes  expected %10d  %s  %8.3fs  %8d nps"
+                  % (name, depth, nodes, expected, "ok  " if passed else "FAIL", seconds,
+                     nodesPerSecond(nodes, seconds)), file=out)
+    print("total %d nodes in %.3fs, %d nps" % (totalNodes, totalTime, nodesPerSecond(totalNodes, totalTime)), file=out)
+    return allPassed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft node counts and move generation speed")
+    parser.add_argument("--fen", default=ChessEngine.START_FEN)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--divide", action="store_true", help="break the count down per root move")
+    parser.add_argument("--suite", action="store_true", help="check the reference positions")
+    parser.add_argument("--max-nodes", type=int, default=1000000, help="deepest suite depth to run, in expected nodes")
+    parser.add_argument("--check-hash", action="store_true", help="verify the incremental hash after every move")
+    args = parser.parse_args(argv)
+    ChessEngine.GameState.checkHash = args.check_hash
+
+    if args.suite:
+        return 0 if runSuite(args.max_nodes) else 1
+
+    gs = ChessEngine.GameState(fen=args.fen)
+    start = time.perf_counter()
+    if args.divide:
+        results = divide(gs, args.depth)
+        for notation, nodes in results:
+            print(notation + ":", nodes)
+        nodes = sum(count for _, count in results)
+    else:
+        nodes = perft(gs, args.depth)
+    seconds = time.perf_counter() - start
+    print("nodes %d  time %.3fs  nps %d" % (nodes, seconds, nodesPerSecond(nodes, seconds)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
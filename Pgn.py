@@ -0,0 +1,115 @@
+"""
+Streaming PGN reader. Games are read one at a time from any iterable of lines (an open file, gzip stream, stdin), so
+databases far bigger than memory can be processed. Comments, NAGs and variations are skipped, only the main line is
+kept. formatGame writes a game back out for other tools to read.
+"""
+import gzip
+import re
+import sys
+import ChessEngine
+
+HEADER_PATTERN = re.compile(r'^\[(\w+)\s+"(.*)"\]$')
+TOKEN_PATTERN = re.compile(r'\{[^}]*\}|;[^\n]*|\$\d+|[()]|[^\s(){};]+')
+MOVE_NUMBER_PATTERN = re.compile(r'^\d+\.+')
+ESCAPE_PATTERN = re.compile(r'\\(.)') # a backslash before a quote or a backslash in a tag value
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+TAG_ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result") # the tags every exported game starts with
+
+
+class PgnGame():
+    def __init__(self, headers, moves, result):
+        self.headers = headers # tag pairs, e.g. {"White": "...", "Result": "1-0"}
+        self.moves = moves # main line in standard algebraic notation
+        self.result = result
+
+    def startFen(self):
+        return self.headers.get("FEN", ChessEngine.START_FEN)
+
+    # yields (ply, move, gs) after every move of the main line, gs is the same GameState each time. Raises
+    # ValueError at the first move that is not legal in the position
+    def replay(self):
+        gs = ChessEngine.GameState(fen=self.startFen())
+        for ply, san in enumerate(self.moves, 1):
+            move = gs.moveFromSan(san)
+            gs.makeMove(move)
+            yield ply, move, gs
+
+
+# text lines of a file for readGames and the like: .gz files are decompressed on the fly and "-" is stdin
+def openInput(path):
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, encoding="utf-8", errors="replace")
+
+# splits movetext into SAN moves and the result
+def parseMovetext(text):
+    moves = []
+    result = "*"
+    depth = 0 # variation nesting, moves inside parentheses are not part of the main line
+    for token in TOKEN_PATTERN.findall(text):
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth = max(depth - 1, 0)
+        elif depth or token[0] in '{;$':
+            continue
+        elif token in RESULTS:
+            result = token
+        else:
+            token = MOVE_NUMBER_PATTERN.sub('', token)
+            if token:
+                moves.append(token)
+    return moves, result
+
+# yields a PgnGame for every game in lines without reading further ahead than the game being built
+def readGames(lines):
+    headers = {}
+    movetext = []
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] == '%':
+            continue
+        if line[0] == '[' and line[-1] == ']':
+            if movetext: # a tag after movetext starts the next game
+                moves, result = parseMovetext(" ".join(movetext))
+                yield PgnGame(headers, moves, headers.get("Result", result) if result == "*" else result)
+                headers = {}
+                movetext = []
+            match = HEADER_PATTERN.match(line)
+            if match:
+                headers[match.group(1)] = ESCAPE_PATTERN.sub(r'\1', match.group(2))
+        else:
+            movetext.append(line)
+    if headers or movetext:
+        moves, result = parseMovetext(" ".join(movetext))
+        yield PgnGame(headers, moves, headers.get("Result", result) if result == "*" else result)
+
+# PGN text of a game, the seven tag roster first. moves are SAN, the lines of movetext are kept under width columns
+def formatGame(headers, moves, result, startPly=0, width=79):
+    tags = dict(headers)
+    for name in TAG_ROSTER:
+        tags.setdefault(name, "?")
+    tags["Result"] = result
+    ordered = list(TAG_ROSTER) + [name for name in tags if name not in TAG_ROSTER]
+    lines = ['[%s "%s"]' % (name, str(tags[name]).replace("\\", "\\\\").replace('"', '\\"')) for name in ordered]
+    lines.append("")
+    tokens = []
+    for ply, san in enumerate(moves, startPly):
+        if ply % 2 == 0:
+            tokens.append("%d. %s" % (ply // 2 + 1, san))
+        elif ply == startPly: # a game set up with black to move
+            tokens.append("%d... %s" % (ply // 2 + 1, san))
+        else:
+            tokens.append(san)
+    tokens.append(result)
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > width:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n\n"
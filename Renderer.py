@@ -0,0 +1,213 @@
+"""
+Board drawing that only repaints what changed. The empty board is rendered once to a surface, and every frame the
+position is compared with the one drawn last, together with the selected square, the move suggestions, the dragged
+piece and the thinking notice. Only the squares that differ are repainted, and only their rects are handed to
+p.display.update, so a frame where nothing happened costs a few comparisons.
+
+SDL_VIDEODRIVER=dummy python Renderer.py --frames 3000    headless frame time and CPU use, full redraw vs dirty rects
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import pygame as p
+import Assets
+import ChessEngine
+
+COLORS = [(211, 182, 131), (43, 29, 20)] # light and dark squares
+HIGHLIGHT = (0, 255, 0)
+SUGGESTION = (0, 0, 0)
+BENCH_SQ_SIZE = 128 # the square size of the 1024x1024 window
+
+
+class BoardRenderer():
+    def __init__(self, screen, images, squareSize, dimension=8):
+        self.screen = screen
+        self.images = images # piece name -> surface of squareSize
+        self.squareSize = squareSize
+        self.dimension = dimension
+        self.background = self.renderBackground()
+        self.font = None
+        self.notice = None
+        self.invalidate()
+
+    def renderBackground(self):
+        size = self.squareSize * self.dimension
+        background = p.Surface((size, size)).convert()
+        for r in range(self.dimension):
+            for c in range(self.dimension):
+                background.fill(COLORS[(r + c) % 2], self.squareRect(r, c))
+        return background
+
+    # forgets what is on screen so the next render repaints everything, e.g. after the window was exposed
+    def invalidate(self):
+        self.board = None
+        self.selected = None
+        self.suggestions = frozenset()
+        self.dragged = None
+        self.overlayRects = []
+
+    def squareRect(self, r, c):
+        return p.Rect(c * self.squareSize, r * self.squareSize, self.squareSize, self.squareSize)
+
+    def squaresUnder(self, rect):
+        last = self.dimension - 1
+        for r in range(max(rect.top // self.squareSize, 0), min((rect.bottom - 1) // self.squareSize, last) + 1):
+            for c in range(max(rect.left // self.squareSize, 0), min((rect.right - 1) // self.squareSize, last) + 1):
+                yield r, c
+
+    def thinkingNotice(self):
+        if self.notice is None:
+            self.font = p.font.SysFont(None, self.squareSize // 3)
+            self.notice = self.font.render("Thinking...", True, p.Color("white"), p.Color("black"))
+        return self.notice
+
+    # Draws the board (a tuple of row tuples of piece names, as GameState.board) and returns the list of rects that
+    # changed, empty when nothing did. selected is the (row, col) of the highlighted square, suggestions the squares
+    # that get a move dot, dragged the square whose piece follows dragPos
+    def render(self, board, selected=None, suggestions=(), dragged=None, dragPos=None, thinking=False):
+        suggestions = frozenset(suggestions)
+        overlays = []
+        if dragged is not None and dragPos is not None:
+            rect = p.Rect(0, 0, self.squareSize, self.squareSize)
+            rect.center = dragPos
+            overlays.append((self.images[board[dragged[0]][dragged[1]]], rect))
+        if thinking:
+            notice = self.thinkingNotice()
+            overlays.append((notice, notice.get_rect(topleft=(self.squareSize // 8, self.squareSize // 8))))
+        overlayRects = [rect for _, rect in overlays]
+
+        full = self.board is None
+        dirty = set()
+        if full:
+            dirty.update((r, c) for r in range(self.dimension) for c in range(self.dimension))
+        else:
+            last = self.board
+            for r in range(self.dimension):
+                if board[r] != last[r]:
+                    dirty.update((r, c) for c in range(self.dimension) if board[r][c] != last[r][c])
+            if selected != self.selected:
+                dirty.update(square for square in (selected, self.selected) if square is not None)
+            dirty |= suggestions ^ self.suggestions
+            if dragged != self.dragged:
+                dirty.update(square for square in (dragged, self.dragged) if square is not None)
+            if overlayRects != self.overlayRects:
+                for rect in self.overlayRects + overlayRects:
+                    dirty.update(self.squaresUnder(rect))
+
+        self.board = board
+        self.selected = selected
+        self.suggestions = suggestions
+        self.dragged = dragged
+        self.overlayRects = overlayRects
+        if not dirty:
+            return []
+
+        rects = []
+        for r, c in dirty:
+            rect = self.squareRect(r, c)
+            if (r, c) == selected:
+                self.screen.fill(HIGHLIGHT, rect)
+            else:
+                self.screen.blit(self.background, rect, rect)
+            if (r, c) in suggestions:
+                p.draw.circle(self.screen, SUGGESTION, rect.center, self.squareSize // 8)
+            piece = board[r][c]
+            if piece != "--" and (r, c) != dragged:
+                self.screen.blit(self.images[piece], rect)
+            rects.append(rect)
+        # overlays are drawn again whenever something moved under them, outside the dirty rects nothing changes
+        for image, rect in overlays:
+            self.screen.blit(image, rect)
+        return [self.screen.get_rect()] if full else rects
+
+
+# the drawing ChessMain did before this module: every square, piece and dot every frame, then a flip
+def drawFull(screen, images, squareSize, board, selected, suggestions, dragged, dragPos):
+    for r in range(8):
+        for c in range(8):
+            p.draw.rect(screen, COLORS[(r + c) % 2], p.Rect(c * squareSize, r * squareSize, squareSize, squareSize))
+    if selected is not None:
+        p.draw.rect(screen, HIGHLIGHT, p.Rect(selected[1] * squareSize, selected[0] * squareSize, squareSize,
+                                              squareSize))
+        for r, c in suggestions:
+            p.draw.circle(screen, SUGGESTION, (c * squareSize + squareSize // 2, r * squareSize + squareSize // 2),
+                          squareSize // 8)
+    for r in range(8):
+        for c in range(8):
+            if board[r][c] != "--" and (r, c) != dragged:
+                screen.blit(images[board[r][c]], p.Rect(c * squareSize, r * squareSize, squareSize, squareSize))
+    if dragged is not None:
+        rect = p.Rect(0, 0, squareSize, squareSize)
+        rect.center = dragPos
+        screen.blit(images[board[dragged[0]][dragged[1]]], rect)
+    p.display.flip()
+
+# Yields the state of every frame of a scripted game: mostly idle frames, then a piece is picked up, dragged to its
+# target square and dropped, as a player would. Moves are random legal moves from a fixed seed
+def scriptedFrames(frames, idleFrames=40, dragFrames=16):
+    gs = ChessEngine.GameState()
+    rng = random.Random(1)
+    frame = 0
+    while frame < frames:
+        moves = gs.getValidMoves()
+        if not moves:
+            gs = ChessEngine.GameState()
+            continue
+        move = rng.choice(moves)
+        start = (move.startRow, move.startCol)
+        for _ in range(idleFrames):
+            yield "idle", gs.board, None, (), None, None
+        suggestions = [(m.endRow, m.endCol) for m in moves if (m.startRow, m.startCol) == start]
+        for i in range(dragFrames):
+            t = i / (dragFrames - 1)
+            pos = (int((move.startCol + (move.endCol - move.startCol) * t + 0.5) * BENCH_SQ_SIZE),
+                   int((move.startRow + (move.endRow - move.startRow) * t + 0.5) * BENCH_SQ_SIZE))
+            yield "drag", gs.board, start, suggestions, start, pos
+        gs.makeMove(move)
+        frame += idleFrames + dragFrames
+
+def benchmark(frames):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    p.display.init()
+    p.font.init()
+    screen = p.display.set_mode((BENCH_SQ_SIZE * 8, BENCH_SQ_SIZE * 8))
+    images = Assets.PieceImages().forSize(BENCH_SQ_SIZE)
+
+    results = {}
+    for mode in ("full", "dirty"):
+        renderer = BoardRenderer(screen, images, BENCH_SQ_SIZE) if mode == "dirty" else None
+        times = {"idle": [], "drag": []}
+        cpuStart = time.process_time()
+        for kind, board, selected, suggestions, dragged, dragPos in scriptedFrames(frames):
+            start = time.perf_counter()
+            if renderer is None:
+                drawFull(screen, images, BENCH_SQ_SIZE, board, selected, suggestions, dragged, dragPos)
+            else:
+                rects = renderer.render(board, selected, suggestions, dragged, dragPos)
+                if rects:
+                    p.display.update(rects)
+            times[kind].append(time.perf_counter() - start)
+        results[mode] = (times, time.process_time() - cpuStart)
+    p.quit()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare full redraws with dirty rect rendering")
+    parser.add_argument("--frames", type=int, default=3000)
+    args = parser.parse_args(argv)
+
+    import ChessMain
+    for mode, (times, cpu) in benchmark(args.frames).items():
+        allTimes = sorted(times["idle"] + times["drag"])
+        idle = sum(times["idle"]) / len(times["idle"])
+        # what a second of doing nothing costs at the frame rate the UI runs at when idle
+        idleFps = ChessMain.MAX_FPS if mode == "full" else ChessMain.IDLE_FPS
+        print("%-5s frames %d  mean %.3fms  p99 %.3fms  idle %.3fms  drag %.3fms  cpu %.2fs  idle cpu %.1f%%"
+              % (mode, len(allTimes), sum(allTimes) / len(allTimes) * 1000, allTimes[len(allTimes) * 99 // 100] * 1000,
+                 idle * 1000, sum(times["drag"]) / len(times["drag"]) * 1000, cpu, idle * idleFps * 100))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+"""
+Alpha-beta search on top of GameState. Negamax with iterative deepening, a transposition table, check extensions and
+a captures only quiescence search. Moves are tried TT move first, then captures by MVV-LVA, then killer moves, then
+quiet moves by history score.
+
+python Search.py --fen "<fen>" --time 5     search a position and print one line per completed depth
+"""
+import argparse
+import sys
+import time
+import ChessEngine
+from Bitboards import EMPTY
+from ChessEngine import PROMOTION, promotedPiece
+from Evaluation import evaluate
+from Tablebase import Tablebases
+from TranspositionTable import TranspositionTable, EXACT, LOWER, UPPER
+
+MATE = 30000
+MATE_BOUND = MATE - 1000 # scores past this are mates, stored relative to the node in the transposition table
+INFINITY = 32000
+MAX_PLY = 100
+PIECE_VALUES = [100, 320, 330, 500, 900, 0] * 2 + [0] # for move ordering, indexed by piece, the last entry is EMPTY
+
+
+# mate scores are stored as distance from the node rather than from the root
+def scoreToTT(score, ply):
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+def scoreFromTT(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+class SearchResult():
+    def __init__(self, bestMove, score, depth, pv, nodes, seconds, ttHitRate, hashfull):
+        self.bestMove = bestMove # Move, None if the side to move has no legal moves
+        self.score = score # centipawns from the side to move's point of view
+        self.depth = depth
+        self.pv = pv # principal variation as a list of Move
+        self.nodes = nodes
+        self.seconds = seconds
+        self.nps = int(nodes / seconds) if seconds > 0 else 0
+        self.ttHitRate = ttHitRate
+        self.hashfull = hashfull
+
+    def isMate(self):
+        return abs(self.score) > MATE_BOUND
+
+    # moves until mate, negative if the side to move is getting mated
+    def mateIn(self):
+        plies = MATE - abs(self.score)
+        return (plies + 1) // 2 if self.score > 0 else -(plies // 2)
+
+    def __repr__(self):
+        score = "mate %d" % self.mateIn() if self.isMate() else "cp %d" % self.score
+        return ("depth %d score %s nodes %d time %.3fs nps %d tthits %.1f%% hashfull %d pv %s"
+                % (self.depth, score, self.nodes, self.seconds, self.nps, self.ttHitRate * 100, self.hashfull,
+                   " ".join(move.getChessNotation() for move in self.pv)))
+
+
+class Searcher():
+    # tt can be passed in to share one table between searchers, otherwise a private table of hashMb is made
+    def __init__(self, hashMb=16, tt=None):
+        self.tt = tt if tt is not None else TranspositionTable(hashMb)
+        self.evaluate = evaluate
+        self.tablebases = None # optional Tablebase.Tablebases, positions they cover are scored without searching
+        self.stopRequested = False
+        self.stopFlag = None # optional shared buffer, the search stops once its first byte is set
+        self.resetStats()
+
+    def resetStats(self):
+        self.nodes = 0
+        self.stopped = False
+        self.tt.resetStats()
+
+    # asks a running search to return as soon as possible, safe to call from another thread
+    def stop(self):
+        self.stopRequested = True
+
+    # Searches gs by iterative deepening until maxDepth, timeLimit seconds or nodeLimit nodes is reached, whichever
+    # comes first, and returns the SearchResult of the last completed depth. info is called with the result of every
+    # completed depth. rootMoves limits the search to those move codes at the root, startDepth skips the first
+    # iterations and ttAge is passed on to TranspositionTable.newSearch. gs is left as it was passed in
+    def search(self, gs, maxDepth=MAX_PLY - 1, timeLimit=None, nodeLimit=None, info=None, rootMoves=None,
+               startDepth=1, ttAge=None):
+        self.resetStats()
+        self.stopRequested = False
+        self.tt.newSearch(ttAge)
+        self.startTime = time.perf_counter()
+        self.deadline = self.startTime + timeLimit if timeLimit is not None else None
+        self.nodeLimit = nodeLimit
+        self.rootMoves = rootMoves
+        self.buffers = [[] for _ in range(MAX_PLY + 1)]
+        self.pv = [[] for _ in range(MAX_PLY + 1)]
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history = [[0] * 64 for _ in range(12)]
+
+        legal = rootMoves if rootMoves is not None else gs.getValidMoveCodes()
+        if not legal:
+            score = -MATE if gs.inCheck() else 0
+            return SearchResult(None, score, 0, [], 0, 0.0, 0.0, 0)
+        result = None
+        for depth in range(min(startDepth, maxDepth), maxDepth + 1):
+            score = self.negamax(gs, depth, -INFINITY, INFINITY, 0)
+            if self.stopped and result is not None:
+                break # an unfinished iteration is not trusted
+            pv = self.pv[0] or [legal[0]]
+            seconds = time.perf_counter() - self.startTime
+            result = SearchResult(ChessEngine.Move(pv[0]), score, depth, list(map(ChessEngine.Move, pv)), self.nodes,
+                                  seconds, self.tt.hitRate(), self.tt.hashfull())
+            if info is not None:
+                info(result)
+            if self.stopped or (result.isMate() and MATE - abs(score) <= depth):
+                break
+            # the next depth takes several times longer than this one, do not start what cannot finish
+            if self.deadline is not None and time.perf_counter() + seconds * 2 > self.deadline:
+                break
+        return result
+
+    def checkLimits(self):
+        if self.stopRequested or (self.stopFlag is not None and self.stopFlag[0]):
+            self.stopped = True
+        elif self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.stopped = True
+        elif self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            self.stopped = True
+
+    def negamax(self, gs, depth, alpha, beta, ply):
+        self.pv[ply] = []
+        inCheck = gs.inCheck()
+        if inCheck:
+            depth += 1
+        if depth <= 0:
+            return self.quiescence(gs, alpha, beta, ply)
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.checkLimits()
+        if self.stopped:
+            return 0
+        if ply >= MAX_PLY:
+            return self.evaluate(gs)
+        # a position repeated since the root, or in the game before it, is scored as the draw it can be forced into
+        if ply > 0 and (gs.halfmoveClock >= 100 or gs.isRepetition()):
+            return 0
+        if self.tablebases is not None and ply > 0:
+            score = self.tablebases.score(gs, ply, MATE)
+            if score is not None:
+                return score
+
+        key = gs.hashKey
+        ttMove = 0
+        entry = self.tt.probe(key)
+        if entry is not None:
+            ttMove, ttScore, ttDepth, bound = entry
+            if ply > 0 and ttDepth >= depth:
+                ttScore = scoreFromTT(ttScore, ply)
+                if (bound == EXACT or (bound == LOWER and ttScore >= beta)
+                        or (bound == UPPER and ttScore <= alpha)):
+                    return ttScore
+
+        if ply == 0 and self.rootMoves is not None:
+            moves = list(self.rootMoves)
+        else:
+            moves = gs.getValidMoveCodes(self.buffers[ply])
+        if not moves:
+            return -MATE + ply if inCheck else 0
+        self.orderMoves(moves, ttMove, ply)
+
+        originalAlpha = alpha
+        bestScore = -INFINITY
+        bestMove = 0
+        for move in moves:
+            gs.makeMove(move)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if self.stopped:
+                return 0
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+                if score > alpha:
+                    alpha = score
+                    self.pv[ply] = [move] + self.pv[ply + 1]
+                    if score >= beta:
+                        if (move >> 16) & 15 == EMPTY and not move & PROMOTION:
+                            self.storeKiller(move, ply)
+                            self.history[(move >> 12) & 15][(move >> 6) & 63] += depth * depth
+                        break
+
+        if bestScore >= beta:
+            bound = LOWER
+        elif bestScore > originalAlpha:
+            bound = EXACT
+        else:
+            bound = UPPER
+        self.tt.store(key, bestMove, scoreToTT(bestScore, ply), depth, bound)
+        return bestScore
+
+    # only captures are searched unless in check, so the score a leaf returns is not in the middle of an exchange
+    def quiescence(self, gs, alpha, beta, ply):
+        self.pv[ply] = []
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.checkLimits()
+        if self.stopped:
+            return 0
+        if ply >= MAX_PLY:
+            return self.evaluate(gs)
+
+        if gs.inCheck():
+            moves = gs.getValidMoveCodes(self.buffers[ply])
+            if not moves:
+                return -MATE + ply
+            bestScore = -INFINITY
+        else:
+            bestScore = self.evaluate(gs) # standing pat, the side to move does not have to capture
+            if bestScore >= beta:
+                return bestScore
+            alpha = max(alpha, bestScore)
+            moves = gs.getValidMoveCodes(self.buffers[ply], capturesOnly=True)
+        self.orderMoves(moves, 0, ply)
+
+        for move in moves:
+            gs.makeMove(move)
+            score = -self.quiescence(gs, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if self.stopped:
+                return 0
+            if score > bestScore:
+                bestScore = score
+                if score > alpha:
+                    alpha = score
+                    self.pv[ply] = [move] + self.pv[ply + 1]
+                    if score >= beta:
+                        break
+        return bestScore
+
+    def orderMoves(self, moves, ttMove, ply):
+        killer1, killer2 = self.killers[ply]
+        history = self.history
+
+        def moveScore(move):
+            if move == ttMove:
+                return 1 << 30
+            gain = PIECE_VALUES[(move >> 16) & 15]
+            if move & PROMOTION:
+                gain += PIECE_VALUES[promotedPiece(move)]
+            if gain: # most valuable victim (or promotion) first, least valuable attacker breaks ties
+                return (1 << 29) + gain * 16 - PIECE_VALUES[(move >> 12) & 15] // 16
+            if move == killer1:
+                return (1 << 28) + 1
+            if move == killer2:
+                return 1 << 28
+            return history[(move >> 12) & 15][(move >> 6) & 63]
+        moves.sort(key=moveScore, reverse=True)
+
+    def storeKiller(self, move, ply):
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search a position and print the best move")
+    parser.add_argument("--fen", default=ChessEngine.START_FEN)
+    parser.add_argument("--depth", type=int, default=MAX_PLY - 1)
+    parser.add_argument("--time", type=float, default=None, help="seconds to search")
+    parser.add_argument("--nodes", type=int, default=None)
+    parser.add_argument("--hash", type=int, default=16, help="transposition table size in MB")
+    parser.add_argument("--tablebases", default=None, help="directory of tables made with Tablebase.py")
+    args = parser.parse_args(argv)
+    if args.time is None and args.nodes is None and args.depth == MAX_PLY - 1:
+        args.time = 5.0
+
+    searcher = Searcher(args.hash)
+    if args.tablebases is not None:
+        searcher.tablebases = Tablebases(args.tablebases)
+    result = searcher.search(ChessEngine.GameState(fen=args.fen), args.depth, args.time, args.nodes, info=print)
+    print("bestmove", result.bestMove.getChessNotation() if result.bestMove is not None else "(none)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
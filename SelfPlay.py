@@ -0,0 +1,523 @@
+"""
+Engine against engine matches, to tell whether a change made the engine stronger or faster. Each engine is a UCI
+command line, this tree's Uci.py by default, so a change is tested by pointing the other side at a checkout of the old
+code. Nothing but Python and the two engines is needed.
+
+Every opening is played twice with the colors swapped. Several games run at once, each slot keeps one process per
+engine for all its games, and the board is kept here: an engine that plays an illegal move, crashes, hangs or
+oversteps its clock loses. The result is the Elo difference of the first engine with its 95% confidence interval,
+with --sprt the match stops as soon as the sequential probability ratio test accepts one of its two hypotheses. The
+nodes per second of each engine come from its info lines, the time per move from the wall clock.
+
+python SelfPlay.py --engine "python Uci.py" --engine "python ../baseline/Uci.py" --games 2000 --nodes 20000
+python SelfPlay.py --games 400 --tc 10+0.1 --concurrency 8 --sprt 0 5 --pgn games.pgn --openings openings.epd
+"""
+import argparse
+import datetime
+import math
+import os
+import queue
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import ChessEngine
+import Pgn
+
+UCI_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Uci.py")
+DEFAULT_NODES = 5000 # nodes per move when no limit is given, the same on any machine and under any load
+START_TIMEOUT = 30.0 # seconds an engine gets to answer uci and isready
+HANG_TIMEOUT = 300.0 # seconds a move without a time limit may take before the engine counts as hung
+MOVE_GRACE = 1.0 # seconds past movetime before the engine counts as hung, clocks have no grace
+MAX_PLIES = 400 # games still going after this many plies are scored as draws
+Z_95 = 1.959964
+# main lines of common openings, every one is played with both colors
+OPENINGS = [
+    "e4 e5 Nf3 Nc6 Bb5 a6", "e4 e5 Nf3 Nc6 Bc4 Bc5", "e4 e5 Nf3 Nf6", "e4 c5 Nf3 d6 d4 cxd4 Nxd4 Nf6 Nc3 a6",
+    "e4 c5 Nf3 Nc6 d4 cxd4 Nxd4", "e4 c5 c3", "e4 e6 d4 d5 Nc3 Bb4", "e4 e6 d4 d5 e5 c5", "e4 c6 d4 d5 e5 Bf5",
+    "e4 d5 exd5 Qxd5 Nc3 Qa5", "e4 d6 d4 Nf6 Nc3 g6", "d4 d5 c4 e6 Nc3 Nf6", "d4 d5 c4 c6 Nf3 Nf6", "d4 d5 c4 dxc4",
+    "d4 Nf6 c4 g6 Nc3 Bg7 e4 d6", "d4 Nf6 c4 e6 Nc3 Bb4", "d4 Nf6 c4 e6 Nf3 b6", "d4 Nf6 c4 c5 d5 b5", "d4 f5 g3 Nf6",
+    "c4 e5 Nc3 Nf6", "c4 c5 Nf3 Nc6 Nc3", "Nf3 d5 g3 Nf6 Bg2", "Nf3 Nf6 c4 b6", "g3 d5 Bg2 Nf6",
+]
+
+
+class EngineError(Exception):
+    pass
+
+
+# a UCI engine process, lines from it are read on a thread so every wait can time out
+class EngineProcess():
+    def __init__(self, command, options=()):
+        self.command = command
+        self.name = command
+        self.process = subprocess.Popen(shlex.split(command), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        self.lines = queue.Queue()
+        threading.Thread(target=self.read, daemon=True).start()
+        self.send("uci")
+        for line in self.readUntil("uciok", START_TIMEOUT):
+            if line.startswith("id name "):
+                self.name = line[8:]
+        for name, value in options:
+            self.send("setoption name %s value %s" % (name, value))
+        self.waitReady()
+
+    def read(self):
+        for line in self.process.stdout:
+            self.lines.put(line.strip())
+        self.lines.put(None)
+
+    def send(self, line):
+        try:
+            self.process.stdin.write(line + "\n")
+            self.process.stdin.flush()
+        except OSError:
+            raise EngineError("engine exited")
+
+    # the lines up to and including the first one starting with prefix
+    def readUntil(self, prefix, timeout=None):
+        deadline = time.perf_counter() + timeout if timeout is not None else None
+        lines = []
+        while True:
+            try:
+                line = self.lines.get(timeout=max(deadline - time.perf_counter(), 0) if deadline else None)
+            except queue.Empty:
+                raise EngineError("engine hung")
+            if line is None:
+                raise EngineError("engine exited")
+            lines.append(line)
+            if line.startswith(prefix):
+                return lines
+
+    def waitReady(self):
+        self.send("isready")
+        self.readUntil("readyok", START_TIMEOUT)
+
+    def newGame(self):
+        self.send("ucinewgame")
+        self.waitReady()
+
+    # asks for a move, returns (UCI move, nodes, seconds) with the nodes and time of the engine's last info line
+    def go(self, fen, moves, goArgs, timeout):
+        self.send("position fen %s%s" % (fen, " moves " + " ".join(moves) if moves else ""))
+        self.send("go " + goArgs)
+        lines = self.readUntil("bestmove", timeout)
+        nodes, seconds = 0, 0.0
+        for line in reversed(lines):
+            words = line.split()
+            if words[0] == "info" and "nodes" in words and "time" in words:
+                nodes = int(words[words.index("nodes") + 1])
+                seconds = int(words[words.index("time") + 1]) / 1000
+                break
+        words = lines[-1].split()
+        return words[1] if len(words) > 1 else "0000", nodes, seconds
+
+    def isAlive(self):
+        return self.process.poll() is None
+
+    def close(self):
+        try:
+            self.send("quit")
+            self.process.wait(1)
+        except (EngineError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+
+class Limits():
+    # nodes, depth and movetime (seconds) per move, or a clock of base seconds plus increment seconds per move
+    def __init__(self, nodes=None, depth=None, movetime=None, base=None, increment=0.0):
+        self.nodes = nodes
+        self.depth = depth
+        self.movetime = movetime
+        self.base = base
+        self.increment = increment
+
+    # the arguments of go and how long to wait for the reply
+    def goArgs(self, clock):
+        if clock is not None:
+            return ("wtime %d btime %d winc %d binc %d" % (clock[0] * 1000, clock[1] * 1000, self.increment * 1000,
+                                                          self.increment * 1000)), None
+        args = []
+        if self.nodes is not None:
+            args.append("nodes %d" % self.nodes)
+        if self.depth is not None:
+            args.append("depth %d" % self.depth)
+        if self.movetime is not None:
+            args.append("movetime %d" % (self.movetime * 1000))
+            return " ".join(args), self.movetime + MOVE_GRACE
+        return " ".join(args), HANG_TIMEOUT
+
+    def describe(self):
+        if self.base is not None:
+            return "%g+%g" % (self.base, self.increment)
+        parts = [("nodes=%d" % self.nodes) if self.nodes else "", ("depth=%d" % self.depth) if self.depth else "",
+                 ("movetime=%g" % self.movetime) if self.movetime else ""]
+        return " ".join(part for part in parts if part)
+
+
+class GameRecord():
+    def __init__(self, index, fen, white):
+        self.index = index
+        self.fen = fen
+        self.white = white # index of the engine that had white, the other one had black
+        self.startPly = 0
+        self.moves = [] # SAN
+        self.result = "*"
+        self.reason = None
+        self.moveTimes = ([], []) # wall clock seconds per move, by color
+        self.nodes = [0, 0] # as reported by the engines, by color
+        self.seconds = [0.0, 0.0]
+
+    # 1, 0.5 or 0 for the first engine
+    def score(self):
+        points = {"1-0": 1.0, "0-1": 0.0}.get(self.result, 0.5)
+        return points if self.white == 0 else 1.0 - points
+
+
+def gameOverReason(gs):
+    if not gs.getValidMoveCodes():
+        return "checkmate" if gs.inCheck() else "stalemate"
+    if gs.isFiftyMoveRule():
+        return "fifty moves"
+    if gs.isThreefoldRepetition():
+        return "repetition"
+    return "insufficient material"
+
+# plays one game from fen between white and black (EngineProcesses) and returns its GameRecord
+def playGame(index, white, black, whiteIndex, fen, limits, maxPlies=MAX_PLIES):
+    record = GameRecord(index, fen, whiteIndex)
+    gs = ChessEngine.GameState(fen=fen)
+    record.startPly = gs.firstPly
+    engines = (white, black)
+    for engine in engines:
+        engine.newGame()
+    clock = [limits.base, limits.base] if limits.base is not None else None
+    played = [] # UCI
+    while True:
+        result = gs.gameResult()
+        if result is not None:
+            record.result, record.reason = result, gameOverReason(gs)
+            return record
+        if len(played) >= maxPlies:
+            record.result, record.reason = "1/2-1/2", "adjudicated after %d plies" % maxPlies
+            return record
+        side = 0 if gs.whiteToMove else 1
+        loss = "0-1" if side == 0 else "1-0"
+        goArgs, timeout = limits.goArgs(clock)
+        start = time.perf_counter()
+        try:
+            uci, nodes, seconds = engines[side].go(fen, played, goArgs, clock[side] + MOVE_GRACE if clock else timeout)
+        except EngineError as e:
+            record.result, record.reason = loss, str(e)
+            return record
+        elapsed = time.perf_counter() - start
+        record.moveTimes[side].append(elapsed)
+        record.nodes[side] += nodes
+        record.seconds[side] += seconds
+        if clock is not None:
+            clock[side] -= elapsed
+            if clock[side] < 0:
+                record.result, record.reason = loss, "time forfeit"
+                return record
+            clock[side] += limits.increment
+        try:
+            move = gs.moveFromUci(uci)
+        except ValueError:
+            record.result, record.reason = loss, "illegal move " + uci
+            return record
+        record.moves.append(gs.moveToSan(move))
+        played.append(uci)
+        gs.makeMove(move)
+
+
+# Elo difference for a score fraction, infinite for a clean sweep
+def eloFromScore(score):
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return 400 * math.log10(score / (1 - score))
+
+def scoreFromElo(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+# mean score and the variance of a single game's score
+def scoreStats(wins, draws, losses):
+    games = wins + draws + losses
+    if not games:
+        return 0.5, 0.0
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    return score, variance
+
+# (elo, low, high), the interval from the normal approximation of the mean score
+def eloInterval(wins, draws, losses, z=Z_95):
+    games = wins + draws + losses
+    score, variance = scoreStats(wins, draws, losses)
+    margin = z * math.sqrt(variance / games) if games else 0.0
+    return eloFromScore(score), eloFromScore(score - margin), eloFromScore(score + margin)
+
+# log likelihood ratio of elo1 against elo0 with the game scores taken as normally distributed (GSPRT)
+def sprtLlr(wins, draws, losses, elo0, elo1):
+    games = wins + draws + losses
+    score, variance = scoreStats(wins, draws, losses)
+    if not variance:
+        return 0.0
+    s0, s1 = scoreFromElo(elo0), scoreFromElo(elo1)
+    return games * (s1 - s0) * (2 * score - s0 - s1) / (2 * variance)
+
+# (lower, upper), H0 is accepted below lower and H1 above upper
+def sprtBounds(alpha=0.05, beta=0.05):
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+# start positions from a FEN/EPD file (one per line) or the final positions of the games in a PGN file
+def loadOpenings(path):
+    with open(path, encoding="utf-8", errors="replace") as f:
+        if path.endswith(".pgn"):
+            fens = []
+            for game in Pgn.readGames(f):
+                gs = None
+                for _, _, gs in game.replay():
+                    pass
+                fens.append(gs.getFen() if gs is not None else game.startFen())
+            return fens
+        from BatchAnalysis import readFens
+        return list(readFens(f))
+
+def openingFens(lines=OPENINGS):
+    fens = []
+    for line in lines:
+        gs = ChessEngine.GameState(fen=ChessEngine.START_FEN)
+        for san in line.split():
+            gs.makeMove(gs.moveFromSan(san))
+        fens.append(gs.getFen())
+    return fens
+
+
+class Match():
+    # commands are the two engine command lines, options (name, value) pairs sent to both
+    def __init__(self, commands, limits, openings, games, concurrency, options=(), maxPlies=MAX_PLIES, sprt=None,
+                 pgnPath=None, out=sys.stdout):
+        self.commands = commands
+        self.limits = limits
+        self.openings = openings
+        self.games = games
+        self.concurrency = max(1, min(concurrency, games))
+        self.options = options
+        self.maxPlies = maxPlies
+        self.sprt = sprt # (elo0, elo1, alpha, beta) or None
+        self.pgnPath = pgnPath
+        self.out = out
+        self.names = list(commands)
+        self.wins = self.draws = self.losses = 0
+        self.moveTimes = ([], []) # by engine
+        self.nodes = [0, 0]
+        self.seconds = [0.0, 0.0]
+        self.reasons = {}
+        self.decision = None
+
+    # one slot plays games off jobs until there are none left or the match is stopped
+    def slot(self, jobs, results, stop):
+        engines = [None, None]
+        try:
+            while not stop.is_set():
+                try:
+                    index = jobs.get_nowait()
+                except queue.Empty:
+                    break
+                for i in (0, 1):
+                    if engines[i] is None or not engines[i].isAlive():
+                        if engines[i] is not None:
+                            engines[i].close()
+                        engines[i] = EngineProcess(self.commands[i], self.options)
+                        self.names[i] = engines[i].name
+                whiteIndex = index % 2
+                fen = self.openings[(index // 2) % len(self.openings)]
+                record = playGame(index, engines[whiteIndex], engines[1 - whiteIndex], whiteIndex, fen, self.limits,
+                                  self.maxPlies)
+                if record.reason in ("engine hung", "engine exited"):
+                    loser = whiteIndex if record.result == "0-1" else 1 - whiteIndex
+                    engines[loser].close() # started again for the next game
+                results.put(record)
+        except (EngineError, OSError) as e:
+            results.put(e)
+        finally:
+            for engine in engines:
+                if engine is not None:
+                    engine.close()
+            results.put(None)
+
+    def run(self):
+        jobs = queue.Queue()
+        for index in range(self.games):
+            jobs.put(index)
+        results = queue.Queue()
+        stop = threading.Event()
+        threads = [threading.Thread(target=self.slot, args=(jobs, results, stop), daemon=True)
+                   for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        pgn = open(self.pgnPath, "w") if self.pgnPath else None
+        running = len(threads)
+        try:
+            while running:
+                record = results.get()
+                if record is None:
+                    running -= 1
+                elif isinstance(record, Exception):
+                    stop.set()
+                    raise record
+                else:
+                    self.add(record)
+                    if pgn is not None:
+                        pgn.write(self.pgnText(record))
+                        pgn.flush()
+                    print(self.progressLine(), file=self.out)
+                    if self.decision is not None:
+                        stop.set()
+        finally:
+            stop.set()
+            if pgn is not None:
+                pgn.close()
+        return self
+
+    def add(self, record):
+        score = record.score()
+        if score == 1:
+            self.wins += 1
+        elif score == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+        for color in (0, 1):
+            engine = record.white if color == 0 else 1 - record.white
+            self.moveTimes[engine].extend(record.moveTimes[color])
+            self.nodes[engine] += record.nodes[color]
+            self.seconds[engine] += record.seconds[color]
+        self.reasons[record.reason] = self.reasons.get(record.reason, 0) + 1
+        if self.sprt is not None and self.decision is None:
+            elo0, elo1, alpha, beta = self.sprt
+            llr = sprtLlr(self.wins, self.draws, self.losses, elo0, elo1)
+            lower, upper = sprtBounds(alpha, beta)
+            if llr <= lower:
+                self.decision = "H0 accepted (elo <= %g)" % elo0
+            elif llr >= upper:
+                self.decision = "H1 accepted (elo >= %g)" % elo1
+
+    def played(self):
+        return self.wins + self.draws + self.losses
+
+    def displayNames(self):
+        if self.names[0] == self.names[1]:
+            return ["%s (%d)" % (name, i + 1) for i, name in enumerate(self.names)]
+        return self.names
+
+    def pgnText(self, record):
+        names = self.displayNames()
+        headers = {"Event": "SelfPlay", "Site": "?", "Date": datetime.date.today().strftime("%Y.%m.%d"),
+                   "Round": record.index + 1, "White": names[record.white], "Black": names[1 - record.white],
+                   "TimeControl": self.limits.describe(), "Termination": record.reason}
+        if record.fen != ChessEngine.START_FEN:
+            headers["SetUp"] = "1"
+            headers["FEN"] = record.fen
+        return Pgn.formatGame(headers, record.moves, record.result, record.startPly)
+
+    def progressLine(self):
+        elo, low, high = eloInterval(self.wins, self.draws, self.losses)
+        line = "game %d/%d  +%d =%d -%d  elo %.1f [%.1f, %.1f]" % (self.played(), self.games, self.wins, self.draws,
+                                                                  self.losses, elo, low, high)
+        if self.sprt is not None:
+            elo0, elo1, alpha, beta = self.sprt
+            lower, upper = sprtBounds(alpha, beta)
+            line += "  llr %.2f [%.2f, %.2f]" % (sprtLlr(self.wins, self.draws, self.losses, elo0, elo1), lower, upper)
+        return line
+
+    def report(self):
+        names = self.displayNames()
+        games = self.played()
+        elo, low, high = eloInterval(self.wins, self.draws, self.losses)
+        score, _ = scoreStats(self.wins, self.draws, self.losses)
+        lines = ["%s vs %s: +%d =%d -%d in %d games, score %.1f%%" % (names[0], names[1], self.wins, self.draws,
+                                                                     self.losses, games, score * 100),
+                 "elo difference %.1f, 95%% interval [%.1f, %.1f]" % (elo, low, high)]
+        if self.sprt is not None:
+            lines.append("sprt " + (self.decision or "inconclusive"))
+        lines.append("endings: " + ", ".join("%s %d" % (reason, count) for reason, count in
+                                              sorted(self.reasons.items(), key=lambda item: -item[1])))
+        for i in (0, 1):
+            times = self.moveTimes[i]
+            nps = self.nodes[i] / self.seconds[i] if self.seconds[i] > 0 else 0
+            lines.append("%s: %d moves  %d nps  time per move mean %.0fms p50 %.0fms p90 %.0fms p99 %.0fms max %.0fms"
+                         % (names[i], len(times), nps, sum(times) / len(times) * 1000 if times else 0,
+                            percentile(times, 0.5) * 1000, percentile(times, 0.9) * 1000,
+                            percentile(times, 0.99) * 1000, max(times, default=0) * 1000))
+        return "\n".join(lines)
+
+
+def parseOption(text):
+    name, separator, value = text.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError("options are NAME=VALUE")
+    return name.strip(), value.strip()
+
+def parseTimeControl(text):
+    base, _, increment = text.partition("+")
+    try:
+        return float(base), float(increment or 0)
+    except ValueError:
+        raise argparse.ArgumentTypeError("time controls are BASE+INCREMENT in seconds, e.g. 10+0.1")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play two UCI engines against each other and compare them")
+    parser.add_argument("--engine", action="append", default=[], help="engine command line, given once or twice")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=os.cpu_count() or 1, help="games played at once")
+    parser.add_argument("--nodes", type=int, default=None, help="nodes per move")
+    parser.add_argument("--depth", type=int, default=None, help="depth per move")
+    parser.add_argument("--movetime", type=float, default=None, help="seconds per move")
+    parser.add_argument("--tc", type=parseTimeControl, default=None, help="clock, BASE+INCREMENT seconds")
+    parser.add_argument("--openings", default=None, help="FEN/EPD or PGN file of start positions")
+    parser.add_argument("--option", type=parseOption, action="append", default=[], help="NAME=VALUE for both")
+    parser.add_argument("--max-plies", type=int, default=MAX_PLIES, help="adjudicate longer games as draws")
+    parser.add_argument("--sprt", type=float, nargs=2, default=None, metavar=("ELO0", "ELO1"),
+                        help="stop once H0 (elo <= ELO0) or H1 (elo >= ELO1) is accepted")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    parser.add_argument("--pgn", default=None, help="write the games to this file")
+    args = parser.parse_args(argv)
+    if len(args.engine) > 2:
+        parser.error("at most two engines")
+    default = "%s %s" % (shlex.quote(sys.executable), shlex.quote(UCI_SCRIPT))
+    commands = args.engine + [default] * (2 - len(args.engine))
+
+    if args.tc is not None:
+        limits = Limits(base=args.tc[0], increment=args.tc[1])
+    elif args.nodes is None and args.depth is None and args.movetime is None:
+        limits = Limits(nodes=DEFAULT_NODES)
+    else:
+        limits = Limits(args.nodes, args.depth, args.movetime)
+    openings = loadOpenings(args.openings) if args.openings else openingFens()
+    if not openings:
+        parser.error("no start positions in " + args.openings)
+    sprt = (args.sprt[0], args.sprt[1], args.alpha, args.beta) if args.sprt else None
+
+    start = time.perf_counter()
+    try:
+        match = Match(commands, limits, openings, args.games, args.concurrency, args.option, args.max_plies, sprt,
+                      args.pgn).run()
+    except (EngineError, OSError) as e:
+        print("engine failed to start: %s" % e, file=sys.stderr)
+        return 1
+    print(match.report())
+    print("%d games in %.1fs" % (match.played(), time.perf_counter() - start))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
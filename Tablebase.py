@@ -0,0 +1,539 @@
+"""
+Endgame tablebases for positions with up to four pieces, built by retrograde analysis on top of GameState's move
+generator. A table covers one material set (e.g. KRvK) with one byte per position and side to move: 0 for a draw, 255
+for a position that cannot occur, otherwise the plies to mate plus one, odd when the side to move is the one getting
+mated. Tables are written as plain files and memory-mapped, so a probe is an index computation and one byte read.
+
+Positions are indexed by the squares of the white king, the black king and the other pieces in table order. The board
+is turned so the white king is in the a1-d1-d4 triangle (on files a-d when there are pawns), which keeps 10 (32) of
+the 64 white king squares, and identical pieces are kept in ascending square order. Tables are only stored with the
+stronger side as white, KvKR is probed as KRvK with the colors swapped.
+
+Generation starts from the mates and works backwards: a position with a move to a lost position is won, a position
+whose moves all lead to won positions is lost. Captures and promotions leave the table and are looked up in the
+smaller tables, which are generated first. The first pass over the table, which runs the move generator on every
+position, is split over a process pool. Castling, en passant and the fifty move rule are not part of the tables.
+
+python Tablebase.py generate KRvK KQvK KPvK --dir tablebases --workers 8
+python Tablebase.py generate --all 3 --dir tablebases     every three piece table
+python Tablebase.py verify KRRvK --dir tablebases           check every stored value against the position's moves
+python Tablebase.py probe --dir tablebases --fen "4k3/8/8/8/8/8/4R3/4K3 w - - 0 1"
+"""
+import argparse
+import itertools
+import mmap
+import os
+import sys
+import time
+import ChessEngine
+from Bitboards import *
+
+INVALID = 255 # no such position, the squares overlap or the side that just moved is in check
+NO_CONVERSION = 255
+LETTERS = "PNBRQK" # indexed by piece type like Bitboards
+NAME_ORDER = "KQRBNP" # order of the pieces in a table name, strongest first
+# sort key of every piece in a table's square list: kings first, then the other white and the other black pieces
+TABLE_ORDER = [piece // 6 if piece % 6 == KING else 2 + piece // 6 * 6 + NAME_ORDER.index(LETTERS[piece % 6])
+               for piece in range(12)]
+
+# the eight ways to turn and mirror the board, as square maps
+TRANSFORMS = [[(f(r, c)[0] * 8 + f(r, c)[1]) for r in range(8) for c in range(8)] for f in (
+    lambda r, c: (r, c), lambda r, c: (r, 7 - c), lambda r, c: (7 - r, c), lambda r, c: (7 - r, 7 - c),
+    lambda r, c: (c, r), lambda r, c: (c, 7 - r), lambda r, c: (7 - c, r), lambda r, c: (7 - c, 7 - r))]
+TRIANGLE = [sq for sq in range(64) if (sq & 7) <= 3 and 7 - (sq >> 3) <= (sq & 7)] # a1-d1-d4
+LEFT_HALF = [sq for sq in range(64) if (sq & 7) <= 3]
+
+
+# byte of a position reached by a move, from the point of view of the side that moved into it
+def moverResult(value):
+    return value + 1 if value else 0
+
+# orders results from the point of view of the side to move: the fastest win, then a draw, then the slowest loss
+def resultRank(value):
+    if value == NO_CONVERSION:
+        return (-1, 0)
+    if value == 0:
+        return (1, 0)
+    return (2, -value) if not value & 1 else (0, value)
+
+# table name of a set of pieces (one count per piece index) and whether the colors have to be swapped to find it
+def materialName(counts):
+    white = "".join(letter * counts[LETTERS.index(letter)] for letter in NAME_ORDER)
+    black = "".join(letter * counts[LETTERS.index(letter) + 6] for letter in NAME_ORDER)
+    strength = lambda part: (len(part), [-NAME_ORDER.index(letter) for letter in part])
+    if strength(white) >= strength(black):
+        return white + "v" + black, False
+    return black + "v" + white, True
+
+# tables the captures and promotions of name lead to, KvK is a draw and has no table
+def dependencies(name):
+    white, black = name.split("v")
+    names = set()
+    for i in range(1, len(white)):
+        names.add(materialName(_counts(white[:i] + white[i + 1:], black))[0])
+        if white[i] == "P":
+            for letter in "QRBN":
+                names.add(materialName(_counts(white[:i] + letter + white[i + 1:], black))[0])
+    for i in range(1, len(black)):
+        names.add(materialName(_counts(white, black[:i] + black[i + 1:]))[0])
+        if black[i] == "P":
+            for letter in "QRBN":
+                names.add(materialName(_counts(white, black[:i] + letter + black[i + 1:]))[0])
+    names.discard("KvK")
+    return sorted(names)
+
+def _counts(white, black):
+    counts = [0] * 12
+    for letter in white:
+        counts[LETTERS.index(letter)] += 1
+    for letter in black:
+        counts[LETTERS.index(letter) + 6] += 1
+    return counts
+
+# every table name with pieces pieces in all, kings included
+def allNames(pieces):
+    names = set()
+    for extra in itertools.combinations_with_replacement(range(10), pieces - 2):
+        counts = [0] * 12
+        counts[KING] = counts[KING + 6] = 1
+        for piece in extra:
+            counts[piece if piece < 5 else piece + 1] += 1
+        names.add(materialName(counts)[0])
+    return sorted(names)
+
+
+class Layout():
+    def __init__(self, name):
+        white, black = name.split("v")
+        self.name = name
+        self.pieces = [KING, KING + 6] + [LETTERS.index(letter) for letter in white[1:]]
+        self.pieces += [LETTERS.index(letter) + 6 for letter in black[1:]]
+        self.hasPawns = PAWN in self.pieces or PAWN + 6 in self.pieces
+        self.kingSquares = LEFT_HALF if self.hasPawns else TRIANGLE
+        self.group = [0, 1] if self.hasPawns else range(8)
+        self.slotIndex = [-1] * 64
+        for i, sq in enumerate(self.kingSquares):
+            self.slotIndex[sq] = i
+        # transforms that bring a white king on each square into kingSquares
+        self.kingTransforms = [[t for t in self.group if self.slotIndex[TRANSFORMS[t][sq]] >= 0] for sq in range(64)]
+        self.runs = [] # (first, last + 1) of every group of identical pieces
+        i = 2
+        while i < len(self.pieces):
+            j = i
+            while j < len(self.pieces) and self.pieces[j] == self.pieces[i]:
+                j += 1
+            if j - i > 1:
+                self.runs.append((i, j))
+            i = j
+        self.size = len(self.kingSquares) * 64 ** (len(self.pieces) - 1)
+
+    def index(self, placement):
+        i = self.slotIndex[placement[0]]
+        if i < 0:
+            return -1
+        for sq in placement[1:]:
+            i = i * 64 + sq
+        return i
+
+    def placement(self, index):
+        rest = []
+        for _ in range(len(self.pieces) - 1):
+            rest.append(index & 63)
+            index >>= 6
+        return [self.kingSquares[index]] + rest[::-1]
+
+    # the turned and mirrored placement the table stores the position under
+    def canonical(self, placement):
+        transforms = self.kingTransforms[placement[0]]
+        if transforms == [0] and not self.runs:
+            return placement
+        best = None
+        for t in transforms:
+            transform = TRANSFORMS[t]
+            image = [transform[sq] for sq in placement]
+            for i, j in self.runs:
+                image[i:j] = sorted(image[i:j])
+            if best is None or image < best:
+                best = image
+        return best
+
+    def isValid(self, placement):
+        if len(set(placement)) != len(placement) or KING_ATTACKS[placement[0]] >> placement[1] & 1:
+            return False
+        for piece, sq in zip(self.pieces, placement):
+            if piece % 6 == PAWN and (sq < 8 or sq >= 56):
+                return False
+        return self.canonical(placement) == placement
+
+
+class Tablebases():
+    # opens the tables in directory lazily, a missing directory just has no tables
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+        names = [name[:-3] for name in os.listdir(directory) if name.endswith(".tb")] if os.path.isdir(directory) else []
+        self.maxPieces = max((len(name) - 1 for name in names), default=0)
+        self.hits = 0
+
+    def table(self, name):
+        if name not in self.tables:
+            path = os.path.join(self.directory, name + ".tb")
+            table = None
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    table = (Layout(name), mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            self.tables[name] = table
+        return self.tables[name]
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table[1].close()
+        self.tables = {}
+
+    # value byte of the position with pieces on placement (parallel lists), None if there is no table for it
+    def probePlacement(self, pieces, placement, whiteToMove):
+        counts = [0] * 12
+        for piece in pieces:
+            counts[piece] += 1
+        name, swapped = materialName(counts)
+        if name == "KvK":
+            return 0
+        table = self.table(name)
+        if table is None:
+            return None
+        layout, data = table
+        if swapped: # black becomes white and the board is flipped top to bottom so pawns still move the right way
+            pieces = [(piece + 6) % 12 for piece in pieces]
+            placement = [sq ^ 56 for sq in placement]
+            whiteToMove = not whiteToMove
+        ordered = [sq for _, sq in sorted(zip((TABLE_ORDER[piece] for piece in pieces), placement))]
+        return data[(0 if whiteToMove else layout.size) + layout.index(layout.canonical(ordered))]
+
+    # (1 win, 0 draw or -1 loss for the side to move, plies to mate) or None if gs is not covered by a table
+    def probe(self, gs):
+        if popCount(gs.occupied) > self.maxPieces or gs.castlingRights() or gs.enPassantKey():
+            return None
+        pieces = []
+        placement = []
+        for piece in range(12):
+            for sq in squares(gs.pieces[piece]):
+                pieces.append(piece)
+                placement.append(sq)
+        value = self.probePlacement(pieces, placement, gs.whiteToMove)
+        if value is None or value == INVALID:
+            return None
+        if value == 0:
+            return 0, 0
+        return (-1 if value & 1 else 1), value - 1
+
+    # search score of gs found ply plies from the root, None if no table covers it
+    def score(self, gs, ply, mate):
+        result = self.probe(gs)
+        if result is None:
+            return None
+        self.hits += 1
+        wdl, plies = result
+        if wdl == 0:
+            return 0
+        return mate - ply - plies if wdl > 0 else -mate + ply + plies
+
+
+def setPosition(gs, pieces, placement, whiteToMove):
+    gs.pieces = [0] * 12
+    gs.squares = [EMPTY] * 64
+    for piece, sq in zip(pieces, placement):
+        gs.pieces[piece] |= 1 << sq
+        gs.squares[sq] = piece
+    gs.updateOccupancy()
+    gs.whiteToMove = whiteToMove
+    gs.enPassantSq = None
+
+# pieces and placement of the position move leads to, the moved piece keeps its slot and a captured one is removed
+def childPosition(pieces, placement, move):
+    origin, end = move & 63, (move >> 6) & 63
+    captured = (move >> 16) & 15
+    promoted = ChessEngine.promotedPiece(move)
+    childPieces = list(pieces)
+    childPlacement = list(placement)
+    mover = placement.index(origin)
+    childPlacement[mover] = end
+    if promoted != EMPTY:
+        childPieces[mover] = promoted
+    if captured != EMPTY:
+        taken = placement.index(end)
+        del childPieces[taken]
+        del childPlacement[taken]
+    return childPieces, childPlacement
+
+# First pass over positions start to stop of table name (white to move positions first, then black to move). Returns
+# the value bytes (mates, stalemates and invalid positions filled in), the number of different positions the moves
+# lead to without leaving the table and the best result of the moves that leave it, as three byte strings
+def _initChunk(name, directory, start, stop):
+    layout = Layout(name)
+    tables = Tablebases(directory)
+    gs = ChessEngine.GameState(fen="8/8/8/8/8/8/8/8 w - - 0 1")
+    values = bytearray(stop - start)
+    counts = bytearray(stop - start)
+    conversions = bytearray([NO_CONVERSION]) * (stop - start)
+    pieces = layout.pieces
+    moves = []
+    for pos in range(start, stop):
+        i = pos - start
+        side = WHITE if pos < layout.size else BLACK
+        placement = layout.placement(pos % layout.size)
+        if not layout.isValid(placement):
+            values[i] = INVALID
+            continue
+        setPosition(gs, pieces, placement, side == WHITE)
+        if gs.attackersTo(placement[1 - side], gs.occupied, side):
+            values[i] = INVALID
+            continue
+        gs.getValidMoveCodes(moves)
+        if not moves:
+            values[i] = 1 if gs.inCheck() else 0
+            continue
+        best = NO_CONVERSION
+        children = set() # moves into images of the same position are counted once, as predecessors finds them
+        for move in moves:
+            if (move >> 16) & 15 == EMPTY and not move & ChessEngine.PROMOTION:
+                children.add(layout.index(layout.canonical(childPosition(pieces, placement, move)[1])))
+                continue
+            childPieces, childPlacement = childPosition(pieces, placement, move)
+            value = tables.probePlacement(childPieces, childPlacement, side == BLACK)
+            if value is None:
+                raise ValueError("%s needs the table for %s" % (name, materialName(
+                    [childPieces.count(p) for p in range(12)])[0]))
+            result = moverResult(value)
+            if resultRank(result) > resultRank(best):
+                best = result
+        counts[i] = len(children)
+        conversions[i] = best
+    tables.close()
+    return bytes(values), bytes(counts), bytes(conversions)
+
+# Positions start to stop of the finished table name whose stored value is not the best result over their moves,
+# as (position, stored value, best value), at most limit of them
+def _verifyChunk(name, directory, start, stop, limit=20):
+    layout = Layout(name)
+    tables = Tablebases(directory)
+    data = tables.table(name)[1]
+    gs = ChessEngine.GameState(fen="8/8/8/8/8/8/8/8 w - - 0 1")
+    pieces = layout.pieces
+    moves = []
+    wrong = []
+    for pos in range(start, stop):
+        stored = data[pos]
+        if stored == INVALID:
+            continue
+        side = WHITE if pos < layout.size else BLACK
+        placement = layout.placement(pos % layout.size)
+        setPosition(gs, pieces, placement, side == WHITE)
+        gs.getValidMoveCodes(moves)
+        if not moves:
+            best = 1 if gs.inCheck() else 0
+        else:
+            best = None
+            for move in moves:
+                result = moverResult(tables.probePlacement(*childPosition(pieces, placement, move), side == BLACK))
+                if best is None or resultRank(result) > resultRank(best):
+                    best = result
+        if best != stored:
+            wrong.append((pos, stored, best))
+            if len(wrong) >= limit:
+                break
+    tables.close()
+    return wrong
+
+# the indexes of every position from which mover's last move reaches placement without leaving the table, each one
+# once. An un-move can carry a piece past a twin, so the placement it gives is put in table order before it is indexed
+def predecessors(layout, placement, mover):
+    found = set()
+    occupied = 0
+    for sq in placement:
+        occupied |= 1 << sq
+    empty = ~occupied & FULL
+    for i, piece in enumerate(layout.pieces):
+        if piece // 6 != mover:
+            continue
+        sq = placement[i]
+        kind = piece % 6
+        if kind == KING:
+            targets = KING_ATTACKS[sq] & empty
+        elif kind == KNIGHT:
+            targets = KNIGHT_ATTACKS[sq] & empty
+        elif kind == BISHOP:
+            targets = bishopAttacks(sq, occupied) & empty
+        elif kind == ROOK:
+            targets = rookAttacks(sq, occupied) & empty
+        elif kind == QUEEN:
+            targets = queenAttacks(sq, occupied) & empty
+        else: # pawns step back, white pawns move towards row 0
+            step = 8 if mover == WHITE else -8
+            back = sq + step
+            targets = 0
+            if 8 <= back < 56 and empty >> back & 1:
+                targets = 1 << back
+                if (sq >> 3) == (4 if mover == WHITE else 3) and empty >> (back + step) & 1:
+                    targets |= 1 << (back + step)
+        for target in squares(targets):
+            pred = list(placement)
+            pred[i] = target
+            found.add(layout.index(layout.canonical(pred)))
+    return found
+
+# results of function(name, directory, start, stop) over chunks of the total positions, in order, on workers processes
+def _runChunks(function, name, directory, total, workers):
+    chunk = max(total // (workers * 8), 4096)
+    ranges = [(i, min(i + chunk, total)) for i in range(0, total, chunk)]
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor # only generating needs it, probing should load fast
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(function, name, directory, lo, hi) for lo, hi in ranges]
+            return [future.result() for future in futures]
+    return [function(name, directory, lo, hi) for lo, hi in ranges]
+
+# builds the table for name in directory, and first every smaller table it depends on that is missing. Returns the
+# (wins, draws, losses) counted over white to move positions
+def generate(name, directory, workers=1, log=sys.stderr):
+    for dependency in dependencies(name):
+        if not os.path.exists(os.path.join(directory, dependency + ".tb")):
+            generate(dependency, directory, workers, log)
+    os.makedirs(directory, exist_ok=True)
+    start = time.perf_counter()
+    layout = Layout(name)
+    size = layout.size
+    total = size * 2
+
+    values, counts, conversions = bytearray(), bytearray(), bytearray()
+    for part in _runChunks(_initChunk, name, directory, total, workers):
+        values += part[0]
+        counts += part[1]
+        conversions += part[2]
+
+    # pending[plies] holds (position, value) pairs whose value is settled once every shorter mate has been found
+    pending = {}
+    for pos in range(total):
+        value = values[pos]
+        if value == INVALID:
+            continue
+        conversion = conversions[pos]
+        if value == 1:
+            pending.setdefault(0, []).append((pos, 1))
+        elif conversion != NO_CONVERSION and conversion and not conversion & 1: # a capture or promotion wins
+            pending.setdefault(conversion - 1, []).append((pos, conversion))
+        elif counts[pos] == 0 and conversion != NO_CONVERSION and conversion & 1: # every move leaves and loses
+            pending.setdefault(conversion - 1, []).append((pos, conversion))
+
+    done = bytearray(total)
+    while pending:
+        plies = min(pending)
+        if plies >= INVALID - 2:
+            raise ValueError("%s has mates longer than a table byte can hold" % name)
+        for pos, value in pending.pop(plies):
+            if done[pos] or values[pos] not in (0, value):
+                continue
+            values[pos] = value
+            done[pos] = 1
+            mover = BLACK if pos < size else WHITE # the side that moved into pos
+            offset = 0 if mover == WHITE else size
+            for index in predecessors(layout, layout.placement(pos % size), mover):
+                pred = offset + index
+                if values[pred] or done[pred]:
+                    continue
+                if value & 1: # the side to move in pos is mated, moving there wins
+                    conversion = conversions[pred]
+                    if conversion != NO_CONVERSION and conversion and not conversion & 1 and conversion <= value + 1:
+                        continue # a capture or promotion wins as fast, it is already pending
+                    values[pred] = value + 1
+                    pending.setdefault(plies + 1, []).append((pred, value + 1))
+                    continue
+                counts[pred] -= 1
+                if counts[pred]:
+                    continue
+                conversion = conversions[pred]
+                if conversion == NO_CONVERSION:
+                    lossPlies = plies + 1
+                elif conversion & 1: # the slowest loss, through this position or out of the table
+                    lossPlies = max(plies + 1, conversion - 1)
+                else:
+                    continue # a capture or promotion holds the draw
+                pending.setdefault(lossPlies, []).append((pred, lossPlies + 1))
+
+    path = os.path.join(directory, name + ".tb")
+    with open(path + ".tmp", "wb") as f:
+        f.write(values)
+    os.replace(path + ".tmp", path)
+    white = values[:size]
+    wins = sum(1 for value in white if value and value != INVALID and not value & 1)
+    losses = sum(1 for value in white if value != INVALID and value & 1)
+    draws = sum(1 for value in white if value == 0)
+    if log is not None:
+        longest = max((value for value in values if value != INVALID), default=0)
+        print("%s: %d wins, %d draws, %d losses with white to move, longest mate %d plies, %.1fs"
+              % (name, wins, draws, losses, max(longest - 1, 0), time.perf_counter() - start), file=log)
+    return wins, draws, losses
+
+# checks every position of the table for name in directory against the values of its moves, a position has to hold the
+# best result over them. Returns [(position, stored value, best value)] of the positions that do not, some per chunk
+def verify(name, directory, workers=1, log=sys.stderr):
+    start = time.perf_counter()
+    wrong = [entry for part in _runChunks(_verifyChunk, name, directory, Layout(name).size * 2, workers)
+             for entry in part]
+    if log is not None:
+        print("%s: %s, %.1fs" % (name, "%d+ wrong values, first at position %d" % (len(wrong), wrong[0][0]) if wrong
+                                 else "every value verified", time.perf_counter() - start), file=log)
+    return wrong
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate or probe endgame tablebases")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("generate", help="build tables and the smaller ones they need")
+    build.add_argument("names", nargs="*", help="material sets such as KRvK or KQvKR")
+    build.add_argument("--all", type=int, choices=[3, 4], default=None, help="every table with this many pieces")
+    build.add_argument("--dir", default="tablebases")
+    build.add_argument("--workers", type=int, default=os.cpu_count())
+    build.add_argument("--verify", action="store_true", help="check every table built against the moves of each position")
+    check = commands.add_parser("verify", help="check finished tables against the moves of each position")
+    check.add_argument("names", nargs="+")
+    check.add_argument("--dir", default="tablebases")
+    check.add_argument("--workers", type=int, default=os.cpu_count())
+    probe = commands.add_parser("probe", help="look a position up")
+    probe.add_argument("--dir", default="tablebases")
+    probe.add_argument("--fen", default=ChessEngine.START_FEN)
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        names = list(args.names)
+        if args.all is not None:
+            names += [name for pieces in range(3, args.all + 1) for name in allNames(pieces)]
+        for name in names:
+            canonical = materialName(_counts(*name.upper().split("V")))[0]
+            if not os.path.exists(os.path.join(args.dir, canonical + ".tb")):
+                generate(canonical, args.dir, args.workers)
+            if args.verify and verify(canonical, args.dir, args.workers):
+                return 1
+        return 0
+
+    if args.command == "verify":
+        failed = False
+        for name in args.names:
+            failed |= bool(verify(materialName(_counts(*name.upper().split("V")))[0], args.dir, args.workers))
+        return 1 if failed else 0
+
+    tables = Tablebases(args.dir)
+    gs = ChessEngine.GameState(fen=args.fen)
+    start = time.perf_counter()
+    result = tables.probe(gs)
+    seconds = time.perf_counter() - start
+    if result is None:
+        print("not in the tablebases")
+        return 1
+    wdl, plies = result
+    text = "draw" if wdl == 0 else "%s, mate in %d plies" % ("win" if wdl > 0 else "loss", plies)
+    print("%s (%.1fus)" % (text, seconds * 1e6))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
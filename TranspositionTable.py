@@ -0,0 +1,86 @@
+"""
+Fixed size transposition table for the search. Every entry is two unsigned 64-bit words, the position key XORed with
+the data word and the data word itself, so the table takes exactly 16 bytes per entry and an entry torn by a
+concurrent writer just fails the key check instead of returning someone else's data.
+
+Data word layout: move in bits 0-23, score + 32768 in bits 24-39, depth in bits 40-47, bound in bits 48-49 and the
+search age in bits 50-55.
+"""
+from array import array
+
+EXACT, LOWER, UPPER = 1, 2, 3 # bound types, LOWER means the score is at least the stored value (a beta cutoff)
+ENTRY_BYTES = 16
+
+
+# largest power of two number of entries that fits in sizeMb
+def entriesFor(sizeMb):
+    entries = 1
+    while entries * 2 * ENTRY_BYTES <= sizeMb * 1024 * 1024:
+        entries *= 2
+    return entries
+
+
+class TranspositionTable():
+    # sizeMb is rounded down to a power of two number of entries. buffer can be any writable buffer of the right
+    # size (e.g. shared memory) to back the table with instead of a private array
+    def __init__(self, sizeMb=16, buffer=None):
+        entries = entriesFor(sizeMb)
+        self.size = entries
+        self.mask = entries - 1
+        if buffer is None:
+            self.table = array('Q', bytes(entries * ENTRY_BYTES))
+        else:
+            self.table = memoryview(buffer).cast('B')[:entries * ENTRY_BYTES].cast('Q')
+        self.age = 0
+        self.probes = 0
+        self.hits = 0
+
+    def sizeBytes(self):
+        return self.size * ENTRY_BYTES
+
+    def clear(self):
+        self.table[:] = array('Q', bytes(len(self.table) * 8))
+        self.age = 0
+        self.resetStats()
+
+    # call once per search so entries from earlier searches are the first to be replaced. Tables sharing one buffer
+    # pass the same age in so they agree on which entries are current
+    def newSearch(self, age=None):
+        self.age = (self.age + 1) & 63 if age is None else age & 63
+
+    def resetStats(self):
+        self.probes = 0
+        self.hits = 0
+
+    # returns (move, score, depth, bound) for key, or None if the table holds nothing for it
+    def probe(self, key):
+        self.probes += 1
+        i = (key & self.mask) << 1
+        data = self.table[i + 1]
+        if data == 0 or self.table[i] ^ data != key:
+            return None
+        self.hits += 1
+        return data & 0xFFFFFF, ((data >> 24) & 0xFFFF) - 32768, (data >> 40) & 0xFF, (data >> 48) & 3
+
+    # keeps the existing entry only if it is for another position from the current search and was searched deeper
+    def store(self, key, move, score, depth, bound):
+        table = self.table
+        i = (key & self.mask) << 1
+        old = table[i + 1]
+        if old and (old >> 50) == self.age and (old >> 40) & 0xFF > depth and table[i] ^ old != key:
+            return
+        if not move and old and table[i] ^ old == key:
+            move = old & 0xFFFFFF # keep the best move we already knew about
+        data = move | (score + 32768) << 24 | depth << 40 | bound << 48 | self.age << 50
+        table[i] = key ^ data
+        table[i + 1] = data
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    # permille of a sample of entries used by the current search, as reported by UCI hashfull
+    def hashfull(self):
+        sample = min(1000, self.size)
+        table = self.table
+        used = sum(1 for i in range(sample) if table[2 * i + 1] and table[2 * i + 1] >> 50 == self.age)
+        return used * 1000 // sample
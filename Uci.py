@@ -0,0 +1,268 @@
+"""
+Universal Chess Interface front-end, so GUIs and tournament managers (cutechess-cli, Arena, ...) can run the engine
+headless. Commands are read from stdin on the main thread and searches run on a background thread, so info lines are
+written as every depth completes and stop, isready and quit are answered while a search is running.
+
+Supported: uci, isready, ucinewgame, setoption (Hash, Threads, Ponder), position [startpos | fen <fen>] [moves ...],
+go [depth | movetime | nodes | wtime btime winc binc movestogo | infinite | ponder | searchmoves ...], ponderhit,
+stop, quit.
+
+python Uci.py
+cutechess-cli -engine cmd="python Uci.py" -engine cmd=other -each proto=uci tc=40/60 -games 10
+"""
+import copy
+import os
+import sys
+import threading
+import ChessEngine
+from Search import Searcher, MAX_PLY
+
+ENGINE_NAME = "PyChess"
+ENGINE_AUTHOR = "PyChess developers"
+DEFAULT_HASH_MB = 16
+MAX_HASH_MB = 1024
+MAX_THREADS = os.cpu_count() or 1
+MOVE_OVERHEAD = 0.05 # seconds kept back from every move for the GUI and the pipes
+DEFAULT_MOVES_TO_GO = 30 # moves the remaining clock time is shared between when the GUI does not say
+STOP_POLL = 0.01 # seconds between stop requests while waiting for the search thread
+
+
+# UCI score string of a SearchResult
+def uciScore(result):
+    return "mate %d" % result.mateIn() if result.isMate() else "cp %d" % result.score
+
+def infoLine(result):
+    return ("info depth %d score %s nodes %d nps %d time %d hashfull %d pv %s"
+            % (result.depth, uciScore(result), result.nodes, result.nps, int(result.seconds * 1000), result.hashfull,
+               " ".join(move.getChessNotation() for move in result.pv)))
+
+# Seconds to spend on a move from the go clock parameters (milliseconds), None when there is no clock to go by
+def timeForMove(params, whiteToMove):
+    if "movetime" in params:
+        return max(params["movetime"] / 1000 - MOVE_OVERHEAD, 0.01)
+    left = params.get("wtime" if whiteToMove else "btime")
+    if left is None:
+        return None
+    increment = params.get("winc" if whiteToMove else "binc", 0)
+    movesToGo = params.get("movestogo", DEFAULT_MOVES_TO_GO)
+    budget = left / max(movesToGo, 1) + increment * 3 / 4
+    return max(min(budget, left / 2) / 1000 - MOVE_OVERHEAD, 0.01)
+
+# splits the arguments of go into {name: int} and the list of searchmoves
+def parseGo(args):
+    params, searchMoves = {}, []
+    i = 0
+    while i < len(args):
+        name = args[i]
+        if name in ("infinite", "ponder"):
+            params[name] = True
+        elif name == "searchmoves":
+            searchMoves = args[i + 1:]
+            break
+        elif i + 1 < len(args):
+            try:
+                params[name] = int(args[i + 1])
+            except ValueError:
+                pass
+            i += 1
+        i += 1
+    return params, searchMoves
+
+
+class UciEngine():
+    # output is called with every line to send to the GUI, from the reading thread and from the search thread
+    def __init__(self, output=None):
+        self.output = output or self.write
+        self.outputLock = threading.Lock()
+        self.hashMb = DEFAULT_HASH_MB
+        self.threads = 1
+        self.searcher = None # made on first use, so answering uci does not wait for the table to be allocated
+        self.parallel = None # ParallelSearch.ParallelSearcher when Threads is above 1
+        self.gs = ChessEngine.GameState(fen=ChessEngine.START_FEN)
+        self.thread = None
+        self.waitForStop = False # infinite and ponder searches hold their bestmove until stop or ponderhit
+        self.released = threading.Event()
+        self.pondering = False
+        self.ponderTime = None # seconds a ponder search gets once ponderhit arrives, None to run until it is done
+        self.timer = None
+
+    def write(self, line):
+        with self.outputLock:
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+
+    # handles one line from the GUI, returns False once the engine should exit
+    def handle(self, line):
+        words = line.split()
+        if not words:
+            return True
+        command, args = words[0], words[1:]
+        if command == "uci":
+            self.output("id name " + ENGINE_NAME)
+            self.output("id author " + ENGINE_AUTHOR)
+            self.output("option name Hash type spin default %d min 1 max %d" % (DEFAULT_HASH_MB, MAX_HASH_MB))
+            self.output("option name Threads type spin default 1 min 1 max %d" % MAX_THREADS)
+            self.output("option name Ponder type check default false")
+            self.output("uciok")
+        elif command == "isready":
+            self.output("readyok")
+        elif command == "setoption":
+            self.stop()
+            self.setOption(args)
+        elif command == "ucinewgame":
+            self.stop()
+            if self.searcher is not None:
+                self.searcher.tt.clear()
+        elif command == "position":
+            self.stop()
+            self.setPosition(args)
+        elif command == "go":
+            self.stop()
+            self.go(args)
+        elif command == "ponderhit":
+            self.ponderHit()
+        elif command == "stop":
+            self.stop()
+        elif command == "quit":
+            self.stop()
+            if self.parallel is not None:
+                self.parallel.close()
+            return False
+        else:
+            self.output("info string unknown command " + command)
+        return True
+
+    # setoption name <name> value <value>, names are case insensitive
+    def setOption(self, args):
+        text = " ".join(args)
+        name, _, value = text.partition(" value ")
+        name = name.replace("name", "", 1).strip().lower()
+        value = value.strip()
+        try:
+            if name == "hash":
+                self.hashMb = min(max(int(value), 1), MAX_HASH_MB)
+                self.searcher = None
+                self.closeParallel()
+            elif name == "threads":
+                self.threads = min(max(int(value), 1), MAX_THREADS)
+                self.closeParallel()
+            elif name != "ponder": # pondering only needs go ponder, the option just tells the GUI it may send it
+                self.output("info string unknown option " + name)
+        except ValueError:
+            self.output("info string invalid value for " + name)
+
+    def closeParallel(self):
+        if self.parallel is not None:
+            self.parallel.close()
+            self.parallel = None
+
+    def setPosition(self, args):
+        if "moves" in args:
+            split = args.index("moves")
+            setup, moves = args[:split], args[split + 1:]
+        else:
+            setup, moves = args, []
+        try:
+            if setup[:1] == ["fen"]:
+                gs = ChessEngine.GameState(fen=" ".join(setup[1:]))
+            else:
+                gs = ChessEngine.GameState(fen=ChessEngine.START_FEN)
+            for move in moves:
+                gs.makeMove(gs.moveFromUci(move))
+        except ValueError as e:
+            self.output("info string " + str(e))
+            return
+        self.gs = gs
+
+    def go(self, args):
+        params, searchMoves = parseGo(args)
+        rootMoves = None
+        if searchMoves: # invalid entries are reported and left out, the others are still searched
+            rootMoves = []
+            for move in searchMoves:
+                try:
+                    rootMoves.append(int(self.gs.moveFromUci(move)))
+                except ValueError as e:
+                    self.output("info string " + str(e))
+        seconds = timeForMove(params, self.gs.whiteToMove)
+        pondering = params.get("ponder", False)
+        self.waitForStop = pondering or params.get("infinite", False)
+        self.pondering = pondering
+        self.ponderTime = seconds
+        self.released.clear()
+        limits = (params.get("depth", MAX_PLY - 1), None if self.waitForStop else seconds, params.get("nodes"))
+        # the search thread gets its own copy, the next position command must not change the board it searches
+        self.thread = threading.Thread(target=self.searchThread, args=(copy.deepcopy(self.gs), limits, rootMoves),
+                                       daemon=True)
+        self.thread.start()
+
+    def searchThread(self, gs, limits, rootMoves):
+        maxDepth, seconds, nodes = limits
+        info = lambda result: self.output(infoLine(result))
+        if rootMoves == []: # no searchmoves entry was a legal move, there is nothing to search
+            result = None
+        elif self.threads > 1 and rootMoves is None:
+            if self.parallel is None:
+                from ParallelSearch import ParallelSearcher # not needed by single threaded searches
+                self.parallel = ParallelSearcher(self.threads, self.hashMb)
+            result = self.parallel.search(gs, maxDepth, seconds, nodes, info=info)
+        else:
+            if self.searcher is None:
+                self.searcher = Searcher(self.hashMb)
+            result = self.searcher.search(gs, maxDepth, seconds, nodes, info=info, rootMoves=rootMoves)
+        if self.waitForStop:
+            self.released.wait() # the GUI has to ask for the move of an infinite or ponder search
+        if result is None or result.bestMove is None:
+            self.output("bestmove 0000")
+        elif len(result.pv) > 1:
+            self.output("bestmove %s ponder %s" % (result.bestMove.getChessNotation(), result.pv[1].getChessNotation()))
+        else:
+            self.output("bestmove " + result.bestMove.getChessNotation())
+
+    # the opponent played the move we were pondering on, carry on searching on our own clock
+    def ponderHit(self):
+        if self.thread is None or not self.pondering:
+            return
+        self.pondering = False
+        self.waitForStop = False
+        self.released.set()
+        if self.ponderTime is not None:
+            self.timer = threading.Timer(self.ponderTime, self.stopSearch)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def stopSearch(self):
+        if self.searcher is not None:
+            self.searcher.stop()
+        if self.parallel is not None:
+            self.parallel.stop()
+
+    # Stops a running search and waits until its bestmove has been written. The stop is repeated until the thread
+    # ends, a search that was only just starting resets the stop request it got before it began
+    def stop(self):
+        if self.thread is None:
+            return
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.pondering = False
+        self.released.set()
+        while self.thread.is_alive():
+            self.stopSearch()
+            self.thread.join(STOP_POLL)
+        self.thread = None
+
+
+def main(argv=None):
+    engine = UciEngine()
+    for line in iter(sys.stdin.readline, ""):
+        if not engine.handle(line):
+            break
+    else: # end of input, a search that ends on its own still gets to print its move
+        if engine.thread is not None and not engine.waitForStop:
+            engine.thread.join()
+        engine.handle("quit")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,16 @@
+"""
+Random 64-bit keys for Zobrist hashing. A position's key is the XOR of the keys of everything in it, so GameState can
+update it in makeMove/undoMove by XORing out what changed. The keys come from a fixed seed so they, and every stored
+hash, are the same on every run.
+"""
+import random
+
+_rng = random.Random(0x5EED)
+
+def _key():
+    return _rng.getrandbits(64)
+
+PIECE_KEYS = [[_key() for sq in range(64)] for piece in range(12)] # indexed [piece][square] like Bitboards
+SIDE_KEY = _key() # XORed in when black is to move
+CASTLING_KEYS = [_key() for rights in range(16)] # indexed by the castling rights bitmask from GameState
+EP_KEYS = [_key() for col in range(8)] # en passant file, only hashed when a capture is actually possible